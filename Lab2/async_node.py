@@ -0,0 +1,1014 @@
+import argparse
+import asyncio
+import inspect
+import itertools
+import json
+import random
+import threading
+import time
+import xmlrpc.client
+from collections import deque
+from socketserver import ThreadingMixIn
+from xmlrpc.server import SimpleXMLRPCServer
+
+from binary_transport import BINARY_PORT_OFFSET, FAULT, FRAME_HEADER, REQUEST, RESPONSE, decode_request, encode_request
+from kv import KVStateMachine
+from log_store import LogEntry, LogSlice, LogStore
+from node import (NODES, APPLY_TIMEOUT, APPLY_BATCH_ENTRIES, APPEND_MAX_ENTRIES, CHECK_QUORUM, ELECTION_TIMEOUT_MIN,
+                  ELECTION_TIMEOUT_MAX, FRESHNESS_HISTORY, LEARNERS, LEARNER_REPLICATION_INTERVAL, PRE_VOTE, LEASE_CLOCK_DRIFT, NOOP_COMMAND, READ_MODE, READ_MODES, RPC_BACKOFF, RPC_MAX_BACKOFF,
+                  RPC_TIMEOUT, SNAPSHOT_THRESHOLD, STATE_MACHINES, VOTE_TIMEOUT, WAL_FSYNC_INTERVAL, WAL_FSYNC_POLICY,
+                  WAL_SEGMENT_SIZE, Node, QuietXMLRPCRequestHandler, is_internal_command)
+from metrics import Histogram
+from snapshot import SnapshotStore
+from transport import ReconnectBackoff
+from wal import FSYNC_POLICIES, SegmentedWAL
+
+
+DEFAULT_GROUP = "default"  # Group served for RPCs without a "group." prefix, so plain clients and nodes still work
+HEARTBEAT_INTERVAL = 0.1
+
+# Methods a host exposes for each group, over the binary protocol and XML-RPC alike
+RPC_METHODS = {
+    "vote",
+    "pre_vote",
+    "timeout_now",
+    "receive_heartbeat",
+    "receive_append_entries",
+    "install_snapshot",
+    "submit_value",
+    "submit_values",
+    "read",
+    "read_local",
+    "is_leader",
+    "get_leader",
+    "get_metrics",
+    "get_log_length",
+    "get_heartbeat_interval",
+    "set_heartbeat_interval",
+    "set_replication_simulation",
+    "delete_log_file",
+}
+
+
+async def read_frame(reader):
+    length, kind, request_id = FRAME_HEADER.unpack(await reader.readexactly(FRAME_HEADER.size))
+    return kind, request_id, await reader.readexactly(length)
+
+
+def write_frame(writer, kind, request_id, body):
+    writer.write(FRAME_HEADER.pack(len(body), kind, request_id) + body)
+
+
+class AsyncConnection:
+    """One binary-protocol stream to another host, shared by every group the two hosts have in common.
+
+    Calls are multiplexed by request id like binary_transport.BinaryConnection, but a reader
+    task resolves the callers' futures instead of a reader thread waking blocked callers.
+    Arguments are encoded before the call first yields, so passing a LogSlice view of the
+    log is safe.
+    """
+
+    def __init__(self, peer, address, timeout=RPC_TIMEOUT, backoff=RPC_BACKOFF, max_backoff=RPC_MAX_BACKOFF):
+        self.peer = peer
+        self.address = address
+        self.timeout = timeout
+        self.backoff = ReconnectBackoff(backoff, max_backoff)
+        self.writer = None
+        self.connecting = asyncio.Lock()
+        self.pending = {}
+        self.ids = itertools.count(1)
+
+    async def call(self, method, args):
+        self.backoff.check(self.peer)
+        body = encode_request(method, args)
+        writer = await self.connect()
+        request_id = next(self.ids) & 0xFFFFFFFF
+        reply = asyncio.get_running_loop().create_future()
+        self.pending[request_id] = reply
+        try:
+            write_frame(writer, REQUEST, request_id, body)
+            return await asyncio.wait_for(reply, self.timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"No reply from {self.peer} to {method} within {self.timeout}s.") from None
+        finally:
+            self.pending.pop(request_id, None)
+
+    async def connect(self):
+        async with self.connecting:
+            if self.writer is None:
+                try:
+                    reader, writer = await asyncio.wait_for(asyncio.open_connection(*self.address), self.timeout)
+                except OSError:
+                    self.backoff.failed()
+                    raise
+                self.backoff.succeeded()
+                self.writer = writer
+                asyncio.create_task(self.read_replies(reader, writer))
+            return self.writer
+
+    async def read_replies(self, reader, writer):
+        try:
+            while True:
+                kind, request_id, body = await read_frame(reader)
+                reply = self.pending.pop(request_id, None)
+                if reply is None or reply.done():
+                    continue  # The caller gave up waiting
+                if kind == FAULT:
+                    reply.set_exception(xmlrpc.client.Fault(1, body.decode()))
+                else:
+                    reply.set_result(json.loads(body))
+        except (OSError, asyncio.IncompleteReadError) as e:
+            self.disconnect(writer, e)
+
+    def disconnect(self, writer, error):
+        """Close `writer` and fail every call waiting on it."""
+        if self.writer is writer:
+            self.writer = None
+            self.backoff.failed()
+        writer.close()
+        pending, self.pending = self.pending, {}
+        for reply in pending.values():
+            if not reply.done():
+                reply.set_exception(ConnectionResetError(f"Connection to {self.peer} lost: {error}"))
+
+    def close(self):
+        if self.writer is not None:
+            self.disconnect(self.writer, "closed")
+
+
+class AsyncProxy:
+    """ServerProxy look-alike for one group on another host: `await proxy.method(*args)`."""
+
+    def __init__(self, connection, group):
+        self.connection = connection
+        self.prefix = "" if group == DEFAULT_GROUP else f"{group}."
+
+    def __getattr__(self, method):
+        async def call(*args):
+            return await self.connection.call(self.prefix + method, list(args))
+        return call
+
+
+class AsyncNode:
+    """One member of a Raft group, run entirely as coroutines on its host's event loop.
+
+    Serves the same RPCs as node.Node. There are no threads and no locks: RPC handlers,
+    the election timer, one replicator per follower and the applier are tasks on the one
+    loop, so state only changes between awaits. Handlers that never await are plain
+    methods and run to completion in one step. Log indexing is shared with node.Node.
+
+    `learners` are replicas that get the log but never vote or count toward commits; a
+    learner member itself never campaigns. Both lists are fixed for the group's lifetime.
+    """
+
+    log_start = Node.log_start
+    last_log_index = Node.last_log_index
+    term_at = Node.term_at
+    first_index_of_term = Node.first_index_of_term
+    last_index_of_term = Node.last_index_of_term
+    entry_at = Node.entry_at
+    load_snapshot = Node.load_snapshot
+    load_log_from_file = Node.load_log_from_file
+    append_entries_reply = Node.append_entries_reply
+    read_reply = Node.read_reply
+    query_reply = Node.query_reply
+    follow_leader = Node.follow_leader
+    known_leader = Node.known_leader
+    log_up_to_date = Node.log_up_to_date
+    grants_pre_vote = Node.grants_pre_vote
+    get_metrics = Node.get_metrics
+
+    def __init__(self, host, group, peers, segment_size=WAL_SEGMENT_SIZE, fsync_policy=WAL_FSYNC_POLICY,
+                 fsync_interval=WAL_FSYNC_INTERVAL, snapshot_threshold=SNAPSHOT_THRESHOLD, state_machine=None,
+                 append_max_entries=APPEND_MAX_ENTRIES, read_mode=READ_MODE, pre_vote=PRE_VOTE, check_quorum=CHECK_QUORUM,
+                 learners=(), learner_interval=LEARNER_REPLICATION_INTERVAL, wal=None, log_dir="./logs"):
+        self.host = host
+        self.group = group
+        self.name = host.name
+        self.peers = [peer for peer in peers if peer != self.name]  # Voters besides us
+        self.learners = [learner for learner in learners if learner != self.name and learner not in self.peers]
+        self.is_learner = self.name in learners
+        self.learner_interval = learner_interval
+        self.current_term = 0
+        self.voted_for = None
+        self.role = "follower"
+        self.is_leader_flag = False
+        self.last_leader_contact = time.time()  # When we last accepted a heartbeat or entries from a leader, or booted; see node.py
+        self.leader_id = None  # Who led leader_term, learnt from its heartbeats and entries
+        self.leader_term = -1
+        self.heartbeat_interval = HEARTBEAT_INTERVAL
+        self.append_max_entries = append_max_entries
+        self.read_mode = read_mode
+        self.lease_duration = ELECTION_TIMEOUT_MIN * (1 - LEASE_CLOCK_DRIFT)
+        self.pre_vote_enabled = pre_vote
+        self.check_quorum_enabled = check_quorum
+        self.leader_since = 0.0
+        self.elections_started = 0
+        self.elections_won = 0
+        self.election_seconds = Histogram()  # From the timeout firing to leading, for elections we won
+        self.election = None  # Task running our current (pre-)vote round, if any
+        self.simulate_replication_failure = False
+        self.batched_heartbeats = False  # Set when the host sends heartbeats for all its groups at once
+
+        # Leader state, reset by start_leader()
+        self.next_index = {}
+        self.match_index = {}
+        self.acked_at = {}  # peer -> send time of the latest request it accepted from us as leader
+        self.replicators = {}  # peer -> replicator task while we lead
+        self.log_grown = {}  # peer -> Event set when that replicator has something new to send
+        self.noop_index = -1
+
+        self.commit_index = -1
+        self.last_applied = -1
+        self.written_index = -1  # Last index handed to the WAL; replicators send up to here
+        self.persisted_index = -1  # Last index durable in our WAL; counts as our own replica
+        self.unpersisted = []  # Entries appended by clients this loop iteration, written by flush_appends()
+        self.pending_results = {}  # log index -> (term, Future) for entries submitted to this leader
+        self.commit_seen = deque(maxlen=FRESHNESS_HISTORY)  # (time, leader commit index) not yet applied
+        self.fresh_as_of = 0.0
+
+        self.leader_contact = asyncio.Event()  # Set whenever something resets the election timer
+        self.commit_advanced = asyncio.Event()  # Wakes the applier
+        self.progress = asyncio.Event()  # Replaced and set whenever reads may be able to proceed
+        self.tasks = []
+
+        # One snapshot and, unless the host shares one WAL between its groups, one WAL per group.
+        # The default group uses the same files as node.Node.
+        prefix = self.name if group == DEFAULT_GROUP else f"{self.name}.{group}"
+        self.state_machine = state_machine or KVStateMachine()
+        self.snapshots = SnapshotStore(f"{log_dir}/{prefix}.snapshot")
+        self.snapshot_threshold = snapshot_threshold
+        self.snapshot_index = -1
+        self.snapshot_term = 0
+        self.load_snapshot()
+        self.LOG_FILE = f"{log_dir}/{prefix}.log"  # Legacy text log, imported once if present
+        self.WAL_DIR = f"{log_dir}/{prefix}"
+        self.wal = wal or SegmentedWAL(self.WAL_DIR, segment_size=segment_size, fsync_policy=fsync_policy, fsync_interval=fsync_interval)
+        self.log = self.load_log_from_file()
+        self.written_index = self.persisted_index = self.last_log_index()
+
+    def start(self):
+        self.tasks = [asyncio.create_task(self.run_election_timer()), asyncio.create_task(self.run_applier())]
+
+    def stop(self):
+        self.stop_replicators()
+        for task in self.tasks:
+            task.cancel()
+        if self.election is not None:
+            self.election.cancel()
+        self.wal.close()
+
+    def rpc(self, peer):
+        return self.host.proxy(peer, self.group)
+
+    # Elections
+
+    async def run_election_timer(self):
+        """Start an election whenever a randomized timeout passes without hearing from a leader.
+
+        A leader uses the same timer to check that a majority still acknowledges it.
+        """
+        while True:
+            self.leader_contact.clear()
+            timeout = random.uniform(ELECTION_TIMEOUT_MIN, ELECTION_TIMEOUT_MAX)
+            try:
+                await asyncio.wait_for(self.leader_contact.wait(), timeout)
+            except asyncio.TimeoutError:
+                if self.is_learner:
+                    continue  # Learners never campaign
+                if self.role != "leader":
+                    await asyncio.wait([self.begin_election()])
+                elif self.check_quorum_enabled and time.time() - max(self.leader_since, self.leadership_confirmed_at()) > timeout:
+                    print(f"{self.name}/{self.group} has not heard from a majority; stepping down.")
+                    self.step_down(self.current_term)
+
+    def begin_election(self, transfer=False):
+        """Start an election task unless one is running, and return the running task.
+
+        An election the leader asked for with TimeoutNow (`transfer`) cancels a timer-driven
+        round still in progress: that round's pre-vote would fail while the other nodes
+        still count the old leader as alive.
+        """
+        if self.election is not None and not self.election.done():
+            if not transfer:
+                return self.election
+            self.election.cancel()
+        self.election = asyncio.create_task(self.start_election(transfer))
+        return self.election
+
+    async def start_election(self, transfer=False):
+        """Pre-vote, then a real election if a majority would vote for us; see node.Node.start_election."""
+        self.elections_started += 1
+        started = time.time()
+        if self.pre_vote_enabled and not transfer:
+            term = self.current_term + 1
+            if not await self.collect_votes("pre_vote", term):
+                return
+            if self.role == "leader" or self.current_term >= term or self.last_leader_contact > started:
+                return  # A leader or a newer term turned up while we asked
+        if await self.request_vote(transfer):
+            self.elections_won += 1
+            self.election_seconds.observe(time.time() - started)
+
+    async def request_vote(self, transfer=False):
+        """Ask every peer for its vote at once and lead as soon as a majority grants it; returns whether we won."""
+        self.current_term += 1
+        term = self.current_term
+        self.role = "candidate"
+        self.voted_for = self.name
+        print(f"{self.name}/{self.group} is requesting votes for term {term}")
+        won = await self.collect_votes("vote", term, transfer)
+        if not won or self.role != "candidate" or self.current_term != term:
+            return False
+        self.start_leader()
+        return True
+
+    async def collect_votes(self, method, term, transfer=False):
+        """Send `method` (vote or pre_vote) for `term` to every peer at once; True as soon as a majority, counting us, grants it."""
+        last_log_index = self.last_log_index()
+        last_log_term = self.term_at(last_log_index)
+        votes = 1
+        args = (self.name, term, last_log_term, last_log_index) + ((True,) if transfer else ())
+        pending = {asyncio.create_task(getattr(self.rpc(peer), method)(*args)) for peer in self.peers}
+        deadline = time.time() + VOTE_TIMEOUT
+        try:
+            while pending and votes <= (len(self.peers) + 1) // 2 and time.time() < deadline:
+                done, pending = await asyncio.wait(pending, timeout=deadline - time.time(), return_when=asyncio.FIRST_COMPLETED)
+                for request in done:
+                    try:
+                        votes += bool(request.result())
+                    except (OSError, xmlrpc.client.Error):
+                        pass  # A peer that fails in any way counts as a refusal
+        finally:
+            for request in pending:
+                request.cancel()  # Also when a TimeoutNow cancels this round
+        return votes > (len(self.peers) + 1) // 2
+
+    def pre_vote(self, candidate, term, last_log_term, last_log_index):
+        """Answer a PreVote without changing any state; see node.Node.pre_vote."""
+        return self.grants_pre_vote(term, last_log_term, last_log_index)
+
+    def timeout_now(self, term, leader_id):
+        """TimeoutNow from the leader of `term`: start an election at once; see node.Node.timeout_now."""
+        if term != self.current_term or self.is_leader_flag or self.is_learner:
+            return False
+        self.leader_contact.set()  # Restart our own timer so it does not race the election
+        self.begin_election(transfer=True)
+        return True
+
+    def vote(self, candidate, term, last_log_term, last_log_index, transfer=False):
+        """Vote for a candidate whose term is current and whose log is at least as up-to-date as ours."""
+        if term < self.current_term:
+            return False
+        if not transfer and self.role == "follower" and time.time() - self.last_leader_contact < ELECTION_TIMEOUT_MIN:
+            return False  # Our leader is alive and may be serving lease reads
+        if term > self.current_term:
+            self.step_down(term)
+
+        my_last_log_index = self.last_log_index()
+        my_last_log_term = self.term_at(my_last_log_index)
+        if last_log_term < my_last_log_term or (last_log_term == my_last_log_term and last_log_index < my_last_log_index):
+            return False
+        if self.voted_for in (None, candidate):
+            self.voted_for = candidate
+            self.leader_contact.set()
+            print(f"{self.name}/{self.group}: Vote granted to {candidate} for term {term}")
+            return True
+        return False
+
+    def step_down(self, term):
+        """Fall back to follower in `term`, forgetting our vote if the term is new."""
+        if term > self.current_term:
+            self.current_term = term
+            self.voted_for = None
+        self.role = "follower"
+        self.is_leader_flag = False
+        self.stop_replicators()
+
+    def start_leader(self):
+        self.role = "leader"
+        self.is_leader_flag = True
+        self.leader_since = time.time()
+        print(f"{self.name} is now the leader of {self.group} for term {self.current_term}.")
+        self.next_index = {peer: self.last_log_index() + 1 for peer in self.peers + self.learners}
+        self.match_index = {peer: -1 for peer in self.peers + self.learners}
+        self.acked_at = {peer: 0.0 for peer in self.peers}  # Only voters confirm our leadership
+
+        # Commit an entry from our own term straight away, as node.Node does
+        self.append_commands([NOOP_COMMAND])
+        self.noop_index = self.last_log_index()
+
+        self.log_grown = {peer: asyncio.Event() for peer in self.peers + self.learners}
+        self.replicators = {peer: asyncio.create_task(self.replicate(peer, self.current_term)) for peer in self.peers + self.learners}
+
+    def stop_replicators(self):
+        for replicator in self.replicators.values():
+            replicator.cancel()
+        self.replicators = {}
+
+    # Replication, leader side
+
+    def append_commands(self, commands):
+        """Append client commands to the log and return a Future per command, resolved once it is applied.
+
+        Commands appended during the same loop iteration share one WAL write in flush_appends().
+        """
+        term = self.current_term
+        first_index = self.last_log_index() + 1
+        entries = [LogEntry(term, command) for command in commands]
+        self.log.extend(entries)
+        if not self.unpersisted:
+            asyncio.get_running_loop().call_soon(self.flush_appends)
+        self.unpersisted.extend(entries)
+
+        futures = []
+        for index in range(first_index, first_index + len(entries)):
+            future = asyncio.get_running_loop().create_future()
+            self.pending_results[index] = (term, future)
+            futures.append(future)
+        return futures
+
+    def flush_appends(self):
+        entries, self.unpersisted = self.unpersisted, []
+        if not self.is_leader_flag or self.written_index + len(entries) != self.last_log_index():
+            self.drop_unwritten()  # Lost leadership before the entries reached the WAL
+            return
+        # A shared WAL hands back a future that resolves once the write is durable; a WAL of our own
+        # writes synchronously. Followers get the entries meanwhile, but we only count ourselves once durable.
+        durable = self.wal.append([(entry.term, entry.command) for entry in entries])
+        self.written_index = self.last_log_index()
+        self.notify_replicators()
+        if durable is None:
+            self.entries_persisted(self.current_term, self.written_index)
+        else:
+            durable.add_done_callback(lambda _, term=self.current_term, index=self.written_index: self.entries_persisted(term, index))
+
+    def drop_unwritten(self):
+        """Remove entries past written_index, which never reached the WAL, and fail their waiters."""
+        del self.log[self.written_index + 1 - self.log_start():]
+        for lost_index in [i for i in self.pending_results if i > self.written_index]:
+            _, future = self.pending_results.pop(lost_index)
+            if not future.done():
+                future.set_exception(RuntimeError(f"Entry at index {lost_index} was dropped: leadership was lost before it was written."))
+
+    def entries_persisted(self, term, index):
+        if self.is_leader_flag and self.current_term == term:
+            self.persisted_index = max(self.persisted_index, index)
+            self.advance_commit_index()
+
+    def notify_replicators(self):
+        for peer, grown in self.log_grown.items():
+            if peer not in self.learners:  # Learners pick new entries up on their own schedule
+                grown.set()
+
+    async def replicate(self, peer, term):
+        """Keep `peer` up to date while we lead `term`: send entries when there are any, a heartbeat otherwise.
+
+        A learner is sent whatever gathered every learner_interval, like replication.LearnerReplicator,
+        and back to back only while it is a full batch or more behind.
+        """
+        proxy = self.rpc(peer)
+        grown = self.log_grown[peer]
+        learner = peer in self.learners
+        while True:
+            grown.clear()
+            try:
+                if self.next_index[peer] < self.log_start():
+                    await self.send_snapshot(peer, proxy, term)
+                elif self.next_index[peer] <= self.written_index and not self.simulate_replication_failure:
+                    await self.send_entries(peer, proxy, term)
+                    if not learner or self.written_index - self.next_index[peer] + 1 >= self.append_max_entries:
+                        continue
+                else:
+                    await self.send_heartbeat(peer, proxy, term)
+            except (OSError, xmlrpc.client.Fault):
+                pass  # Retried on the next heartbeat tick
+            if learner:
+                timeout = min(self.heartbeat_interval, self.learner_interval)
+            else:
+                # With batched heartbeats we only wake for new entries or a read asking for a heartbeat now
+                timeout = None if self.batched_heartbeats else self.heartbeat_interval
+            try:
+                await asyncio.wait_for(grown.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def send_heartbeat(self, peer, proxy, term):
+        sent_at = time.time()
+        if await proxy.receive_heartbeat(term, self.commit_index, self.match_index[peer], self.name):
+            self.acknowledged(peer, sent_at)
+
+    async def send_entries(self, peer, proxy, term):
+        prev_log_index = self.next_index[peer] - 1
+        prev_log_term = self.term_at(prev_log_index)
+        start = self.next_index[peer] - self.log_start()
+        batch = self.log[start:min(start + self.append_max_entries, self.written_index - self.log_start() + 1)]
+        sent_at = time.time()
+        reply = await proxy.receive_append_entries(term, prev_log_index, prev_log_term, batch, self.commit_index, self.name)
+        if reply["term"] > self.current_term:
+            self.step_down(reply["term"])
+            return
+        self.acknowledged(peer, sent_at)
+        if reply["success"]:
+            self.match_index[peer] = max(self.match_index[peer], prev_log_index + len(batch))
+            self.next_index[peer] = self.match_index[peer] + 1
+            self.advance_commit_index()
+        else:
+            self.next_index[peer] = self.backtrack_index(reply, prev_log_index)
+
+    def backtrack_index(self, reply, prev_log_index):
+        """next_index to retry from after a rejection, using the follower's conflict hints like PeerReplicator."""
+        conflict_index = reply["conflict_index"]
+        if conflict_index is None:
+            return max(0, prev_log_index)
+        if reply["conflict_term"] is not None:
+            last_index = self.last_index_of_term(reply["conflict_term"], prev_log_index)
+            if last_index is not None:
+                conflict_index = last_index + 1
+        return max(0, min(conflict_index, prev_log_index))
+
+    async def send_snapshot(self, peer, proxy, term):
+        snapshot = self.snapshots.load()
+        if snapshot is None:
+            return
+        sent_at = time.time()
+        if await proxy.install_snapshot(term, self.name, snapshot["last_included_index"],
+                                        snapshot["last_included_term"], snapshot["state"]):
+            self.acknowledged(peer, sent_at)
+            self.match_index[peer] = max(self.match_index[peer], snapshot["last_included_index"])
+            self.next_index[peer] = self.match_index[peer] + 1
+            print(f"Sent snapshot at index {snapshot['last_included_index']} of {self.group} to {peer}.")
+
+    def acknowledged(self, peer, sent_at):
+        if peer in self.acked_at and sent_at > self.acked_at[peer]:
+            self.acked_at[peer] = sent_at
+            self.notify_progress()
+
+    def advance_commit_index(self):
+        """Commit the highest entry from the current term stored on a majority, counting our persisted log."""
+        cluster_size = len(self.peers) + 1
+        for i in range(self.persisted_index, self.commit_index, -1):
+            if self.term_at(i) != self.current_term:
+                break
+            replicas = 1 + sum(1 for peer in self.peers if self.match_index[peer] >= i)
+            if replicas > cluster_size // 2:
+                self.commit_index = i
+                self.commit_advanced.set()
+                break
+
+    # Replication, follower side
+
+    def receive_heartbeat(self, leader_term, leader_commit=-1, match_index=-1, leader_id=None):
+        """Accept a heartbeat from a current leader; returns True if we do."""
+        if leader_term < self.current_term:
+            return False
+        if leader_term > self.current_term or self.role != "follower":
+            self.step_down(leader_term)
+        self.follow_leader(leader_id)
+        self.last_leader_contact = time.time()
+        self.leader_contact.set()
+        self.follow_commit_index(leader_commit, match_index)
+        return True
+
+    async def receive_append_entries(self, term, prev_log_index, prev_log_term, entries, leader_commit, leader_id=None):
+        """Append the leader's entries after prev_log_index, replying like node.Node.receive_append_entries."""
+        if not isinstance(entries, LogSlice):
+            entries = LogStore(LogEntry.from_string(entry_str) for entry_str in entries)[:]
+        if term < self.current_term:
+            return self.append_entries_reply(False)
+        if term > self.current_term or self.role != "follower":
+            self.step_down(term)
+        self.follow_leader(leader_id)
+        self.last_leader_contact = time.time()
+        self.leader_contact.set()
+
+        if prev_log_index > self.last_log_index():
+            return self.append_entries_reply(False, self.last_log_index() + 1, None)
+        if prev_log_index < self.snapshot_index:
+            # Entries covered by our snapshot are committed and match by definition
+            entries = entries[self.snapshot_index - prev_log_index:]
+            prev_log_index = self.snapshot_index
+            prev_log_term = self.snapshot_term
+        if prev_log_index >= 0 and self.term_at(prev_log_index) != prev_log_term:
+            conflict_term = self.term_at(prev_log_index)
+            conflict_index = self.first_index_of_term(prev_log_index)
+            self.truncate_log(prev_log_index)
+            return self.append_entries_reply(False, conflict_index, conflict_term)
+
+        first_index = prev_log_index + 1
+        held = 0
+        while held < len(entries) and first_index + held <= self.last_log_index():
+            if self.term_at(first_index + held) != entries.terms[held]:
+                self.truncate_log(first_index + held)
+                break
+            held += 1
+        new_entries = entries[held:]
+        durable = None
+        if new_entries:
+            self.log.extend(new_entries)
+            durable = self.wal.append(list(new_entries.records()))
+            self.written_index = self.persisted_index = self.last_log_index()
+        self.follow_commit_index(leader_commit, prev_log_index + len(entries))
+        if durable is not None:
+            await durable  # Only acknowledge entries once they are durable
+        return self.append_entries_reply(True)
+
+    def truncate_log(self, index):
+        del self.log[index - self.log_start():]
+        self.wal.truncate(index)
+        self.written_index = self.persisted_index = min(self.persisted_index, self.last_log_index())
+        for lost_index in [i for i in self.pending_results if i >= index]:
+            _, future = self.pending_results.pop(lost_index)
+            if not future.done():
+                future.set_exception(RuntimeError(f"Entry at index {lost_index} was overwritten by another leader."))
+
+    def follow_commit_index(self, leader_commit, matched_index):
+        """Advance our commit index from the leader's, up to the last entry known to match its log."""
+        new_commit_index = min(leader_commit, matched_index, self.last_log_index())
+        if new_commit_index > self.commit_index:
+            self.commit_index = new_commit_index
+            self.commit_advanced.set()
+        if self.commit_seen and self.commit_seen[-1][1] >= leader_commit:
+            self.commit_seen[-1] = (time.time(), self.commit_seen[-1][1])
+        else:
+            self.commit_seen.append((time.time(), leader_commit))
+        self.update_freshness()
+
+    def update_freshness(self):
+        while self.commit_seen and self.commit_seen[0][1] <= self.last_applied:
+            self.fresh_as_of = max(self.fresh_as_of, self.commit_seen.popleft()[0])
+        self.notify_progress()
+
+    def install_snapshot(self, term, leader_id, last_included_index, last_included_term, state, config=None):
+        """Follower installs a snapshot from a leader that has already compacted the entries it needs.
+
+        `config`, sent by node.Node leaders, is ignored: membership here is fixed.
+        """
+        if term < self.current_term:
+            return False
+        if term > self.current_term or self.role != "follower":
+            self.step_down(term)
+        self.follow_leader(leader_id)
+        self.last_leader_contact = time.time()
+        self.leader_contact.set()
+        if last_included_index <= self.snapshot_index:
+            return True
+
+        self.snapshots.save(last_included_index, last_included_term, state)
+        if last_included_index <= self.last_log_index() and self.term_at(last_included_index) == last_included_term:
+            del self.log[:last_included_index - self.log_start() + 1]
+            self.snapshot_index, self.snapshot_term = last_included_index, last_included_term
+            self.wal.compact(self.log_start())
+        else:
+            self.log = LogStore()
+            self.snapshot_index, self.snapshot_term = last_included_index, last_included_term
+            self.wal.reset(self.log_start())
+        self.written_index = self.persisted_index = self.last_log_index()
+        if last_included_index > self.last_applied:
+            self.state_machine.restore(state)
+            self.last_applied = last_included_index
+        self.commit_index = max(self.commit_index, last_included_index)
+        print(f"{self.name}/{self.group}: Installed snapshot from {leader_id} at index {last_included_index}.")
+        return True
+
+    # Applying
+
+    async def run_applier(self):
+        while True:
+            await self.commit_advanced.wait()
+            self.commit_advanced.clear()
+            while self.last_applied < min(self.commit_index, self.last_log_index()):
+                self.apply_entries_to_state_machine()
+                await asyncio.sleep(0)  # Let RPCs in between large batches
+
+    def apply_entries_to_state_machine(self):
+        end = min(self.commit_index, self.last_log_index(), self.last_applied + APPLY_BATCH_ENTRIES)
+        batch = [(i, self.entry_at(i)) for i in range(self.last_applied + 1, end + 1)]
+        results = iter(self.state_machine.apply_batch([entry for _, entry in batch if not is_internal_command(entry.command)]))
+        for index, entry in batch:
+            result = next(results) if not is_internal_command(entry.command) else None
+            self.last_applied = index
+            term, future = self.pending_results.pop(index, (None, None))
+            if future is None or future.done():
+                continue
+            if term == entry.term:
+                future.set_result(result)
+            else:
+                future.set_exception(RuntimeError(f"Entry at index {index} was overwritten by another leader."))
+        self.update_freshness()
+        if self.snapshot_threshold and self.last_applied - self.snapshot_index >= self.snapshot_threshold:
+            self.take_snapshot()
+
+    def take_snapshot(self):
+        index = self.last_applied
+        term = self.term_at(index)
+        self.snapshots.save(index, term, self.state_machine.snapshot())
+        del self.log[:index - self.log_start() + 1]
+        self.snapshot_index, self.snapshot_term = index, term
+        self.wal.compact(self.log_start())
+
+    # Client RPCs
+
+    async def forward(self, method, *args):
+        """Run a client call on the leader; None if none could be reached. See node.Node.forward."""
+        deadline = time.time() + VOTE_TIMEOUT
+        while True:
+            if self.is_leader_flag:
+                return await getattr(self, method)(*args)
+            leader = self.known_leader()
+            if leader in self.peers:
+                try:
+                    return await getattr(self.rpc(leader), method)(*args)
+                except (OSError, xmlrpc.client.Fault):
+                    print(f"Connection to {leader} failed.")
+            for peer in self.peers:
+                if peer == leader:
+                    continue
+                proxy = self.rpc(peer)
+                try:
+                    if await proxy.is_leader():
+                        return await getattr(proxy, method)(*args)
+                except (OSError, xmlrpc.client.Fault):
+                    print(f"Connection to {peer} failed.")
+            if time.time() >= deadline:
+                return None
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+
+    async def submit_values(self, values):
+        """Submit a batch of values; returns one {index, committed, result, error, leader} per value, like node.Node."""
+        if not self.is_leader_flag:
+            results = await self.forward("submit_values", values)
+            return results or [{"index": None, "committed": False, "result": None,
+                                "error": "No leader available to handle the request.", "leader": None} for _ in values]
+        first_index = self.last_log_index() + 1
+        futures = self.append_commands(values)
+        await asyncio.wait(futures, timeout=APPLY_TIMEOUT)
+        results = []
+        for index, future in enumerate(futures, first_index):
+            if not future.done():
+                error = f"Entry at index {index} was not applied within {APPLY_TIMEOUT} seconds."
+            elif future.exception():
+                error = str(future.exception())
+            else:
+                error = None
+            results.append({"index": index, "committed": error is None,
+                            "result": future.result() if error is None else None, "error": error, "leader": self.name})
+        return results
+
+    async def submit_value(self, value):
+        if not self.is_leader_flag:
+            return await self.forward("submit_value", value) or "Error: No leader available to handle the request."
+        [result] = await self.submit_values([value])
+        if result["error"]:
+            return f"Error: {result['error']}"
+        return f"Success: Value committed at index {result['index']}, result: {result['result']}"
+
+    def notify_progress(self):
+        """Wake every wait_until() so it re-checks its condition."""
+        progress, self.progress = self.progress, asyncio.Event()
+        progress.set()
+
+    async def wait_until(self, predicate, deadline):
+        """Wait until `predicate()` holds; returns False if `deadline` passes first."""
+        while not predicate():
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            try:
+                # A leader gets fresher through acknowledgements alone, so re-check every heartbeat
+                await asyncio.wait_for(self.progress.wait(), min(remaining, self.heartbeat_interval))
+            except asyncio.TimeoutError:
+                pass
+        return True
+
+    def leadership_confirmed_at(self):
+        needed = (len(self.peers) + 1) // 2
+        if needed == 0:
+            return time.time()
+        acks = sorted(self.acked_at.values(), reverse=True)
+        return acks[needed - 1] if len(acks) >= needed else 0.0
+
+    def lease_valid(self):
+        return self.is_leader_flag and time.time() < self.leadership_confirmed_at() + self.lease_duration
+
+    def freshness(self):
+        if self.is_leader_flag and self.last_applied >= self.commit_index:
+            return self.leadership_confirmed_at()
+        return self.fresh_as_of
+
+    async def read(self, key, mode=None):
+        """Linearizable read from the leader without a log write; see node.Node.read for the modes."""
+        mode = mode or self.read_mode
+        if mode not in READ_MODES:
+            return self.read_reply(error=f"Unknown read mode {mode!r}; expected one of {', '.join(READ_MODES)}.")
+        since = time.time()
+        deadline = since + APPLY_TIMEOUT
+        if not self.is_leader_flag:
+            return self.read_reply(error="NotLeader")
+        term = self.current_term
+        if not await self.wait_until(lambda: self.last_applied >= self.noop_index or self.current_term != term, deadline):
+            return self.read_reply(error=f"Timeout: {self.name} has not committed an entry in term {term} yet.")
+        if not self.is_leader_flag or self.current_term != term:
+            return self.read_reply(error="NotLeader")
+        read_index = self.commit_index
+
+        if not (mode == "lease" and self.lease_valid()):
+            if self.leadership_confirmed_at() < since:
+                self.notify_replicators()  # Idle replicators send their heartbeat now
+            confirmed = await self.wait_until(lambda: not self.is_leader_flag or self.leadership_confirmed_at() >= since, deadline)
+            if not self.is_leader_flag:
+                return self.read_reply(error="NotLeader")
+            if not confirmed:
+                return self.read_reply(error=f"Timeout: a majority did not confirm {self.name} as leader within {APPLY_TIMEOUT} seconds.")
+
+        if not await self.wait_until(lambda: self.last_applied >= read_index, deadline):
+            return self.read_reply(error=f"Timeout: entry {read_index} was not applied within {APPLY_TIMEOUT} seconds.")
+        return self.query_reply(key, read_index)
+
+    async def read_local(self, key, min_index=-1, max_staleness_ms=None):
+        """Read from this member's own state machine; see node.Node.read_local."""
+        deadline = time.time() + APPLY_TIMEOUT
+        if not await self.wait_until(lambda: self.last_applied >= min_index, deadline):
+            return self.read_reply(error=f"Timeout: {self.name} had not applied entry {min_index} within {APPLY_TIMEOUT} seconds.")
+        if max_staleness_ms is not None:
+            since = time.time() - max_staleness_ms / 1000
+            if not await self.wait_until(lambda: self.freshness() >= since, deadline):
+                return self.read_reply(error=f"Stale: {self.name} could not get within {max_staleness_ms}ms of the leader.")
+        return self.query_reply(key, self.last_applied)
+
+    def is_leader(self):
+        return self.is_leader_flag
+
+    def get_leader(self):
+        return self.known_leader()
+
+    def get_log_length(self):
+        return self.last_log_index() + 1
+
+    def get_heartbeat_interval(self):
+        return self.heartbeat_interval
+
+    def set_heartbeat_interval(self, interval):
+        self.heartbeat_interval = interval
+        return True
+
+    def set_replication_simulation(self, simulate_failure):
+        self.simulate_replication_failure = simulate_failure
+        print(f"Replication failure simulation {'enabled' if simulate_failure else 'disabled'} on {self.name}/{self.group}.")
+        return True
+
+    def delete_log_file(self):
+        self.wal.reset(self.log_start())
+        self.log = LogStore()
+        self.written_index = self.persisted_index = self.last_log_index()
+        return True
+
+
+class ThreadedXMLRPCServer(ThreadingMixIn, SimpleXMLRPCServer):
+    daemon_threads = True
+
+
+class XMLRPCFront:
+    """XML-RPC entry point for clients, handing each call to the host's event loop."""
+
+    def __init__(self, host):
+        self.host = host
+
+    def _dispatch(self, method, params):
+        return asyncio.run_coroutine_threadsafe(self.host.invoke(method, params), self.host.loop).result()
+
+
+class AsyncRaftHost:
+    """Host any number of Raft groups in one process, on one event loop and one port.
+
+    Peers talk the binary protocol on port + BINARY_PORT_OFFSET, and all groups shared with
+    a peer host use a single connection to it. RPC method names are "group.method"; a bare
+    "method" addresses DEFAULT_GROUP, so node.Node peers running --transport binary and
+    client.py (through the XML-RPC port) work unchanged against the default group.
+    """
+
+    host_methods = set()  # RPCs served by the host itself rather than one of its groups
+
+    def __init__(self, name, nodes=NODES, rpc_timeout=RPC_TIMEOUT, rpc_backoff=RPC_BACKOFF, rpc_max_backoff=RPC_MAX_BACKOFF):
+        self.name = name
+        self.nodes = nodes
+        self.ip, self.port = nodes[name]
+        self.connection_options = {"timeout": rpc_timeout, "backoff": rpc_backoff, "max_backoff": rpc_max_backoff}
+        self.connections = {}  # peer -> AsyncConnection, created on first use
+        self.groups = {}  # group -> AsyncNode
+        self.loop = None
+        self.server = None
+        self.xmlrpc_server = None
+        self.peer_handlers = {}  # writer -> handler task for each incoming peer connection
+
+    def add_group(self, group, members=None, **node_options):
+        """Create (and, if the host is serving, start) this host's member of `group`.
+
+        `members` are the group's voters, every node the host knows by default; pass
+        `learners=[...]` for non-voting replicas.
+        """
+        node = AsyncNode(self, group, members or list(self.nodes), **node_options)
+        self.groups[group] = node
+        if self.loop is not None:
+            node.start()
+        return node
+
+    def proxy(self, peer, group):
+        if peer not in self.connections:
+            ip, port = self.nodes[peer]
+            self.connections[peer] = AsyncConnection(peer, (ip, port + BINARY_PORT_OFFSET), **self.connection_options)
+        return AsyncProxy(self.connections[peer], group)
+
+    async def start(self, clients=True):
+        """Listen for peers (and, if `clients`, for XML-RPC clients) and start every group."""
+        self.loop = asyncio.get_running_loop()
+        self.server = await asyncio.start_server(self.handle_connection, "0.0.0.0", self.port + BINARY_PORT_OFFSET)
+        if clients:
+            self.xmlrpc_server = ThreadedXMLRPCServer(("0.0.0.0", self.port), requestHandler=QuietXMLRPCRequestHandler,
+                                                      allow_none=True, logRequests=False)
+            self.xmlrpc_server.register_instance(XMLRPCFront(self))
+            threading.Thread(target=self.xmlrpc_server.serve_forever, name="xmlrpc-front", daemon=True).start()
+        for node in self.groups.values():
+            node.start()
+        print(f"{self.name} is serving {len(self.groups)} groups on port {self.port + BINARY_PORT_OFFSET}.")
+
+    async def close(self):
+        for node in self.groups.values():
+            node.stop()
+        for connection in self.connections.values():
+            connection.close()
+        if self.xmlrpc_server is not None:
+            self.xmlrpc_server.shutdown()
+            self.xmlrpc_server.server_close()
+        self.server.close()
+        for writer in list(self.peer_handlers):
+            writer.close()  # The handler sees end of stream and returns
+        await asyncio.gather(*self.peer_handlers.values(), return_exceptions=True)
+        await self.server.wait_closed()
+
+    async def handle_connection(self, reader, writer):
+        self.peer_handlers[writer] = asyncio.current_task()
+        try:
+            while True:
+                kind, request_id, body = await read_frame(reader)
+                asyncio.create_task(self.handle_request(writer, request_id, body))
+        except (OSError, asyncio.IncompleteReadError):
+            writer.close()
+        finally:
+            self.peer_handlers.pop(writer, None)
+
+    async def handle_request(self, writer, request_id, body):
+        try:
+            method, args = decode_request(body)
+            result = await self.invoke(method, args)
+        except Exception as e:
+            write_frame(writer, FAULT, request_id, f"{type(e).__name__}: {e}".encode())
+        else:
+            write_frame(writer, RESPONSE, request_id, json.dumps(result).encode())
+
+    async def invoke(self, method, params):
+        group, _, method = method.rpartition(".")
+        if not group and method in self.host_methods:
+            return getattr(self, method)(*params)
+        node = self.groups.get(group or DEFAULT_GROUP)
+        if node is None:
+            raise KeyError(f"{self.name} does not host group {group or DEFAULT_GROUP!r}.")
+        if method not in RPC_METHODS:
+            raise AttributeError(f"Method {method!r} is not supported.")
+        result = getattr(node, method)(*params)
+        if inspect.isawaitable(result):
+            result = await result
+        return result
+
+
+async def serve(args):
+    host = AsyncRaftHost(args.node_name, {**NODES, **LEARNERS})
+    for group in args.groups:
+        host.add_group(group, list(NODES), learners=list(LEARNERS), learner_interval=args.learner_interval, segment_size=args.segment_size, fsync_policy=args.fsync, fsync_interval=args.fsync_interval,
+                       snapshot_threshold=args.snapshot_threshold, append_max_entries=args.append_max_entries,
+                       read_mode=args.read_mode, state_machine=STATE_MACHINES[args.state_machine]())
+    await host.start()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await host.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a node's members of one or more Raft groups on a single event loop.")
+    parser.add_argument("node_name", choices=[*NODES, *LEARNERS], help="The name of the node to run (e.g., node1, node2, node3, or a learner).")
+    parser.add_argument("--groups", nargs="+", default=[DEFAULT_GROUP], help="Raft groups to host; every node hosts the same ones.")
+    parser.add_argument("--segment-size", type=int, default=WAL_SEGMENT_SIZE, help="WAL segment size in bytes.")
+    parser.add_argument("--fsync", choices=FSYNC_POLICIES, default=WAL_FSYNC_POLICY, help="When to fsync the WAL.")
+    parser.add_argument("--fsync-interval", type=float, default=WAL_FSYNC_INTERVAL, help="Seconds between fsyncs for --fsync interval.")
+    parser.add_argument("--snapshot-threshold", type=int, default=SNAPSHOT_THRESHOLD, help="Applied entries between snapshots (0 disables them).")
+    parser.add_argument("--append-max-entries", type=int, default=APPEND_MAX_ENTRIES, help="Entries per AppendEntries batch.")
+    parser.add_argument("--state-machine", choices=STATE_MACHINES, default="kv", help="State machine committed entries are applied to.")
+    parser.add_argument("--read-mode", choices=READ_MODES, default=READ_MODE, help="Default mode for linearizable reads.")
+    parser.add_argument("--learner-interval", type=float, default=LEARNER_REPLICATION_INTERVAL, help="Seconds between batches to each learner.")
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        print(f"{args.node_name} has shut down cleanly.")
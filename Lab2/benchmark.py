@@ -0,0 +1,870 @@
+import argparse
+import asyncio
+import contextlib
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import time
+import tracemalloc
+
+import node as raft
+from async_node import AsyncRaftHost
+from multi_raft import MultiRaftHost
+from kv import KVStateMachine, encode_command
+from binary_transport import BINARY_PORT_OFFSET, BinaryPeerConnections, BinaryRPCServer
+from log_store import LogEntry, LogSlice, LogStore
+from metrics import Histogram
+from transport import PeerConnections
+
+
+class LocalProxy:
+    """Stand-in for a peer's XML-RPC proxy that calls the peer Node in-process.
+
+    Each call sleeps for half of `rtt` on the way out and half on the way back, so
+    benchmarks can measure protocol behaviour at a chosen network latency without
+    real sockets. Calls to a node listed in the cluster's `lag` take that many seconds
+    longer to arrive. Calls to a node that has been taken down raise ConnectionRefusedError,
+    like the pooled transport does while backing off, and with a `call_timeout` set on the
+    cluster, calls that take longer than that raise TimeoutError.
+    """
+
+    def __init__(self, cluster, peer):
+        self.cluster = cluster
+        self.peer = peer
+
+    def __getattr__(self, method):
+        def call(*args):
+            time.sleep(self.cluster.rtt / 2 + self.cluster.lag.get(self.peer, 0.0))
+            target = self.cluster.nodes.get(self.peer)
+            if target is None or self.peer in self.cluster.down:
+                raise ConnectionRefusedError(f"{self.peer} is down.")
+            result = getattr(target, method)(*args)
+            time.sleep(self.cluster.rtt / 2)
+            return result
+
+        def call_with_timeout(*args):
+            # The call carries on in the background after we give up on it, like a slow server would
+            outcome = {}
+
+            def run():
+                try:
+                    outcome["result"] = call(*args)
+                except Exception as e:
+                    outcome["error"] = e
+            worker = threading.Thread(target=run, daemon=True)
+            worker.start()
+            worker.join(self.cluster.call_timeout)
+            if worker.is_alive():
+                raise TimeoutError(f"{method} on {self.peer} timed out.")
+            if "error" in outcome:
+                raise outcome["error"]
+            return outcome["result"]
+        return call if self.cluster.call_timeout is None else call_with_timeout
+
+
+class LocalPeers:
+    """PeerConnections replacement handing out LocalProxy objects."""
+
+    def __init__(self, cluster):
+        self.cluster = cluster
+
+    def add_peer(self, peer, address):
+        pass  # Proxies are made on demand and find their node by name
+
+    def remove_peer(self, peer):
+        pass
+
+    def proxy(self, peer):
+        return LocalProxy(self.cluster, peer)
+
+    def encode_entries(self, batch):
+        # Same as the binary transport: the follower gets the batch's bytes, not the leader's arena
+        return LogSlice(batch.terms, batch.offsets, memoryview(bytes(batch.payload)))
+
+    def close(self):
+        pass
+
+
+class LocalCluster:
+    """Run every node of the cluster in this process, wired together through LocalPeers.
+
+    Nodes keep their WALs in a throwaway directory. No election threads are started;
+    call elect() to make a node leader for a fresh term.
+    """
+
+    def __init__(self, rtt=0.0, call_timeout=None, **node_options):
+        self.rtt = rtt
+        self.call_timeout = call_timeout
+        self.down = set()
+        self.lag = {}  # name -> extra seconds calls to that node take
+        self.directory = tempfile.mkdtemp(prefix="raft-bench-")
+        node_options.setdefault("snapshot_threshold", 0)
+        self.node_options = node_options
+        self.nodes = {}
+        self.appliers = []
+        for name in raft.NODES:
+            self.start_member(name)
+
+    def start_member(self, name, address=None):
+        """Create node `name` and its applier; one outside raft.NODES needs an address and joins with add_node."""
+        member = raft.Node(name, log_dir=self.directory, address=address, **self.node_options)
+        member.peer_connections = LocalPeers(self)
+        self.nodes[name] = member
+        applier = threading.Thread(target=member.run_applier, daemon=True)
+        applier.start()
+        self.appliers.append(applier)
+        return member
+
+    def seed(self, name, count, term, command="seed"):
+        """Append `count` entries from `term` straight into a node's log and WAL."""
+        member = self.nodes[name]
+        entries = [raft.LogEntry(term, command) for _ in range(count)]
+        member.log.extend(entries)
+        member.persist_entries(entries)
+
+    def elect(self, name):
+        """Make `name` leader of a new term, as if it had just won an election."""
+        term = max(max(member.current_term, member.term_at(member.last_log_index()) if member.log else 0)
+                   for member in self.nodes.values()) + 1
+        for member in self.nodes.values():
+            member.current_term = term
+        leader = self.nodes[name]
+        with leader.lock:
+            leader.start_leader()
+        return leader
+
+    def close(self):
+        for member in self.nodes.values():
+            member.stop()
+        for applier in self.appliers:
+            applier.join()
+        for member in self.nodes.values():
+            member.wal.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ClientWriter:
+    """Thread writing like client.py: to the cached leader, following the leader each reply names.
+
+    Each call submits `batch` values for `key`. Counts committed and failed writes, the seconds
+    spent in submit_values and the longest gap between committed writes; read them after stop().
+    """
+
+    def __init__(self, cluster, leader, batch=1, key="k"):
+        self.cluster = cluster
+        self.current = leader
+        self.batch = batch
+        self.key = key
+        self.committed = 0
+        self.failed = 0
+        self.busy = 0.0
+        self.stall = 0.0
+        self.running = True
+        self.thread = threading.Thread(target=self.run)
+        self.thread.start()
+
+    def run(self):
+        last_write = time.time()
+        while self.running:
+            start = time.time()
+            results = self.current.submit_values([f"{self.key}={start}"] * self.batch)
+            self.busy += time.time() - start
+            committed = sum(1 for result in results if result["committed"])
+            self.committed += committed
+            self.failed += len(results) - committed
+            if committed:
+                self.stall = max(self.stall, time.time() - last_write)
+                last_write = time.time()
+                self.current = self.cluster.nodes.get(results[-1]["leader"], self.current)
+            else:
+                time.sleep(0.01)
+                self.current = next((member for member in self.cluster.nodes.values() if member.is_leader_flag), self.current)
+        self.stall = max(self.stall, time.time() - last_write)
+
+    def stop(self):
+        self.running = False
+        self.thread.join()
+
+
+def drive_writes(leader, duration, clients, batch, payload):
+    """Submit batches of writes from `clients` threads for `duration` seconds; returns committed entries per second."""
+    committed = [0] * clients
+    deadline = time.time() + duration
+
+    def client(slot):
+        while time.time() < deadline:
+            results = leader.submit_values([payload] * batch)
+            committed[slot] += sum(1 for result in results if result["committed"])
+
+    threads = [threading.Thread(target=client, args=(slot,)) for slot in range(clients)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sum(committed) / (time.time() - start)
+
+
+def bench_pipeline(args):
+    """Write throughput against the number of AppendEntries batches in flight per follower."""
+    payload = "x" * args.payload
+    print(f"{'rtt ms':>8} {'inflight':>8} {'entries/s':>12}")
+    for rtt_ms in args.rtt:
+        for inflight in args.inflight:
+            with quiet(args), LocalCluster(rtt=rtt_ms / 1000, fsync_policy=args.fsync, append_max_entries=args.append_max_entries,
+                                           pipeline_max_inflight=inflight) as cluster:
+                leader = cluster.elect("node1")
+                throughput = drive_writes(leader, args.duration, args.clients, args.batch, payload)
+            print(f"{rtt_ms:>8g} {inflight:>8} {throughput:>12.0f}", flush=True)
+
+
+def catch_up(case, prefix, entries, **cluster_options):
+    """Elect node1 over a `lagging` or `divergent` node2 and wait until node2 matches its log.
+
+    Returns how many AppendEntries node2 rejected, the seconds it took, and whether
+    node2's log then equals the leader's entry for entry.
+    """
+    with LocalCluster(**cluster_options) as cluster:
+        for name in ("node1", "node3"):
+            cluster.seed(name, prefix, 1)
+            cluster.seed(name, entries, 3)
+        if case == "divergent":
+            # node2 holds a different suffix from a term the new leader never saw
+            cluster.seed("node2", prefix, 1)
+            cluster.seed("node2", entries, 2, command="stale")
+
+        follower = cluster.nodes["node2"]
+        rejections = [0]
+        receive = follower.receive_append_entries
+
+        def counting(*rpc_args):
+            reply = receive(*rpc_args)
+            rejections[0] += not reply["success"]
+            return reply
+
+        follower.receive_append_entries = counting
+        start = time.time()
+        leader = cluster.elect("node1")  # The new leader's no-op exposes the gap
+        while leader.match_index["node2"] < leader.last_log_index():
+            if time.time() - start > 60:
+                raise RuntimeError(f"node2 did not catch up ({case}).")
+            time.sleep(0.001)
+        elapsed = time.time() - start
+        in_line = [(entry.term, entry.command) for entry in follower.log] == [(entry.term, entry.command) for entry in leader.log]
+    return rejections[0], elapsed, in_line
+
+
+def bench_catchup(args):
+    """Time for a leader to bring a lagging or divergent follower's log in line with its own."""
+    print(f"{'case':>10} {'entries':>8} {'rejections':>10} {'seconds':>8}")
+    mismatched = []
+    for case in ("lagging", "divergent"):
+        with quiet(args):
+            rejections, elapsed, in_line = catch_up(case, args.prefix, args.entries, rtt=args.rtt / 1000, fsync_policy=args.fsync)
+        print(f"{case:>10} {args.prefix + args.entries:>8} {rejections:>10} {elapsed:>8.2f}{'' if in_line else '  MISMATCH'}",
+              flush=True)
+        if not in_line:
+            mismatched.append(case)
+    if mismatched:
+        raise SystemExit(f"Follower log differs from the leader's after catching up: {', '.join(mismatched)}")
+
+
+def bench_leader(args):
+    """Leader lookups (is_leader/get_leader RPCs) per write for each way a client can reach the leader."""
+    print(f"{'client':>26} {'probes/write':>13} {'writes/s':>10}")
+    with quiet(args), LocalCluster(rtt=args.rtt / 1000) as cluster:
+        cluster.elect(args.leader)
+        time.sleep(0.5)  # Let the followers hear a heartbeat naming the leader
+        proxies = {name: LocalProxy(cluster, name) for name in cluster.nodes}
+        follower = next(name for name in cluster.nodes if name != args.leader)
+        probes = [0]
+        lock = threading.Lock()
+        for member in cluster.nodes.values():
+            for method in ("is_leader", "get_leader"):
+                def counted(*call_args, call=getattr(member, method)):
+                    with lock:
+                        probes[0] += 1
+                    return call(*call_args)
+                setattr(member, method, counted)
+
+        def probe_for_leader():
+            # What client.py used to do: is_leader() on each node in turn
+            return next((name for name, proxy in proxies.items() if proxy.is_leader()), None)
+
+        probed = [probe_for_leader()]
+
+        def probe_every_command(value):
+            # client.py before: write, then look the leader up twice after every command
+            proxies[probed[0]].submit_values([value])
+            probe_for_leader()
+            probed[0] = probe_for_leader()
+
+        cached = [None]
+
+        def cached_leader(value):
+            # client.py now: ask one node who leads, then reuse that until a request fails
+            if cached[0] is None:
+                cached[0] = proxies[follower].get_leader()
+            [result] = proxies[cached[0]].submit_values([value])
+            if not result["committed"]:
+                cached[0] = None
+            else:
+                cached[0] = result["leader"]
+
+        def follower_probing(value):
+            # A follower without a leader hint asks each peer whether it leads before forwarding
+            cluster.nodes[follower].leader_id = None
+            proxies[follower].submit_values([value])
+
+        def follower_hint(value):
+            proxies[follower].submit_values([value])
+
+        rows = []
+        for label, write in (("probe every command", probe_every_command), ("cached leader", cached_leader),
+                             ("via follower, probing", follower_probing), ("via follower, hint", follower_hint)):
+            probes[0] = 0
+            start = time.time()
+            for i in range(args.writes):
+                write(f"k{i}=v{i}")
+            rows.append((label, probes[0] / args.writes, args.writes / (time.time() - start)))
+    for label, per_write, writes in rows:
+        print(f"{label:>26} {per_write:>13.2f} {writes:>10.0f}")
+
+
+def run_soak(enabled, duration, lag, lag_every, lag_for, interval, rtt=0.0):
+    """Write every `interval` seconds for `duration` while one follower's links lag by `lag` seconds in spells.
+
+    Every `lag_every` seconds, calls to the lagging node take `lag` longer for `lag_for`
+    seconds. PreVote and CheckQuorum are on when `enabled`. Returns the elections held
+    after the first leader, the nodes that led, the writes that failed and the longest
+    gap in seconds between committed writes.
+    """
+    with LocalCluster(rtt=rtt, call_timeout=raft.RPC_TIMEOUT, pre_vote=enabled, check_quorum=enabled) as cluster:
+        members = list(cluster.nodes.values())
+        for member in members:
+            threading.Thread(target=member.run_election, daemon=True).start()
+        wait_for(lambda: any(member.is_leader_flag for member in members))
+        leader = next(member for member in members if member.is_leader_flag)
+        lagging = next(name for name in cluster.nodes if name != leader.name)
+        first_term = max(member.current_term for member in members)
+        leaders = {leader.name}
+        failed = 0
+        max_stall = 0.0
+        start = last_write = time.time()
+        while time.time() - start < duration:
+            phase = (time.time() - start) % lag_every
+            if phase < lag_for:
+                cluster.lag[lagging] = lag
+            else:
+                cluster.lag.pop(lagging, None)
+            current = next((member for member in members if member.is_leader_flag), None)
+            if current is not None:
+                leaders.add(current.name)
+                [result] = current.submit_values([f"soak={time.time()}"])
+                if result["committed"]:
+                    max_stall = max(max_stall, time.time() - last_write)
+                    last_write = time.time()
+                else:
+                    failed += 1
+            else:
+                failed += 1
+            time.sleep(interval)
+        cluster.lag.clear()
+        max_stall = max(max_stall, time.time() - last_write)
+        elections = max(member.current_term for member in members) - first_term
+    return elections, leaders, failed, max_stall
+
+
+def bench_soak(args):
+    """Elections per hour while one follower's links keep lagging past the election timeout, with and without PreVote/CheckQuorum."""
+    print(f"{'pre-vote/check-quorum':>22} {'elections':>10} {'per hour':>9} {'leaders':>8} {'failed writes':>14} {'max stall s':>12}")
+    rows = []
+    for enabled in (False, True):
+        with quiet(args):
+            elections, leaders, failed, max_stall = run_soak(enabled, args.duration, args.lag / 1000, args.lag_every, args.lag_for,
+                                                             args.interval / 1000, rtt=args.rtt / 1000)
+        rows.append(("on" if enabled else "off", elections, elections * 3600 / args.duration, len(leaders), failed, max_stall))
+    for label, elections, per_hour, leaders, failed, stall in rows:
+        print(f"{label:>22} {elections:>10} {per_hour:>9.0f} {leaders:>8} {failed:>14} {stall:>12.2f}")
+
+
+def bench_election(args):
+    """Time to win an election when every peer answers, when one is down and when one is too slow to answer in time."""
+    print(f"{'peers':>18} {'won':>6} {'p50 ms':>8} {'p99 ms':>8} {'mean ms':>8}")
+    for label, setup in (("all up", lambda cluster, peer: None),
+                         ("one down", lambda cluster, peer: cluster.down.add(peer)),
+                         ("one slow", lambda cluster, peer: cluster.lag.update({peer: args.lag / 1000}))):
+        with quiet(args), LocalCluster(rtt=args.rtt / 1000, call_timeout=raft.RPC_TIMEOUT) as cluster:
+            candidate = cluster.nodes[args.candidate]
+            setup(cluster, next(name for name in cluster.nodes if name != args.candidate))
+            elections = Histogram()
+            for _ in range(args.rounds):
+                for member in cluster.nodes.values():
+                    member.last_leader_contact = 0.0  # Nobody has a leader, so everyone grants the pre-vote
+                start = time.time()
+                with candidate.lock:
+                    candidate.start_election()
+                    if candidate.is_leader_flag:
+                        elections.observe(time.time() - start)
+                        candidate.lose_leadership()
+            time.sleep(raft.RPC_TIMEOUT)  # Let calls left with the slow peer time out while output is still quiet
+        print(f"{label:>18} {elections.count:>3}/{args.rounds:<2} {elections.quantile(0.5) * 1000:>8.0f} "
+              f"{elections.quantile(0.99) * 1000:>8.0f} {elections.sum / max(1, elections.count) * 1000:>8.1f}")
+
+
+def bench_transfer(args):
+    """Write outage when the leader goes away: killed and replaced by an election timeout, or after handing over with transfer_leadership."""
+    print(f"{'leader change':>14} {'new leader after ms':>20} {'failed writes':>14} {'max stall ms':>13}")
+    rows = []
+    for how in ("kill", "transfer"):
+        with quiet(args), LocalCluster(rtt=args.rtt / 1000, call_timeout=raft.RPC_TIMEOUT) as cluster:
+            members = list(cluster.nodes.values())
+            for member in members:
+                threading.Thread(target=member.run_election, daemon=True).start()
+            wait_for(lambda: any(member.is_leader_flag for member in members))
+            old = next(member for member in members if member.is_leader_flag)
+            target = next(member for member in members if member is not old)
+            writer = ClientWriter(cluster, old)
+            time.sleep(0.5)
+            start = time.time()
+            if how == "kill":
+                cluster.down.add(old.name)
+                old.stop()
+            else:
+                old.transfer_leadership(target.name)
+            wait_for(lambda: any(member.is_leader_flag for member in members if member is not old))
+            new_leader = time.time() - start
+            time.sleep(args.after)
+            writer.stop()
+            rows.append((how, new_leader * 1000, writer.failed, writer.stall * 1000))
+    for how, new_leader, failed, stall in rows:
+        print(f"{how:>14} {new_leader:>20.0f} {failed:>14} {stall:>13.0f}")
+
+
+def bench_membership(args):
+    """Write outage while the membership changes: a node is added (learner catch-up, then promotion), a follower removed, and the leader removed."""
+    print(f"{'change':>16} {'change ms':>10} {'writes/s':>9} {'failed writes':>14} {'max stall ms':>13} {'voters':>24}")
+    rows = []
+    for change in ("none", "add", "remove follower", "remove leader"):
+        with quiet(args), LocalCluster(rtt=args.rtt / 1000, call_timeout=raft.RPC_TIMEOUT) as cluster:
+            leader = cluster.elect("node1")
+            follower = cluster.nodes["node2"]
+            wait_for(lambda: leader.last_applied >= leader.noop_index)
+            for start in range(0, args.entries, 1000):
+                leader.submit_values([f"seed{i}=x" for i in range(start, min(args.entries, start + 1000))])
+            start = time.time()
+            writer = ClientWriter(cluster, leader)
+            time.sleep(args.before)
+            changed_at = time.time()
+            if change == "add":
+                cluster.start_member("node4", ("localhost", 0))
+                reply = leader.add_node("node4", "localhost", 0)
+            elif change == "remove follower":
+                reply = leader.remove_node(follower.name)
+            elif change == "remove leader":
+                reply = leader.remove_node(leader.name)
+            else:
+                reply = leader.membership_reply()
+            change_ms = (time.time() - changed_at) * 1000
+            time.sleep(args.after)
+            writer.stop()
+            voters = ",".join(reply["voters"]) if reply["ok"] else f"failed: {reply['error']}"
+            rows.append((change, change_ms, writer.committed / (time.time() - start), writer.failed, writer.stall * 1000, voters))
+    for change, change_ms, writes, failed, stall, voters in rows:
+        print(f"{change:>16} {change_ms:>10.0f} {writes:>9.0f} {failed:>14} {stall:>13.0f} {voters:>24}")
+
+
+def bench_learners(args):
+    """Write throughput, commit latency and learner lag with learners attached, then follower reads served by the learners.
+
+    "peer" replicates to the learners with an ordinary PeerReplicator, as if they were voters
+    that commits do not wait for; "learner" uses the lower-priority LearnerReplicator. Reads
+    run after the writes, as both compete for one interpreter here.
+    """
+    print(f"{'learners':>8} {'replicator':>10} {'writes/s':>9} {'mean ms':>8} {'max lag':>8} {'learner reads/s':>16}")
+    for count in args.learners:
+        for kind in (("learner", "peer") if count else ("-",)):
+            with quiet(args), LocalCluster(rtt=args.rtt / 1000, fsync_policy=args.fsync) as cluster:
+                leader = cluster.elect("node1")
+                if kind == "peer":
+                    leader.make_replicator = lambda peer: raft.PeerReplicator(leader, peer, leader.current_term, **leader.replicator_options)
+                learners = []
+                for i in range(count):
+                    name = f"learner{i + 1}"
+                    learners.append(cluster.start_member(name, ("localhost", 0)))
+                    leader.add_learner(name, "localhost", 0)
+                wait_for(lambda: all(learner.last_applied >= leader.commit_index for learner in learners))
+
+                reads = [0] * count
+                lag = [0]
+                deadline = time.time() + args.duration
+
+                def monitor():
+                    while time.time() < deadline:
+                        lag[0] = max([lag[0]] + [leader.commit_index - learner.last_applied for learner in learners])
+                        time.sleep(0.01)
+
+                monitoring = threading.Thread(target=monitor)
+                start = time.time()
+                monitoring.start()
+                writers = [ClientWriter(cluster, leader, batch=args.batch, key=f"key{slot}") for slot in range(args.clients)]
+                monitoring.join()
+                for writer in writers:
+                    writer.stop()
+                elapsed = time.time() - start
+
+                def reader(slot):
+                    i = 0
+                    while time.time() < deadline:
+                        reply = learners[slot].read_local(f"key{i % args.clients}", -1, args.max_staleness)
+                        reads[slot] += reply["ok"]
+                        i += 1
+
+                threads = [threading.Thread(target=reader, args=(slot,)) for slot in range(count)]
+                deadline = time.time() + args.duration
+                read_start = time.time()
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                read_rate = sum(reads) / (time.time() - read_start)
+            total = sum(writer.committed for writer in writers)
+            mean_ms = 1000 * sum(writer.busy for writer in writers) / max(total // args.batch, 1)
+            print(f"{count:>8} {kind:>10} {total / elapsed:>9.0f} {mean_ms:>8.2f} {lag[0]:>8} {read_rate:>16.0f}", flush=True)
+
+
+def bench_reads(args):
+    """Read throughput and latency of each read path; none of them writes the log.
+
+    "follower" spreads bounded-staleness reads over every node instead of sending them to the leader.
+    """
+    print(f"{'mode':>10} {'reads/s':>10} {'mean ms':>8} {'appended':>8}")
+    for mode in raft.READ_MODES + ("follower",):
+        with quiet(args), LocalCluster(rtt=args.rtt / 1000, fsync_policy=args.fsync) as cluster:
+            leader = cluster.elect("node1")
+            written = leader.submit_values([f"key{i}=value{i}" for i in range(args.keys)])
+            token = max(result["index"] for result in written)
+            log_length = leader.get_log_length()
+            members = list(cluster.nodes.values())
+
+            reads = [0] * args.clients
+            latency = [0.0] * args.clients
+            deadline = time.time() + args.duration
+
+            def reader(slot):
+                i = slot
+                while time.time() < deadline:
+                    start = time.time()
+                    if mode == "follower":
+                        reply = members[i % len(members)].read_local(f"key{i % args.keys}", token, args.max_staleness)
+                    else:
+                        reply = leader.read(f"key{i % args.keys}", mode)
+                    latency[slot] += time.time() - start
+                    reads[slot] += reply["value"] == f"value{i % args.keys}"
+                    i += args.clients
+
+            threads = [threading.Thread(target=reader, args=(slot,)) for slot in range(args.clients)]
+            start = time.time()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.time() - start
+            appended = leader.get_log_length() - log_length
+        total = sum(reads)
+        print(f"{mode:>10} {total / elapsed:>10.0f} {1000 * sum(latency) / max(total, 1):>8.2f} {appended:>8}", flush=True)
+
+
+def bench_kv(args):
+    """Apply throughput of the KV state machine by apply_batch size, and point lookup throughput."""
+    commands = []
+    for i in range(args.operations):
+        key = f"key{i % args.keys}"
+        op = ("put", "put", "put", "get", "cas", "delete")[i % 6]
+        commands.append(encode_command(op, key, f"value{i}", f"value{i - 1}" if op == "cas" else None))
+    entries = [raft.LogEntry(1, command) for command in commands]
+
+    print(f"{'batch':>8} {'applied/s':>12}")
+    for batch in args.batch:
+        machine = KVStateMachine()
+        start = time.time()
+        for offset in range(0, len(entries), batch):
+            machine.apply_batch(entries[offset:offset + batch])
+        print(f"{batch:>8} {len(entries) / (time.time() - start):>12.0f}", flush=True)
+
+    keys = [f"key{i % args.keys}" for i in range(args.operations)]
+    start = time.time()
+    for key in keys:
+        machine.query(key)
+    print(f"{'lookups/s':>8} {len(keys) / (time.time() - start):>12.0f} ({len(machine.values)} keys)")
+
+
+def bench_log(args):
+    """Memory per entry and batch slicing cost of the compact LogStore against a list of LogEntry objects."""
+    print(f"{'log':>10} {'bytes/entry':>12} {'slice us':>10}")
+    for name, make in (("list", list), ("LogStore", LogStore)):
+        tracemalloc.start()
+        log = make(raft.LogEntry(i // 1000, f"{i:0{args.payload}d}") for i in range(args.entries))
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+        start = time.time()
+        for offset in range(0, args.entries - args.batch, args.batch):
+            log[offset:offset + args.batch]
+        per_slice = (time.time() - start) / (args.entries // args.batch - 1)
+        print(f"{name:>10} {size / args.entries:>12.1f} {per_slice * 1e6:>10.1f}", flush=True)
+        del log
+
+
+class AppendSink:
+    """Follower stand-in that decodes AppendEntries batches the way Node does and accepts them."""
+
+    def receive_append_entries(self, term, prev_log_index, prev_log_term, entries, leader_commit, leader_id=None):
+        if not isinstance(entries, LogSlice):
+            entries = LogStore(LogEntry.from_string(entry_str) for entry_str in entries)[:]
+        return {"success": True, "term": term, "conflict_index": -1, "conflict_term": -1}
+
+
+def bench_transport(args):
+    """AppendEntries throughput over localhost sockets with XML-RPC against the binary transport."""
+    log = LogStore(LogEntry(1, f"{i:0{args.payload}d}") for i in range(args.entries))
+    server = raft.QuietXMLRPCServer(("127.0.0.1", 0), allow_none=True)
+    server.register_instance(AppendSink())
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    binary_server = BinaryRPCServer(("127.0.0.1", 0), AppendSink(), server.pools, raft.rpc_pool)
+    binary_server.start()
+
+    transports = {
+        "xmlrpc": PeerConnections({"sink": server.server_address}, pool_size=args.clients),
+        "binary": BinaryPeerConnections({"sink": ("127.0.0.1", binary_server.server_address[1] - BINARY_PORT_OFFSET)}),
+    }
+    print(f"{'transport':>10} {'entries/s':>12} {'MB/s':>8} {'ms/batch':>9}")
+    for name, peers in transports.items():
+        def send(offset):
+            # Encode under the same conditions as the leader: one batch at a time, straight from the log
+            entries = peers.encode_entries(log[offset:offset + args.batch])
+            started = time.time()
+            reply = peers.proxy("sink").receive_append_entries(1, offset - 1, 1, entries, -1)
+            assert reply["success"]
+            return time.time() - started
+
+        offsets = range(0, args.entries, args.batch)
+        start = time.time()
+        with ThreadPoolExecutor(args.clients) as pool:
+            latency = list(pool.map(send, offsets))
+        elapsed = time.time() - start
+        print(f"{name:>10} {args.entries / elapsed:>12.0f} {log[:].nbytes / elapsed / 1e6:>8.1f} "
+              f"{1000 * sum(latency) / len(latency):>9.2f}", flush=True)
+        peers.close()
+
+    binary_server.close()
+    server.shutdown()
+    server.server_close()
+
+
+def wait_for(predicate, timeout=30.0):
+    """Poll until `predicate()` holds; returns the seconds it took."""
+    start = time.time()
+    while not predicate():
+        if time.time() - start > timeout:
+            raise RuntimeError("Timed out waiting for the cluster.")
+        time.sleep(0.01)
+    return time.time() - start
+
+
+def bench_groups(args):
+    """Threads, idle CPU and write throughput of the threaded Node (one group) against AsyncRaftHost and MultiRaftHost with many groups."""
+    print(f"{'node':>10} {'groups':>7} {'threads':>8} {'idle cpu%':>10} {'elect s':>8} {'writes/s':>10}", flush=True)
+    directory = tempfile.mkdtemp(prefix="raft-bench-")
+    threads_before = threading.active_count()
+    payload = "x" * args.payload
+
+    # The threaded node: one process per node runs exactly one group
+    raft.NODES.clear()
+    raft.NODES.update({f"node{i + 1}": ("127.0.0.1", args.base_port + i) for i in range(3)})
+    with quiet(args):
+        members = [raft.Node(name, fsync_policy=args.fsync, snapshot_threshold=0, log_dir=directory) for name in raft.NODES]
+        for member in members:
+            for target in (member.run_server, member.run_election, member.run_applier):
+                threading.Thread(target=target, daemon=True).start()
+        elected = wait_for(lambda: any(member.is_leader_flag for member in members))
+        leader = next(member for member in members if member.is_leader_flag)
+        time.sleep(0.5)
+        cpu = time.process_time()
+        time.sleep(args.idle)
+        idle_cpu = (time.process_time() - cpu) / args.idle
+        threads = threading.active_count() - threads_before
+        writes = drive_writes(leader, args.duration, args.clients, args.batch, payload)
+        for member in members:
+            member.stop()
+    print(f"{'threaded':>10} {1:>7} {threads:>8} {100 * idle_cpu:>10.1f} {elected:>8.2f} {writes:>10.0f}", flush=True)
+    time.sleep(1)  # Let the threaded nodes wind down before measuring the next run
+    threads_before = threading.active_count()
+
+    runs = [(kind, groups) for kind in ("async", "multi") for groups in args.groups]
+    for run, (kind, groups) in enumerate(runs):
+        nodes = {f"node{i + 1}": ("127.0.0.1", args.base_port + 10 * (run + 1) + i) for i in range(3)}
+        with quiet(args):
+            threads, idle_cpu, elected, writes = asyncio.run(run_groups(args, kind, nodes, groups, directory, payload))
+        print(f"{kind:>10} {groups:>7} {threads - threads_before:>8} {100 * idle_cpu:>10.1f} {elected:>8.2f} {writes:>10.0f}", flush=True)
+    shutil.rmtree(directory, ignore_errors=True)
+
+
+async def run_groups(args, kind, nodes, groups, directory, payload):
+    log_dir = f"{directory}/{kind}{groups}"
+    if kind == "multi":
+        hosts = [MultiRaftHost(name, nodes, fsync_policy=args.fsync, log_dir=log_dir) for name in nodes]
+    else:
+        hosts = [AsyncRaftHost(name, nodes) for name in nodes]
+    for host in hosts:
+        for group in range(groups):
+            host.add_group(f"g{group}", fsync_policy=args.fsync, snapshot_threshold=0, log_dir=log_dir)
+        await host.start(clients=False)
+
+    start = time.time()
+    while not all(any(host.groups[group].is_leader_flag for host in hosts) for group in hosts[0].groups):
+        await asyncio.sleep(0.01)
+    elected = time.time() - start
+    await asyncio.sleep(0.5)
+    cpu = time.process_time()
+    await asyncio.sleep(args.idle)
+    idle_cpu = (time.process_time() - cpu) / args.idle
+    threads = threading.active_count()
+
+    leaders = [member for host in hosts for member in host.groups.values() if member.is_leader_flag]
+    committed = [0]
+    deadline = time.time() + args.duration
+
+    async def client(slot):
+        while time.time() < deadline:
+            results = await leaders[slot % len(leaders)].submit_values([payload] * args.batch)
+            committed[0] += sum(1 for result in results if result["committed"])
+
+    start = time.time()
+    await asyncio.gather(*(client(slot) for slot in range(args.clients)))
+    writes = committed[0] / (time.time() - start)
+    for host in hosts:
+        await host.close()
+    return threads, idle_cpu, elected, writes
+
+
+def quiet(args):
+    """Silence the nodes' per-entry logging unless --verbose is given."""
+    if args.verbose:
+        return contextlib.nullcontext()
+    return contextlib.redirect_stdout(open(os.devnull, "w"))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark a Raft cluster running in-process with simulated network latency.")
+    parser.add_argument("--verbose", action="store_true", help="Show the nodes' own logging.")
+    parser.add_argument("--fsync", choices=raft.FSYNC_POLICIES, default="never", help="WAL fsync policy for the benchmark nodes.")
+    scenarios = parser.add_subparsers(dest="scenario", required=True)
+
+    pipeline = scenarios.add_parser("pipeline", help=bench_pipeline.__doc__)
+    pipeline.add_argument("--rtt", type=float, nargs="+", default=[1, 5, 20], help="Simulated round-trip times in milliseconds.")
+    pipeline.add_argument("--inflight", type=int, nargs="+", default=[1, 2, 4, 8], help="Pipeline depths to compare.")
+    pipeline.add_argument("--append-max-entries", type=int, default=32, help="Entries per AppendEntries batch.")
+    pipeline.add_argument("--duration", type=float, default=3.0, help="Seconds to run each configuration.")
+    pipeline.add_argument("--clients", type=int, default=16, help="Concurrent writers.")
+    pipeline.add_argument("--batch", type=int, default=16, help="Values per submit_values call.")
+    pipeline.add_argument("--payload", type=int, default=100, help="Bytes per value.")
+    pipeline.set_defaults(run=bench_pipeline)
+
+    catchup = scenarios.add_parser("catchup", help=bench_catchup.__doc__)
+    catchup.add_argument("--rtt", type=float, default=1, help="Simulated round-trip time in milliseconds.")
+    catchup.add_argument("--prefix", type=int, default=1000, help="Entries every node agrees on.")
+    catchup.add_argument("--entries", type=int, default=10000, help="Entries the follower is missing or holds from a stale term.")
+    catchup.set_defaults(run=bench_catchup)
+
+    leader = scenarios.add_parser("leader", help=bench_leader.__doc__)
+    leader.add_argument("--rtt", type=float, default=1, help="Simulated round-trip time in milliseconds.")
+    leader.add_argument("--writes", type=int, default=500, help="Writes per client strategy.")
+    leader.add_argument("--leader", choices=sorted(raft.NODES), default="node3",
+                        help="Node to make leader; the last one probed is the worst case for probing clients.")
+    leader.set_defaults(run=bench_leader)
+
+    soak = scenarios.add_parser("soak", help=bench_soak.__doc__)
+    soak.add_argument("--rtt", type=float, default=1, help="Simulated round-trip time in milliseconds.")
+    soak.add_argument("--duration", type=float, default=60.0, help="Seconds to run with each setting.")
+    soak.add_argument("--lag", type=float, default=6000, help="Extra milliseconds calls to the lagging follower take.")
+    soak.add_argument("--lag-every", type=float, default=15.0, help="Seconds between the starts of lag spells.")
+    soak.add_argument("--lag-for", type=float, default=8.0, help="Seconds each lag spell lasts.")
+    soak.add_argument("--interval", type=float, default=50, help="Milliseconds between writes.")
+    soak.set_defaults(run=bench_soak)
+
+    election = scenarios.add_parser("election", help=bench_election.__doc__)
+    election.add_argument("--rtt", type=float, default=1, help="Simulated round-trip time in milliseconds.")
+    election.add_argument("--rounds", type=int, default=20, help="Elections to time per case.")
+    election.add_argument("--lag", type=float, default=5000, help="Extra milliseconds calls to the slow peer take.")
+    election.add_argument("--candidate", choices=sorted(raft.NODES), default="node1", help="Node that runs for leader.")
+    election.set_defaults(run=bench_election)
+
+    transfer = scenarios.add_parser("transfer", help=bench_transfer.__doc__)
+    transfer.add_argument("--rtt", type=float, default=1, help="Simulated round-trip time in milliseconds.")
+    transfer.add_argument("--after", type=float, default=1.0, help="Seconds to keep writing once a new leader is in place.")
+    transfer.set_defaults(run=bench_transfer)
+
+    membership = scenarios.add_parser("membership", help=bench_membership.__doc__)
+    membership.add_argument("--rtt", type=float, default=1, help="Simulated round-trip time in milliseconds.")
+    membership.add_argument("--entries", type=int, default=20000, help="Entries in the log before the change; a new node has to copy them.")
+    membership.add_argument("--before", type=float, default=0.5, help="Seconds to write before the change.")
+    membership.add_argument("--after", type=float, default=1.0, help="Seconds to keep writing once the change is done.")
+    membership.set_defaults(run=bench_membership)
+
+    learners = scenarios.add_parser("learners", help=bench_learners.__doc__)
+    learners.add_argument("--rtt", type=float, default=1, help="Simulated round-trip time in milliseconds.")
+    learners.add_argument("--learners", type=int, nargs="+", default=[0, 2, 4], help="Learner counts to compare.")
+    learners.add_argument("--duration", type=float, default=3.0, help="Seconds to run each configuration.")
+    learners.add_argument("--clients", type=int, default=16, help="Concurrent writers.")
+    learners.add_argument("--batch", type=int, default=16, help="Values per submit_values call.")
+    learners.add_argument("--max-staleness", type=float, default=200, help="Staleness bound in ms for the learners' reads.")
+    learners.set_defaults(run=bench_learners)
+
+    reads = scenarios.add_parser("reads", help=bench_reads.__doc__)
+    reads.add_argument("--rtt", type=float, default=1, help="Simulated round-trip time in milliseconds.")
+    reads.add_argument("--duration", type=float, default=3.0, help="Seconds to run each read mode.")
+    reads.add_argument("--clients", type=int, default=16, help="Concurrent readers.")
+    reads.add_argument("--keys", type=int, default=1000, help="Keys written before reading.")
+    reads.add_argument("--max-staleness", type=float, default=200, help="Staleness bound in ms for follower reads.")
+    reads.set_defaults(run=bench_reads)
+
+    kv = scenarios.add_parser("kv", help=bench_kv.__doc__)
+    kv.add_argument("--operations", type=int, default=200000, help="Commands to apply.")
+    kv.add_argument("--keys", type=int, default=10000, help="Distinct keys the commands touch.")
+    kv.add_argument("--batch", type=int, nargs="+", default=[1, 16, 256, 1024], help="apply_batch sizes to compare.")
+    kv.set_defaults(run=bench_kv)
+
+    log = scenarios.add_parser("log", help=bench_log.__doc__)
+    log.add_argument("--entries", type=int, default=1000000, help="Entries in the log.")
+    log.add_argument("--payload", type=int, default=32, help="Bytes per command.")
+    log.add_argument("--batch", type=int, default=512, help="Entries per AppendEntries slice.")
+    log.set_defaults(run=bench_log)
+
+    transport = scenarios.add_parser("transport", help=bench_transport.__doc__)
+    transport.add_argument("--entries", type=int, default=200000, help="Entries to replicate per transport.")
+    transport.add_argument("--payload", type=int, default=100, help="Bytes per command.")
+    transport.add_argument("--batch", type=int, default=512, help="Entries per AppendEntries call.")
+    transport.add_argument("--clients", type=int, default=4, help="Batches in flight at once.")
+    transport.set_defaults(run=bench_transport)
+
+    groups = scenarios.add_parser("groups", help=bench_groups.__doc__)
+    groups.add_argument("--groups", type=int, nargs="+", default=[1, 10, 100], help="Raft groups per host to compare.")
+    groups.add_argument("--base-port", type=int, default=18600, help="First localhost port the nodes listen on.")
+    groups.add_argument("--idle", type=float, default=3.0, help="Seconds to measure CPU use with no client traffic.")
+    groups.add_argument("--duration", type=float, default=3.0, help="Seconds to run the write load.")
+    groups.add_argument("--clients", type=int, default=16, help="Concurrent writers.")
+    groups.add_argument("--batch", type=int, default=16, help="Values per submit_values call.")
+    groups.add_argument("--payload", type=int, default=100, help="Bytes per value.")
+    groups.set_defaults(run=bench_groups)
+
+    args = parser.parse_args()
+    args.run(args)
@@ -0,0 +1,291 @@
+import itertools
+import json
+import socket
+import socketserver
+import struct
+import threading
+import xmlrpc.client
+from array import array
+
+from log_store import LogSlice
+from transport import ReconnectBackoff
+
+
+BINARY_PORT_OFFSET = 1000  # The binary listener runs on the node's XML-RPC port plus this
+
+# Every frame: body length, frame kind, request id. Responses echo the request id, so one
+# connection carries many concurrent calls and replies can come back in any order.
+FRAME_HEADER = struct.Struct("<IBI")
+REQUEST, RESPONSE, FAULT = 1, 2, 3
+
+# Request body: method name, then either JSON arguments or, for AppendEntries, a binary batch
+NAME_HEADER = struct.Struct("<BB")  # name length, argument encoding
+JSON_ARGS, APPEND_ARGS = 0, 1
+APPEND_HEADER = struct.Struct("<qqqqIB")  # term, prev_log_index, prev_log_term, leader_commit, entry count, leader id length
+
+
+def encode_request(method, args):
+    name = method.encode()
+    if method.endswith("receive_append_entries") and isinstance(args[3], LogSlice):
+        term, prev_log_index, prev_log_term, entries, leader_commit = args[:5]
+        leader_id = (args[5] if len(args) > 5 and args[5] else "").encode()
+        # Terms and offsets go out as the arrays' raw bytes and the payload as the arena bytes
+        return b"".join((NAME_HEADER.pack(len(name), APPEND_ARGS), name,
+                         APPEND_HEADER.pack(term, prev_log_index, prev_log_term, leader_commit, len(entries), len(leader_id)),
+                         leader_id, entries.terms.tobytes(), entries.offsets.tobytes(), entries.payload))
+    return NAME_HEADER.pack(len(name), JSON_ARGS) + name + json.dumps(args).encode()
+
+
+def decode_request(body):
+    """Return (method, args) from a request body; AppendEntries batches arrive as a LogSlice."""
+    name_length, encoding = NAME_HEADER.unpack_from(body)
+    position = NAME_HEADER.size + name_length
+    method = bytes(body[NAME_HEADER.size:position]).decode()
+    if encoding == JSON_ARGS:
+        return method, json.loads(bytes(body[position:]))
+
+    term, prev_log_index, prev_log_term, leader_commit, count, leader_id_length = APPEND_HEADER.unpack_from(body, position)
+    position += APPEND_HEADER.size
+    leader_id = bytes(body[position:position + leader_id_length]).decode() or None
+    position += leader_id_length
+    terms, offsets = array("q"), array("q")
+    terms.frombytes(body[position:position + 8 * count])
+    position += 8 * count
+    offsets.frombytes(body[position:position + 8 * (count + 1)])
+    position += 8 * (count + 1)
+    return method, [term, prev_log_index, prev_log_term, LogSlice(terms, offsets, memoryview(body)[position:]), leader_commit, leader_id]
+
+
+def read_exactly(sock, size):
+    data = bytearray(size)
+    view = memoryview(data)
+    received = 0
+    while received < size:
+        chunk = sock.recv_into(view[received:])
+        if not chunk:
+            raise ConnectionResetError("Connection closed by peer.")
+        received += chunk
+    return data
+
+
+def read_frame(sock):
+    length, kind, request_id = FRAME_HEADER.unpack(read_exactly(sock, FRAME_HEADER.size))
+    return kind, request_id, read_exactly(sock, length)
+
+
+def send_frame(sock, kind, request_id, body):
+    sock.sendall(FRAME_HEADER.pack(len(body), kind, request_id) + body)
+
+
+class PendingCall:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class BinaryConnection:
+    """One persistent socket to a peer, multiplexing concurrent calls by request id.
+
+    Calls are written in order on the one stream, so pipelined AppendEntries batches reach
+    the follower in the order they were sent. A reader thread hands each reply to the
+    caller waiting for it. When the socket fails every outstanding call fails with it and
+    the next call reconnects, subject to the same backoff as the XML-RPC transport.
+    """
+
+    def __init__(self, peer, address, timeout=2.0, backoff=0.05, max_backoff=1.0):
+        self.peer = peer
+        self.address = address
+        self.timeout = timeout
+        self.backoff = ReconnectBackoff(backoff, max_backoff)
+        self.sock = None
+        self.lock = threading.Lock()  # Guards sock and pending, and serialises writes
+        self.pending = {}
+        self.ids = itertools.count(1)
+
+    def call(self, method, args):
+        self.backoff.check(self.peer)
+        body = encode_request(method, args)
+        call = PendingCall()
+        with self.lock:
+            sock = self.connect()
+            request_id = next(self.ids) & 0xFFFFFFFF
+            self.pending[request_id] = call
+            try:
+                send_frame(sock, REQUEST, request_id, body)
+            except OSError as e:
+                self.disconnect(sock, e)
+                raise
+        if not call.done.wait(self.timeout):
+            with self.lock:
+                self.pending.pop(request_id, None)
+            raise TimeoutError(f"No reply from {self.peer} to {method} within {self.timeout}s.")
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def connect(self):
+        """Return the open socket, connecting first if needed. Called with self.lock held."""
+        if self.sock is not None:
+            return self.sock
+        try:
+            sock = socket.create_connection(self.address, timeout=self.timeout)
+        except OSError:
+            self.backoff.failed()
+            raise
+        sock.settimeout(None)  # Calls time out individually; the reader blocks until the socket closes
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.backoff.succeeded()
+        self.sock = sock
+        threading.Thread(target=self.read_replies, args=(sock,), name=f"binary-reader-{self.peer}", daemon=True).start()
+        return sock
+
+    def disconnect(self, sock, error):
+        """Close `sock` and fail every call waiting on it. Called with self.lock held."""
+        if self.sock is sock:
+            self.sock = None
+            self.backoff.failed()
+        sock.close()
+        pending, self.pending = self.pending, {}
+        for call in pending.values():
+            call.error = ConnectionResetError(f"Connection to {self.peer} lost: {error}")
+            call.done.set()
+
+    def read_replies(self, sock):
+        try:
+            while True:
+                kind, request_id, body = read_frame(sock)
+                with self.lock:
+                    call = self.pending.pop(request_id, None)
+                if call is None:
+                    continue  # The caller gave up waiting
+                if kind == FAULT:
+                    call.error = xmlrpc.client.Fault(1, body.decode())
+                else:
+                    call.result = json.loads(body)
+                call.done.set()
+        except OSError as e:
+            with self.lock:
+                self.disconnect(sock, e)
+
+    def close(self):
+        with self.lock:
+            if self.sock is not None:
+                self.disconnect(self.sock, "closed")
+
+
+class BinaryProxy:
+    """ServerProxy look-alike: attribute calls become binary RPCs on the peer's connection."""
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __getattr__(self, method):
+        def call(*args):
+            return self.connection.call(method, list(args))
+        return call
+
+
+class BinaryPeerConnections:
+    """Drop-in replacement for transport.PeerConnections that talks the binary protocol."""
+
+    def __init__(self, peers, timeout=2.0, backoff=0.05, max_backoff=1.0):
+        self.options = {"timeout": timeout, "backoff": backoff, "max_backoff": max_backoff}
+        self.proxies = {}
+        for peer, address in peers.items():
+            self.add_peer(peer, address)
+
+    def add_peer(self, peer, address):
+        """Start talking to a peer that joined the cluster."""
+        ip, port = address
+        self.proxies[peer] = BinaryProxy(BinaryConnection(peer, (ip, port + BINARY_PORT_OFFSET), **self.options))
+
+    def remove_peer(self, peer):
+        """Close the connection to a peer that left the cluster."""
+        proxy = self.proxies.pop(peer, None)
+        if proxy is not None:
+            proxy.connection.close()
+
+    def proxy(self, peer):
+        try:
+            return self.proxies[peer]
+        except KeyError:
+            raise ConnectionRefusedError(f"{peer} is not a member of the cluster.") from None
+
+    def encode_entries(self, batch):
+        """Prepare a LogSlice for AppendEntries; called with the node lock held.
+
+        Only the payload bytes are copied, once, so the batch no longer depends on the
+        leader's arena after the lock is released.
+        """
+        return LogSlice(batch.terms, batch.offsets, memoryview(bytes(batch.payload)))
+
+    def close(self):
+        for proxy in self.proxies.values():
+            proxy.connection.close()
+
+
+class BinaryRPCServer(socketserver.ThreadingTCPServer):
+    """Serve the binary protocol for `instance`, running calls on the XML-RPC server's worker pools.
+
+    Each connection gets a reader thread that decodes requests and submits them to the
+    pool `pool_of(method)` names; replies are written back as the calls complete.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, instance, pools, pool_of):
+        self.instance = instance
+        self.pools = pools
+        self.pool_of = pool_of
+        super().__init__(address, BinaryRequestHandler)
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, kwargs={"poll_interval": 0.5}, name="binary-server", daemon=True).start()
+
+    def close(self):
+        self.shutdown()
+        self.server_close()
+
+    def submit(self, method, args):
+        if method.startswith("_"):
+            raise AttributeError(f"Method {method!r} is not supported.")
+        func = getattr(self.instance, method)
+        return self.pools[self.pool_of(method)].submit(func, *args)
+
+
+class BinaryRequestHandler(socketserver.BaseRequestHandler):
+    def setup(self):
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.write_lock = threading.Lock()
+
+    def handle(self):
+        try:
+            while True:
+                kind, request_id, body = read_frame(self.request)
+                try:
+                    method, args = decode_request(body)
+                    future = self.server.submit(method, args)
+                except Exception as e:
+                    self.reply(request_id, FAULT, f"{type(e).__name__}: {e}".encode())
+                    continue
+                future.add_done_callback(lambda future, request_id=request_id: self.complete(request_id, future))
+        except OSError:
+            pass  # Peer went away
+
+    def complete(self, request_id, future):
+        error = future.exception()
+        if error is not None:
+            self.reply(request_id, FAULT, f"{type(error).__name__}: {error}".encode())
+        else:
+            self.reply(request_id, RESPONSE, json.dumps(future.result()).encode())
+
+    def reply(self, request_id, kind, body):
+        try:
+            with self.write_lock:
+                send_frame(self.request, kind, request_id, body)
+        except OSError:
+            pass  # The caller sees the connection drop
@@ -1,6 +1,8 @@
 import xmlrpc.client
 import logging
 import time
+
+from kv import KV_OPS, encode_command
 # Setup logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
@@ -19,26 +21,58 @@ NODES = {
     "node3": "http://10.128.0.5:17002/"
 }
 
+# Learners serve reads and metrics but never vote or lead, e.g. "learner1": "http://10.128.0.7:17003/"
+LEARNERS = {}
+
+RESTART_TIMEOUT = 120  # Seconds to wait for a restarted node to come back and catch up
+last_write_index = -1  # Index of our latest committed write; follower reads wait for it (read-your-writes)
+
+
+def remember_write(index):
+    """Keep the highest log index one of our writes was committed at."""
+    global last_write_index
+    last_write_index = max(last_write_index, index)
+
 
 def find_leader(current_leader=None):
-    """Attempts to find the leader by querying each node, and reprints the leader if it changes."""
+    """Attempts to find the leader by asking each node who leads, and reprints the leader if it changes.
+
+    Any node that hears the leader's heartbeats names it, so this normally takes one RPC, plus
+    one more to confirm when the node names someone else. The result is cached by the caller
+    and only looked up again after a request fails.
+    """
     for node_url in NODES.values():
         try:
-            with xmlrpc.client.ServerProxy(node_url) as client:
-                if client.is_leader():
-                    # If the leader has changed, notify the user
-                    if node_url != current_leader:
-                        logging.info(f"Leader changed: New leader found at {node_url}")
-                    else:
-                        logging.info(f"Leader found at {node_url}")
-                    return node_url
+            with xmlrpc.client.ServerProxy(node_url, allow_none=True) as client:
+                leader = client.get_leader()
+            leader_url = NODES.get(leader)
+            if leader_url and leader_url != node_url:
+                with xmlrpc.client.ServerProxy(leader_url) as client:
+                    if not client.is_leader():
+                        continue  # A stale hint; ask the next node
+            if leader_url:
+                # If the leader has changed, notify the user
+                if leader_url != current_leader:
+                    logging.info(f"Leader changed: New leader found at {leader_url}")
+                else:
+                    logging.info(f"Leader found at {leader_url}")
+                return leader_url
         except Exception as e:
             logging.warning(f"Failed to connect to {node_url}: {e}")
-    
+
     logging.error("Leader not found after checking all nodes.")
     return None
 
 
+def follow_hint(leader_url, result):
+    """Switch to the leader named in a submit_values result, which may have changed since we cached ours."""
+    leader = result.get("leader")
+    if leader in NODES and NODES[leader] != leader_url:
+        logging.info(f"Leader changed: New leader found at {NODES[leader]}")
+        return NODES[leader]
+    return leader_url
+
+
 def delete_log_file(node_url):
     """Sends a request to the specified node to delete its log file."""
     if node_url:
@@ -84,7 +118,7 @@ def set_heartbeat_interval(leader_url):
 
 
 def write_value_to_leader(leader_url,simulate_failure=False):
-    """Submit a value to the current leader."""
+    """Submit a value to the current leader, following the leader its reply names."""
     value = input("Enter the value to write: ")
     logging.info(f"Attempting to write value: {value}")
 
@@ -92,12 +126,13 @@ def write_value_to_leader(leader_url,simulate_failure=False):
         try:
             with xmlrpc.client.ServerProxy(leader_url) as client:
                 client.set_replication_simulation(simulate_failure)
-                response = client.submit_value(value)
-                logging.info(f"Response from leader: {response}")
-                
-                if "Error" in response:
+                [result] = client.submit_values([value])
+                logging.info(f"Response from leader: {result}")
+                if not result["committed"]:
                     logging.warning("Error submitting value, attempting to find new leader.")
                     return find_leader(leader_url)  # Retry finding the leader
+                remember_write(result["index"])
+                return follow_hint(leader_url, result)
         except Exception as e:
             logging.error(f"Failed to submit value to leader at {leader_url}: {e}")
             return find_leader(leader_url)  # Retry finding the leader
@@ -105,6 +140,209 @@ def write_value_to_leader(leader_url,simulate_failure=False):
         logging.warning("No leader found to write to.")
     return leader_url
 
+def write_values_to_leader(leader_url):
+    """Submit several values to the current leader in one group-committed batch."""
+    values = [value.strip() for value in input("Enter the values to write, separated by ';': ").split(";") if value.strip()]
+    logging.info(f"Attempting to write {len(values)} values: {values}")
+
+    if leader_url:
+        try:
+            with xmlrpc.client.ServerProxy(leader_url) as client:
+                client.set_replication_simulation(False)
+                results = client.submit_values(values)
+                for value, result in zip(values, results):
+                    if result["committed"]:
+                        remember_write(result["index"])
+                        logging.info(f"{value!r} committed at index {result['index']}, result: {result['result']}")
+                    else:
+                        logging.warning(f"{value!r} not committed: {result['error']}")
+
+                if not all(result["committed"] for result in results):
+                    logging.warning("Error submitting values, attempting to find new leader.")
+                    return find_leader(leader_url)  # Retry finding the leader
+                if results:
+                    return follow_hint(leader_url, results[0])
+        except Exception as e:
+            logging.error(f"Failed to submit values to leader at {leader_url}: {e}")
+            return find_leader(leader_url)  # Retry finding the leader
+    else:
+        logging.warning("No leader found to write to.")
+    return leader_url
+
+def read_from_node():
+    """Read a key from any node, followers and learners included, either reading our own writes or within a staleness bound."""
+    replicas = {**NODES, **LEARNERS}
+    node = input(f"Enter the node to read from ({', '.join(replicas)}): ")
+    if node not in replicas:
+        logging.warning("Invalid node name. Please enter one of the specified node names.")
+        return
+    key = input("Enter the key to read: ")
+    staleness = input("Enter the maximum staleness in ms (leave empty to read your own writes): ").strip()
+    try:
+        with xmlrpc.client.ServerProxy(replicas[node], allow_none=True) as client:
+            if staleness:
+                reply = client.read_local(key, -1, float(staleness))
+            else:
+                reply = client.read_local(key, last_write_index)
+        if reply["ok"]:
+            logging.info(f"{key} = {reply['value']!r} on {node} (applied through index {reply['index']})")
+        else:
+            logging.warning(f"Read from {node} failed: {reply['error']}")
+    except Exception as e:
+        logging.error(f"Failed to read from {node}: {e}")
+
+def kv_operation(leader_url):
+    """Run one put/get/delete/cas operation against the replicated key-value store."""
+    op = input(f"Enter the operation ({', '.join(KV_OPS)}): ").strip()
+    if op not in KV_OPS:
+        logging.warning("Invalid operation.")
+        return leader_url
+    key = input("Enter the key: ")
+    value = input("Enter the new value: ") if op in ("put", "cas") else None
+    expected = (input("Enter the expected current value (leave empty if the key must be absent): ") or None) if op == "cas" else None
+
+    if leader_url:
+        try:
+            with xmlrpc.client.ServerProxy(leader_url, allow_none=True) as client:
+                [result] = client.submit_values([encode_command(op, key, value, expected)])
+            if result["committed"]:
+                remember_write(result["index"])
+                logging.info(f"{op} {key!r} committed at index {result['index']}, result: {result['result']!r}")
+                return follow_hint(leader_url, result)
+            else:
+                logging.warning(f"{op} {key!r} not committed: {result['error']}")
+                return find_leader(leader_url)  # Retry finding the leader
+        except Exception as e:
+            logging.error(f"Failed to run {op} on leader at {leader_url}: {e}")
+            return find_leader(leader_url)  # Retry finding the leader
+    else:
+        logging.warning("No leader found to send the operation to.")
+    return leader_url
+
+def show_metrics():
+    """Print a node's election counters and its histogram of election times."""
+    node = input("Enter the node to show metrics for (node1, node2, node3): ")
+    if node not in NODES:
+        logging.warning("Invalid node name. Please enter one of the specified node names.")
+        return
+    try:
+        with xmlrpc.client.ServerProxy(NODES[node], allow_none=True) as client:
+            metrics = client.get_metrics()
+    except Exception as e:
+        logging.error(f"Failed to get metrics from {node}: {e}")
+        return
+    elections = metrics["election_seconds"]
+    logging.info(f"{node}: {metrics['elections_won']} of {metrics['elections_started']} elections won, "
+                 f"{elections['sum']:.3f}s spent winning them")
+    for bound, count in zip(elections["bounds"] + [None], elections["counts"]):
+        label = f"<= {bound}s" if bound is not None else "slower"
+        logging.info(f"  {label:>9}: {count}")
+
+def log_length(node_url):
+    """Length of a node's log, or None if it does not answer."""
+    try:
+        with xmlrpc.client.ServerProxy(node_url, allow_none=True) as client:
+            return client.get_log_length()
+    except Exception:
+        return None
+
+def wait_until_caught_up(node, leader_url, timeout=RESTART_TIMEOUT):
+    """Wait until a restarted node answers again and has every entry the leader had when it came back."""
+    deadline = time.time() + timeout
+    needed = None
+    while time.time() < deadline:
+        length = log_length(NODES[node])
+        if length is not None and needed is None:
+            needed = log_length(leader_url)
+        if needed is not None and length is not None and length >= needed:
+            logging.info(f"{node} is back with {length} log entries.")
+            return True
+        time.sleep(0.5)
+    logging.error(f"{node} did not catch up within {timeout} seconds.")
+    return False
+
+def transfer_leadership(leader_url, target):
+    """Ask the leader to hand its role to `target`; returns the new leader's URL, or None if the transfer failed."""
+    try:
+        with xmlrpc.client.ServerProxy(leader_url, allow_none=True) as client:
+            reply = client.transfer_leadership(target)
+    except Exception as e:
+        logging.error(f"Failed to transfer leadership from {leader_url} to {target}: {e}")
+        return None
+    if not reply["ok"]:
+        logging.error(f"Leadership transfer to {target} failed: {reply['error']}")
+        return None
+    logging.info(f"Leadership transferred to {reply['leader']}.")
+    return NODES[reply["leader"]]
+
+def rolling_restart(leader_url):
+    """Restart every node in turn without an election timeout: followers first, then the leader once it has handed over."""
+    leader_url = leader_url or find_leader()
+    if leader_url is None:
+        logging.warning("No leader found; restart the nodes by hand.")
+        return leader_url
+    leader = next(name for name, url in NODES.items() if url == leader_url)
+    for node in [name for name in NODES if name != leader] + [leader]:
+        if node == leader:
+            # Hand over to the follower with the longest log; it has the least to catch up
+            target = max((name for name in NODES if name != leader), key=lambda name: log_length(NODES[name]) or -1)
+            new_leader_url = transfer_leadership(leader_url, target)
+            if new_leader_url is None:
+                logging.warning(f"Stopping the rolling restart; {leader} is still the leader.")
+                return leader_url
+            leader_url = new_leader_url
+        input(f"Restart {node} now, then press Enter: ")
+        if not wait_until_caught_up(node, leader_url):
+            logging.warning("Stopping the rolling restart.")
+            return find_leader(leader_url)
+    logging.info("Rolling restart finished.")
+    return leader_url
+
+def change_membership(leader_url, method, *args):
+    """Call add_node, add_learner or remove_node on the leader and report the configuration it leaves.
+
+    Returns the leader's URL and whether the change was made.
+    """
+    leader_url = leader_url or find_leader()
+    if leader_url is None:
+        logging.warning("No leader found; try again once one is elected.")
+        return leader_url, False
+    try:
+        with xmlrpc.client.ServerProxy(leader_url, allow_none=True) as client:
+            reply = getattr(client, method)(*args)
+    except Exception as e:
+        logging.error(f"{method} on {leader_url} failed: {e}")
+        return None, False
+    if not reply["ok"]:
+        logging.error(f"{method} failed: {reply['error']}")
+    else:
+        logging.info(f"Voters: {', '.join(reply['voters'])}; learners: {', '.join(reply['learners']) or 'none'}.")
+    return NODES.get(reply["leader"], leader_url if reply["ok"] else None), reply["ok"]
+
+def add_node(leader_url, learner=False):
+    """Add a node, already started with --address, to the cluster; it votes once it has caught up, or never as a learner."""
+    members = LEARNERS if learner else NODES
+    name = input(f"Enter the new {'learner' if learner else 'node'}'s name: ")
+    ip = input("Enter its IP address: ")
+    port = int(input("Enter its port: "))
+    previous = members.get(name)
+    members[name] = f"http://{ip}:{port}/"
+    leader_url, added = change_membership(leader_url, "add_learner" if learner else "add_node", name, ip, port)
+    if not added and previous is None:
+        members.pop(name)
+    elif not added:
+        members[name] = previous
+    return leader_url
+
+def remove_node(leader_url):
+    """Remove a node or learner from the cluster; removing the leader hands leadership over first."""
+    name = input(f"Enter the node to remove ({', '.join({**NODES, **LEARNERS})}): ")
+    leader_url, removed = change_membership(leader_url, "remove_node", name)
+    if removed:
+        NODES.pop(name, None)
+        LEARNERS.pop(name, None)
+    return leader_url
+
 def submit_values_with_leader_detection():
     """Main loop for user interactions with the Raft cluster."""
     leader_url = find_leader()  # Initial leader detection
@@ -115,11 +353,20 @@ def submit_values_with_leader_detection():
             'To write values to all nodes through leader enter "2"\n'
             'To write values to only leader and stimulate a failure enter "3"\n'
             'To delete log file of a follower enter "4"\n'
+            'To write several values in one batch through leader enter "5"\n'
+            'To read a key from any node enter "6"\n'
+            'To put/get/delete/cas a key through leader enter "7"\n'
+            'To show a node\'s election metrics enter "8"\n'
+            'To restart every node in turn, handing over leadership first, enter "9"\n'
+            'To add a node to the cluster enter "10"\n'
+            'To remove a node from the cluster enter "11"\n'
+            'To add a non-voting learner to the cluster enter "12"\n'
             '(or "exit" to quit): '
         )
 
         if command == "1":
-            leader_url = set_heartbeat_interval(leader_url)
+            # The long heartbeat pause usually costs the leader its leadership
+            leader_url = find_leader(set_heartbeat_interval(leader_url))
         elif command == "2":
             leader_url = write_value_to_leader(leader_url, simulate_failure=False)
         elif command == "3":
@@ -130,19 +377,31 @@ def submit_values_with_leader_detection():
                 delete_log_file(NODES[node])
             else:
                 logging.warning("Invalid node name. Please enter one of the specified node names.")
+        elif command == "5":
+            leader_url = write_values_to_leader(leader_url)
+        elif command == "6":
+            read_from_node()
+        elif command == "7":
+            leader_url = kv_operation(leader_url)
+        elif command == "8":
+            show_metrics()
+        elif command == "9":
+            leader_url = rolling_restart(leader_url)
+        elif command == "10":
+            leader_url = add_node(leader_url)
+        elif command == "11":
+            leader_url = remove_node(leader_url)
+        elif command == "12":
+            leader_url = add_node(leader_url, learner=True)
         elif command.lower() == "exit":
             logging.info("Exiting.")
             break
         else:
             logging.warning("Invalid command.")
 
-        # Re-check leader after operations
-        leader_url = find_leader(leader_url)
-    
-        # Check if the leader has changed after each command
-        new_leader_url = find_leader(leader_url)
-        if new_leader_url != leader_url:
-            leader_url = new_leader_url  # Update the leader URL if it has changed
+        # The leader is cached between commands; each operation looks it up again when it fails
+        if leader_url is None:
+            leader_url = find_leader()
 
 if __name__ == "__main__":
     submit_values_with_leader_detection()
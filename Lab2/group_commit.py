@@ -0,0 +1,100 @@
+import threading
+import time
+
+from state_machine import ApplyFuture
+
+
+class WriteRequest:
+    """One caller's commands waiting to be folded into the next group commit."""
+
+    def __init__(self, commands):
+        self.commands = commands
+        self.size = sum(len(command) for command in commands)
+        self.futures = None
+        self.ready = threading.Event()
+
+
+class GroupCommitter:
+    """Coalesce concurrent client writes into a single log append.
+
+    Requests that arrive within `window` seconds of the first pending one (or until
+    `max_entries` / `max_bytes` are queued) are appended together, so they share one WAL
+    write and fsync and one AppendEntries round per follower. `append` receives the
+    combined list of commands and must return one ApplyFuture per command.
+    """
+
+    def __init__(self, append, window=0.002, max_entries=256, max_bytes=1024 * 1024):
+        self.append = append
+        self.window = window
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.pending = []
+        self.pending_entries = 0
+        self.pending_bytes = 0
+        self.cond = threading.Condition()
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name="group-commit", daemon=True)
+        self.thread.start()
+
+    def submit(self, commands):
+        """Queue `commands` for the next group commit and return their ApplyFutures."""
+        request = WriteRequest(list(commands))
+        with self.cond:
+            self.pending.append(request)
+            self.pending_entries += len(request.commands)
+            self.pending_bytes += request.size
+            self.cond.notify()
+        request.ready.wait()
+        return request.futures
+
+    def stop(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+
+    def full(self):
+        return self.pending_entries >= self.max_entries or self.pending_bytes >= self.max_bytes
+
+    def run(self):
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.pending or not self.running)
+                if not self.running and not self.pending:
+                    return
+                # Give concurrent writers a short window to join this batch
+                deadline = time.time() + self.window
+                while not self.full() and time.time() < deadline:
+                    self.cond.wait(deadline - time.time())
+                batch = self.take_batch()
+            self.flush(batch)
+
+    def take_batch(self):
+        """Pop requests up to the entry/byte limits, always taking at least one."""
+        batch, entries, size = [], 0, 0
+        while self.pending:
+            request = self.pending[0]
+            if batch and (entries + len(request.commands) > self.max_entries or size + request.size > self.max_bytes):
+                break
+            batch.append(self.pending.pop(0))
+            entries += len(request.commands)
+            size += request.size
+        self.pending_entries -= entries
+        self.pending_bytes -= size
+        return batch
+
+    def flush(self, batch):
+        commands = [command for request in batch for command in request.commands]
+        try:
+            futures = self.append(commands)
+        except Exception as e:
+            print(f"Group commit of {len(commands)} entries failed: {e}")
+            futures = []
+            for _ in commands:
+                future = ApplyFuture(None, None)
+                future.set_error(f"Append failed: {e}")
+                futures.append(future)
+        position = 0
+        for request in batch:
+            request.futures = futures[position:position + len(request.commands)]
+            position += len(request.commands)
+            request.ready.set()
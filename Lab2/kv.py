@@ -0,0 +1,139 @@
+import json
+import zlib
+
+from state_machine import StateMachine
+
+
+KV_OPS = ("put", "get", "delete", "cas")
+RANGE_OPS = ("fence", "ingest", "drop")  # Used by the shard router to move a key range between groups
+SNAPSHOT_FORMAT = 2  # Tag on snapshot(); older snapshots are the plain {key: value} dict
+HASH_SPACE = 1 << 30  # Keys hash into [0, HASH_SPACE); kept below 2**31 so ranges fit XML-RPC ints
+WRONG_SHARD = "WrongShard"  # Error prefix for keys whose range was fenced off for a move
+
+
+def key_hash(key):
+    """Position of `key` in the hash space that shard ranges divide up."""
+    return zlib.crc32(key.encode()) % HASH_SPACE
+
+
+def encode_command(op, key, value=None, expected=None):
+    """Build the log command for one KV operation."""
+    if op not in KV_OPS:
+        raise ValueError(f"Unknown KV operation {op!r}; expected one of {', '.join(KV_OPS)}.")
+    command = {"op": op, "key": key}
+    if op in ("put", "cas"):
+        command["value"] = value
+    if op == "cas":
+        command["expected"] = expected
+    return json.dumps(command, separators=(",", ":"))
+
+
+def encode_range_command(op, lo, hi, values=None):
+    """Build the log command for one operation on the keys hashing into [lo, hi)."""
+    if op not in RANGE_OPS:
+        raise ValueError(f"Unknown range operation {op!r}; expected one of {', '.join(RANGE_OPS)}.")
+    command = {"op": op, "lo": lo, "hi": hi}
+    if op == "ingest":
+        command["values"] = values or {}
+    return json.dumps(command, separators=(",", ":"))
+
+
+class KVStateMachine(StateMachine):
+    """Replicated key-value store: a hash index from key to value, built by applying the log.
+
+    Commands are JSON objects made by encode_command():
+      {"op": "put", "key": k, "value": v}      -> True
+      {"op": "get", "key": k}                  -> the value, or None
+      {"op": "delete", "key": k}               -> whether the key existed
+      {"op": "cas", "key": k, "expected": e, "value": v}
+                                               -> whether the value was e (None: absent) and is now v
+    A plain "key=value" command is a put; any other command is echoed back and changes nothing.
+
+    Range commands from encode_range_command() move the keys hashing into [lo, hi) between groups:
+      {"op": "fence", "lo": l, "hi": h}        -> the range's values; its keys are refused from now on
+      {"op": "ingest", "lo": l, "hi": h, "values": {...}}
+                                               -> True; the values are stored and the range served again
+      {"op": "drop", "lo": l, "hi": h}         -> how many of the (fenced) range's keys were deleted
+    Any command on a key in a fenced range fails with a WRONG_SHARD error instead.
+    """
+
+    def __init__(self):
+        self.values = {}
+        self.fences = []  # [lo, hi) hash ranges whose keys this group no longer serves
+
+    def apply(self, entry):
+        command = entry.command
+        if command.startswith("{"):
+            return self.execute(self.values, json.loads(command))
+        key, sep, value = command.partition("=")
+        if not sep:
+            return command
+        if self.fences and self.fenced(key):
+            return self.wrong_shard(key)
+        self.values[key] = value
+        return True
+
+    def execute(self, values, request):
+        op = request["op"]
+        if op in RANGE_OPS:
+            return self.execute_range(values, op, request["lo"], request["hi"], request.get("values"))
+        key = request["key"]
+        if self.fences and self.fenced(key):
+            return self.wrong_shard(key)
+        if op == "put":
+            values[key] = request["value"]
+            return True
+        if op == "get":
+            return values.get(key)
+        if op == "delete":
+            return values.pop(key, None) is not None
+        if op == "cas":
+            if values.get(key) != request["expected"]:
+                return False
+            values[key] = request["value"]
+            return True
+        raise ValueError(f"unknown op {op!r}")
+
+    def execute_range(self, values, op, lo, hi, ingested):
+        in_range = [key for key in values if lo <= key_hash(key) < hi]
+        if op == "fence":
+            self.fences = self.unfenced(lo, hi) + [[lo, hi]]
+            return {key: values[key] for key in in_range}
+        if op == "ingest":
+            self.fences = self.unfenced(lo, hi)
+            values.update(ingested)
+            return True
+        for key in in_range:
+            del values[key]
+        return len(in_range)
+
+    def unfenced(self, lo, hi):
+        """The fences with [lo, hi) cut out of them."""
+        fences = []
+        for fence_lo, fence_hi in self.fences:
+            if fence_lo < lo:
+                fences.append([fence_lo, min(fence_hi, lo)])
+            if fence_hi > hi:
+                fences.append([max(fence_lo, hi), fence_hi])
+        return fences
+
+    def fenced(self, key):
+        position = key_hash(key)
+        return any(lo <= position < hi for lo, hi in self.fences)
+
+    def wrong_shard(self, key):
+        return f"{WRONG_SHARD}: {key!r} has moved to another group."
+
+    def snapshot(self):
+        return {"format": SNAPSHOT_FORMAT, "values": dict(self.values), "fences": [list(fence) for fence in self.fences]}
+
+    def restore(self, state):
+        if set(state) == {"format", "values", "fences"} and state["format"] == SNAPSHOT_FORMAT:
+            self.values, self.fences = dict(state["values"]), [list(fence) for fence in state["fences"]]
+        else:
+            self.values, self.fences = dict(state), []  # Written before snapshots were tagged: the plain values
+
+    def query(self, key):
+        if self.fences and self.fenced(key):
+            raise LookupError(self.wrong_shard(key))
+        return self.values.get(key)
@@ -0,0 +1,167 @@
+from array import array
+
+
+INITIAL_ARENA_SIZE = 64 * 1024  # Bytes reserved for payloads by an empty LogStore
+
+
+class LogEntry:
+    __slots__ = ("term", "command")
+
+    def __init__(self, term, command):
+        self.term = term
+        self.command = command
+
+    def to_string(self):
+        """Convert log entry to a string format."""
+        return f"{self.term},{self.command}"
+
+    @staticmethod
+    def from_string(entry_str):
+        """Create a LogEntry object from a string format."""
+        term, command = entry_str.split(",", 1)  # Commands may contain commas themselves
+        return LogEntry(int(term), command)
+
+
+class LogSlice:
+    """Consecutive log entries taken from a LogStore without copying their payloads.
+
+    `payload` is a memoryview of the store's arena covering every entry in the slice;
+    `terms` and `offsets` describe the entries within it.
+    """
+
+    __slots__ = ("terms", "offsets", "payload")
+
+    def __init__(self, terms, offsets, payload):
+        self.terms = terms
+        self.offsets = offsets  # len(terms) + 1 arena offsets, starting at the slice's first payload byte
+        self.payload = payload
+
+    def __len__(self):
+        return len(self.terms)
+
+    def __iter__(self):
+        for term, payload in self.records():
+            yield LogEntry(term, str(payload, "utf-8"))
+
+    def __getitem__(self, index):
+        """Contiguous sub-slice, still sharing the payload bytes."""
+        start, stop, step = index.indices(len(self.terms))
+        if step != 1:
+            raise ValueError("LogSlice slices must be contiguous.")
+        stop = max(start, stop)
+        base = self.offsets[0]
+        return LogSlice(self.terms[start:stop], self.offsets[start:stop + 1],
+                        self.payload[self.offsets[start] - base:self.offsets[stop] - base])
+
+    def records(self):
+        """Yield (term, payload) pairs with each payload as a memoryview of the UTF-8 command."""
+        base = self.offsets[0]
+        for i, term in enumerate(self.terms):
+            yield term, self.payload[self.offsets[i] - base:self.offsets[i + 1] - base]
+
+    @property
+    def nbytes(self):
+        return len(self.payload)
+
+
+class LogStore:
+    """Compact in-memory Raft log: entry terms and payload offsets in parallel arrays plus one byte arena.
+
+    An entry costs 16 bytes of index plus its UTF-8 command, instead of a LogEntry object
+    holding an int and a str; LogEntry objects are only built when an entry is read.
+    Positions are relative to the first entry held, like a list.
+
+    The arena is never resized in place. When it fills up it is replaced by a larger copy,
+    so LogSlice views keep pointing at valid bytes while the log grows. A view of entries
+    that are later truncated may see them overwritten, so views are meant to be used
+    straight away.
+    """
+
+    def __init__(self, entries=()):
+        self.terms = array("q")
+        self.offsets = array("q", [0])  # Entry i's payload is arena[offsets[i]:offsets[i + 1]]
+        self.arena = bytearray(INITIAL_ARENA_SIZE)
+        self.extend(entries)
+
+    def __len__(self):
+        return len(self.terms)
+
+    def __iter__(self):
+        for i in range(len(self.terms)):
+            yield self[i]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self.terms))
+            if step != 1:
+                raise ValueError("LogStore slices must be contiguous.")
+            return self.view(start, max(start, stop))
+        if index < 0:
+            index += len(self.terms)
+        if not 0 <= index < len(self.terms):
+            raise IndexError(f"Log position {index} out of range.")
+        return LogEntry(self.terms[index], self.arena[self.offsets[index]:self.offsets[index + 1]].decode())
+
+    def __delitem__(self, index):
+        """Delete a prefix (compaction) or a suffix (truncation) of the log."""
+        start, stop, step = index.indices(len(self.terms))
+        if step != 1 or (start > 0 and stop < len(self.terms)):
+            raise ValueError("LogStore can only delete a prefix or a suffix of the log.")
+        if start >= stop:
+            return
+        if stop == len(self.terms):
+            # The arena keeps the bytes; later appends overwrite them
+            del self.terms[start:]
+            del self.offsets[start + 1:]
+            return
+        base, end = self.offsets[stop], self.offsets[-1]
+        arena = bytearray(max(INITIAL_ARENA_SIZE, 2 * (end - base)))
+        arena[:end - base] = memoryview(self.arena)[base:end]
+        self.arena = arena
+        self.terms = self.terms[stop:]
+        self.offsets = array("q", (offset - base for offset in self.offsets[stop:]))
+
+    def term(self, index):
+        """Term of the entry at `index`, without building a LogEntry."""
+        return self.terms[index]
+
+    def contains(self, data, start=0):
+        """Whether the payloads of the entries from position `start` on hold `data`, searched in place."""
+        return self.arena.find(data, self.offsets[start], self.offsets[-1]) >= 0
+
+    def view(self, start, stop):
+        """LogSlice of entries [start, stop) sharing the arena's payload bytes."""
+        return LogSlice(self.terms[start:stop], self.offsets[start:stop + 1],
+                        memoryview(self.arena)[self.offsets[start]:self.offsets[stop]])
+
+    def append(self, entry):
+        self.extend((entry,))
+
+    def extend(self, entries):
+        if isinstance(entries, LogSlice):
+            self.extend_slice(entries)
+            return
+        start = end = self.offsets[-1]
+        payloads = []
+        for entry in entries:
+            payload = entry.command.encode()
+            payloads.append(payload)
+            end += len(payload)
+            self.terms.append(entry.term)
+            self.offsets.append(end)
+        self.write(start, b"".join(payloads))
+
+    def extend_slice(self, entries):
+        """Append a LogSlice by copying its payload bytes as they are, without decoding them."""
+        start = self.offsets[-1]
+        shift = start - entries.offsets[0]
+        self.terms.extend(entries.terms)
+        self.offsets.extend(array("q", (offset + shift for offset in entries.offsets[1:])))
+        self.write(start, entries.payload)
+
+    def write(self, start, data):
+        if start + len(data) > len(self.arena):
+            arena = bytearray(max(2 * len(self.arena), start + len(data)))
+            arena[:start] = memoryview(self.arena)[:start]
+            self.arena = arena
+        self.arena[start:start + len(data)] = data
@@ -0,0 +1,45 @@
+import bisect
+import threading
+
+
+# Bucket upper bounds in seconds, from a fast local round trip up to a badly stalled election
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """Counts of observed values per bucket, with their total count and sum.
+
+    `bounds` are the buckets' inclusive upper bounds, in increasing order; values above
+    the last bound land in one extra overflow bucket. Safe to use from several threads.
+    """
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        with self.lock:
+            self.counts[bisect.bisect_left(self.bounds, value)] += 1
+            self.count += 1
+            self.sum += value
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-quantile; None if nothing was observed or it overflowed."""
+        with self.lock:
+            if not self.count:
+                return None
+            rank = q * self.count
+            seen = 0
+            for bound, count in zip(self.bounds, self.counts):
+                seen += count
+                if seen >= rank:
+                    return bound
+            return None
+
+    def to_dict(self):
+        """Plain values for an RPC reply; `counts` has one more entry than `bounds`, the overflow bucket."""
+        with self.lock:
+            return {"bounds": list(self.bounds), "counts": list(self.counts), "count": self.count, "sum": self.sum}
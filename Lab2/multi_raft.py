@@ -0,0 +1,322 @@
+import argparse
+import asyncio
+import json
+import os
+import time
+import xmlrpc.client
+
+from async_node import DEFAULT_GROUP, HEARTBEAT_INTERVAL, AsyncRaftHost
+from node import (APPEND_MAX_ENTRIES, LEARNER_REPLICATION_INTERVAL, READ_MODE, READ_MODES, SNAPSHOT_THRESHOLD, STATE_MACHINES, WAL_FSYNC_INTERVAL,
+                  WAL_FSYNC_POLICY, WAL_SEGMENT_SIZE)
+from shard_map import SHARD_MAP_GROUP
+from wal import FSYNC_POLICIES, SegmentedWAL
+
+
+# Shared WAL records put "kind, group, log index" in front of the command, separated by
+# FIELD_SEPARATOR (which group names therefore must not contain)
+FIELD_SEPARATOR = "\x1f"
+ENTRY = "E"  # A log entry of the group at that index
+TRUNCATE = "T"  # The group dropped every entry at or after that index
+RESET = "R"  # The group dropped its whole log; its next entry has that index
+
+# Lab3's cluster config, found relative to this file so it works from any directory. It lists
+# node3 in clusterA at 10.128.0.7:17007 and in clusterB at 10.128.0.8:17008; one process serves
+# both of node3's groups, on its clusterA address, and clusterB's members reach it there.
+CONFIG_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Lab3", "raft", "config_file.json")
+
+
+def load_groups(config_file):
+    """Read a Lab3-style config file and return ({group: [members]}, {node: (ip, port)}).
+
+    Every top-level object mapping node names to [ip, port] is a group (clusterA, clusterB, ...);
+    other sections such as "coordinator" are ignored. A node serves all of its groups from one
+    process, so it listens on the address of the first group that lists it. Unless the config
+    defines the SHARD_MAP_GROUP itself, the members of the first group also keep the shard map.
+    """
+    with open(config_file, "r") as f:
+        config = json.load(f)
+    groups, nodes = {}, {}
+    for group, members in config.items():
+        if not isinstance(members, dict) or not members:
+            continue
+        if not all(isinstance(address, list) and len(address) == 2 for address in members.values()):
+            continue
+        groups[group] = list(members)
+        for name, (ip, port) in members.items():
+            if name not in nodes:
+                nodes[name] = (ip, port)
+            elif nodes[name] != (ip, port):
+                print(f"{name} is listed at {ip}:{port} for {group} but serves every group on {nodes[name][0]}:{nodes[name][1]}.")
+    if groups and SHARD_MAP_GROUP not in groups:
+        groups[SHARD_MAP_GROUP] = list(next(iter(groups.values())))
+    return groups, nodes
+
+
+def load_learners(config_file, nodes):
+    """Read the optional "learners" section, {group: {node: [ip, port]}}, of a config file; returns {group: [learners]}.
+
+    Learners get a group's log and serve follower reads but never vote. Those not already in
+    `nodes` are added to it, so every host can reach them.
+    """
+    with open(config_file, "r") as f:
+        config = json.load(f)
+    learners = {}
+    for group, members in config.get("learners", {}).items():
+        learners[group] = list(members)
+        for name, (ip, port) in members.items():
+            nodes.setdefault(name, (ip, port))
+    return learners
+
+
+class SharedWAL:
+    """One segmented write-ahead log shared by every Raft group on a host.
+
+    Each record carries its group and log index, so the groups' entries, truncations and
+    resets interleave in one append-only stream and replay rebuilds every group's log.
+    Writes made during one loop iteration, from any number of groups, go to disk with a
+    single write and (with the "batch" policy) a single fsync. A sealed segment is deleted
+    once every group it holds entries for has compacted past them.
+    """
+
+    def __init__(self, directory, segment_size=WAL_SEGMENT_SIZE, fsync_policy=WAL_FSYNC_POLICY, fsync_interval=WAL_FSYNC_INTERVAL):
+        self.wal = SegmentedWAL(directory, segment_size=segment_size, fsync_policy=fsync_policy, fsync_interval=fsync_interval)
+        self.pins = {}  # segment first index -> {group: highest log index it holds an entry for}
+        self.floors = {}  # group -> index below which the group needs no entries
+        self.pending = []  # (group, kind, index, term, payload) waiting for flush()
+        self.flushed = None  # Future resolved by the next flush()
+        self.replayed = self.replay()
+
+    def replay(self):
+        """Rebuild every group's log from the records on disk; returns {group: [first_index, entries]}."""
+        records = self.wal.load()
+        groups = {}
+        position = 0
+        for segment in self.wal.segments:
+            pins = self.pins.setdefault(segment.first_index, {})
+            for term, payload in records[position:position + segment.count]:
+                kind, group, index, command = payload.split(FIELD_SEPARATOR, 3)
+                index = int(index)
+                state = groups.get(group)
+                if state is None or kind == RESET or not state[0] <= index <= state[0] + len(state[1]):
+                    state = groups[group] = [index, []]
+                del state[1][index - state[0]:]
+                if kind == ENTRY:
+                    state[1].append((term, command))
+                    pins[group] = max(pins.get(group, -1), index)
+            position += segment.count
+        return groups
+
+    def group(self, group):
+        """The GroupWAL for `group`, holding whatever it had in the WAL."""
+        first_index, entries = self.replayed.pop(group, (0, []))
+        return GroupWAL(self, group, first_index, entries)
+
+    def write(self, group, kind, index, entries):
+        """Queue records for flush(); returns a future resolved once they are written, or None if already written."""
+        for offset, (term, command) in enumerate(entries):
+            header = FIELD_SEPARATOR.join((kind, group, str(index + offset), "")).encode()
+            self.pending.append((group, kind, index + offset, term, header + (command.encode() if isinstance(command, str) else bytes(command))))
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.flush()  # Not serving yet, e.g. a node setting up its log
+            return None
+        if self.flushed is None:
+            self.flushed = loop.create_future()
+            loop.call_soon(self.flush)
+        return self.flushed
+
+    def flush(self):
+        pending, self.pending = self.pending, []
+        flushed, self.flushed = self.flushed, None
+        try:
+            self.wal.append([(term, payload) for _, _, _, term, payload in pending])
+        except OSError as e:
+            if flushed is None:
+                raise
+            flushed.set_exception(e)
+            return
+        pins = self.pins.setdefault(self.wal.segments[-1].first_index, {})
+        for group, kind, index, _, _ in pending:
+            if kind == ENTRY:
+                pins[group] = max(pins.get(group, -1), index)
+        if flushed is not None:
+            flushed.set_result(len(pending))
+
+    def compact(self, group, index):
+        """Note that `group` needs no entries below `index` and delete the sealed segments nobody needs."""
+        self.floors[group] = max(self.floors.get(group, 0), index)
+        removed = 0
+        while len(self.wal.segments) > 1:
+            segment = self.wal.segments[0]
+            pins = self.pins.get(segment.first_index, {})
+            if any(last_index >= self.floors.get(pinned, 0) for pinned, last_index in pins.items()):
+                break
+            removed += self.wal.compact(segment.next_index)
+            self.pins.pop(segment.first_index, None)
+        return removed
+
+    def close(self):
+        if self.pending:
+            self.flushed = None
+            self.flush()
+        self.wal.close()
+
+
+class GroupWAL:
+    """One group's part of a SharedWAL, offering the SegmentedWAL methods the nodes use.
+
+    append() returns the SharedWAL's future for the write instead of writing synchronously.
+    """
+
+    def __init__(self, shared, group, first_index, entries):
+        self.shared = shared
+        self.group = group
+        self.first = first_index
+        self.next = first_index + len(entries)
+        self.entries = entries  # Handed out once, by load()
+
+    def load(self):
+        entries, self.entries = self.entries, []
+        return entries
+
+    def first_index(self):
+        return self.first
+
+    def next_index(self):
+        return self.next
+
+    def append(self, entries):
+        if not entries:
+            return None
+        index = self.next
+        self.next += len(entries)
+        return self.shared.write(self.group, ENTRY, index, entries)
+
+    def truncate(self, index):
+        if index >= self.next:
+            return
+        self.next = index
+        self.first = min(self.first, index)
+        self.shared.write(self.group, TRUNCATE, index, [(0, "")])
+
+    def compact(self, index):
+        return self.shared.compact(self.group, index)
+
+    def reset(self, start_index=0):
+        self.first = self.next = start_index
+        self.shared.write(self.group, RESET, start_index, [(0, "")])
+        self.shared.compact(self.group, start_index)
+
+    def close(self):
+        pass  # The host closes the shared WAL
+
+
+class MultiRaftHost(AsyncRaftHost):
+    """AsyncRaftHost for hundreds of groups: one shared WAL and one heartbeat per peer per tick.
+
+    Every HEARTBEAT_INTERVAL the host sends each peer a single receive_heartbeats call
+    covering all the groups it leads that the peer belongs to, instead of one heartbeat
+    per group. Entries, snapshots and the heartbeats reads ask for still go per group,
+    over the one connection to that peer.
+    """
+
+    host_methods = {"receive_heartbeats"}
+
+    def __init__(self, name, nodes, segment_size=WAL_SEGMENT_SIZE, fsync_policy=WAL_FSYNC_POLICY,
+                 fsync_interval=WAL_FSYNC_INTERVAL, log_dir="./logs", **host_options):
+        super().__init__(name, nodes, **host_options)
+        self.log_dir = log_dir
+        self.wal = SharedWAL(f"{log_dir}/{name}.shared", segment_size=segment_size, fsync_policy=fsync_policy,
+                             fsync_interval=fsync_interval)
+        self.heartbeat_task = None
+        self.heartbeats_inflight = set()  # Peers whose last batch has not been answered yet
+
+    def add_group(self, group, members=None, **node_options):
+        if FIELD_SEPARATOR in group:
+            raise ValueError(f"Group name {group!r} must not contain {FIELD_SEPARATOR!r}.")
+        node_options.setdefault("log_dir", self.log_dir)
+        node = super().add_group(group, members, wal=self.wal.group(group), **node_options)
+        node.batched_heartbeats = True
+        return node
+
+    async def start(self, clients=True):
+        await super().start(clients)
+        self.heartbeat_task = asyncio.create_task(self.run_heartbeats())
+
+    async def close(self):
+        self.heartbeat_task.cancel()
+        await super().close()
+        self.wal.close()
+
+    async def run_heartbeats(self):
+        while True:
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+            batches = {}
+            for node in self.groups.values():
+                if node.is_leader_flag:
+                    for peer in node.peers:
+                        batches.setdefault(peer, []).append(node)
+            for peer, nodes in batches.items():
+                if peer not in self.heartbeats_inflight:
+                    asyncio.create_task(self.send_heartbeats(peer, nodes))
+
+    async def send_heartbeats(self, peer, nodes):
+        self.heartbeats_inflight.add(peer)
+        sent_at = time.time()
+        terms = [node.current_term for node in nodes]
+        heartbeats = [[node.group, term, node.commit_index, node.match_index[peer]] for node, term in zip(nodes, terms)]
+        try:
+            accepted = await self.proxy(peer, DEFAULT_GROUP).receive_heartbeats(heartbeats, self.name)
+        except (OSError, xmlrpc.client.Fault):
+            return
+        finally:
+            self.heartbeats_inflight.discard(peer)
+        for node, term, ok in zip(nodes, terms, accepted):
+            if ok and node.is_leader_flag and node.current_term == term:
+                node.acknowledged(peer, sent_at)
+
+    def receive_heartbeats(self, heartbeats, leader_id=None):
+        """Deliver a peer's batched [group, term, leader_commit, match_index] heartbeats; returns whether each was accepted."""
+        return [group in self.groups and self.groups[group].receive_heartbeat(term, leader_commit, match_index, leader_id)
+                for group, term, leader_commit, match_index in heartbeats]
+
+
+async def serve(args):
+    groups, nodes = load_groups(args.config)
+    learners = load_learners(args.config, nodes)
+    if args.node_name not in nodes:
+        raise SystemExit(f"{args.node_name} is not a member or learner of any group in {args.config}.")
+    host = MultiRaftHost(args.node_name, nodes, segment_size=args.segment_size, fsync_policy=args.fsync,
+                         fsync_interval=args.fsync_interval)
+    for group, members in groups.items():
+        if args.node_name in members or args.node_name in learners.get(group, ()):
+            state_machine = STATE_MACHINES["shardmap" if group == SHARD_MAP_GROUP else args.state_machine]()
+            host.add_group(group, members, learners=learners.get(group, ()), learner_interval=args.learner_interval,
+                           snapshot_threshold=args.snapshot_threshold, append_max_entries=args.append_max_entries,
+                           read_mode=args.read_mode, state_machine=state_machine)
+    await host.start()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await host.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run every Raft group a node belongs to in one process.")
+    parser.add_argument("node_name", help="The name of the node to run, as it appears in the config file.")
+    parser.add_argument("--config", default=CONFIG_FILE, help="Config file mapping each group (cluster) to its members, and optionally its learners.")
+    parser.add_argument("--segment-size", type=int, default=WAL_SEGMENT_SIZE, help="Shared WAL segment size in bytes.")
+    parser.add_argument("--fsync", choices=FSYNC_POLICIES, default=WAL_FSYNC_POLICY, help="When to fsync the shared WAL.")
+    parser.add_argument("--fsync-interval", type=float, default=WAL_FSYNC_INTERVAL, help="Seconds between fsyncs for --fsync interval.")
+    parser.add_argument("--snapshot-threshold", type=int, default=SNAPSHOT_THRESHOLD, help="Applied entries between snapshots (0 disables them).")
+    parser.add_argument("--append-max-entries", type=int, default=APPEND_MAX_ENTRIES, help="Entries per AppendEntries batch.")
+    parser.add_argument("--state-machine", choices=STATE_MACHINES, default="kv", help="State machine committed entries are applied to.")
+    parser.add_argument("--read-mode", choices=READ_MODES, default=READ_MODE, help="Default mode for linearizable reads.")
+    parser.add_argument("--learner-interval", type=float, default=LEARNER_REPLICATION_INTERVAL, help="Seconds between batches to each learner.")
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        print(f"{args.node_name} has shut down cleanly.")
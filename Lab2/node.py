@@ -1,14 +1,29 @@
 
 
-import xmlrpc.client
 from xmlrpc.server import SimpleXMLRPCServer
 from xmlrpc.server import SimpleXMLRPCRequestHandler
+from socketserver import ThreadingMixIn
+from concurrent.futures import ThreadPoolExecutor
 import os
 import threading
 import time
 import random
 import argparse
+import json
 import logging
+from collections import deque
+
+from wal import SegmentedWAL, FSYNC_POLICIES
+from snapshot import SnapshotStore
+from state_machine import LoggingStateMachine, ApplyFuture
+from kv import KVStateMachine
+from shard_map import ShardMapStateMachine
+from log_store import LogEntry, LogSlice, LogStore
+from binary_transport import BinaryPeerConnections, BinaryRPCServer, BINARY_PORT_OFFSET
+from transport import RPC_ERRORS, PeerConnections
+from replication import LearnerReplicator, PeerReplicator, LEARNER_INTERVAL, MAX_APPEND_ENTRIES, PIPELINE_DEPTH, PIPELINE_MAX_BYTES
+from group_commit import GroupCommitter
+from metrics import Histogram
 
 
 # Define IPs and ports for each node in the cluster
@@ -24,64 +39,286 @@ NODES = {
     "node3": ("10.128.0.5", 17002)
 }
 
+# Learners: extra replicas that receive the log and serve follower reads, but never vote or
+# count toward commits. More can be attached to a running cluster with add_learner.
+# LEARNERS = {
+#     "reader1": ("10.128.0.8", 17003)
+# }
+LEARNERS = {}
+
+# Write-ahead log settings, overridable from the command line
+WAL_SEGMENT_SIZE = 4 * 1024 * 1024  # Bytes per segment before rolling over to a new one
+WAL_FSYNC_POLICY = "batch"  # One of "batch", "interval" or "never"
+WAL_FSYNC_INTERVAL = 1.0  # Seconds between fsyncs when the policy is "interval"
+SNAPSHOT_THRESHOLD = 1000  # Applied entries between automatic snapshots (0 disables them)
+APPLY_TIMEOUT = 5.0  # Seconds a client waits for its entry to be committed and applied
+APPLY_BATCH_ENTRIES = 1024  # Committed entries handed to the state machine in one apply_batch call
+STATE_MACHINES = {"kv": KVStateMachine, "logging": LoggingStateMachine, "shardmap": ShardMapStateMachine}
+
+# Elections. A follower that heard from a leader less than ELECTION_TIMEOUT_MIN ago refuses
+# to vote, which is what lets the leader serve lease reads for (nearly) that long. A node
+# counts its own start as leader contact, since it may have acknowledged a leader just
+# before restarting: it grants no (pre-)votes for ELECTION_TIMEOUT_MIN after booting.
+ELECTION_TIMEOUT_MIN = 2.0
+ELECTION_TIMEOUT_MAX = 5.0
+# PreVote: a node whose timer fires first asks whether a majority would vote for it, and only
+# bumps its term for a real election if so. CheckQuorum: a leader that no majority has
+# acknowledged for an election timeout steps down instead of hanging on to a dead term.
+PRE_VOTE = True
+CHECK_QUORUM = True
+VOTE_TIMEOUT = 1.0  # Seconds a candidate waits for a majority of (pre-)votes before giving up on the round
+TRANSFER_TIMEOUT = ELECTION_TIMEOUT_MIN  # Seconds a leader waits for the target of a transfer to catch up
+NOOP_COMMAND = ""  # Appended by every new leader so it commits an entry from its own term
+
+# Membership changes, one server at a time. The configuration (voters, plus learners that get the
+# log but never vote or count toward commits) is a log entry: CONFIG_PREFIX followed by JSON.
+# Every node uses the newest configuration in its log as soon as it is appended, committed or not.
+CONFIG_PREFIX = "raft-config:"
+CATCHUP_ROUNDS = 10  # Replication rounds a new node gets to come within an election timeout of the leader
+CATCHUP_TIMEOUT = 60.0  # Seconds a single catch-up round may take before add_node gives up
+
+# Linearizable reads served by the leader without a log write
+READ_MODES = ("read_index", "lease")
+READ_MODE = "read_index"  # Default mode for read() calls that do not name one
+LEASE_CLOCK_DRIFT = 0.1  # Fraction of the lease given up to clock drift between nodes
+FRESHNESS_HISTORY = 64  # Leader commit indexes a follower remembers while it catches up
+
+# Group commit: concurrent client writes are coalesced into one append, fsync and replication round
+BATCH_WINDOW = 0.002  # Seconds to wait for more writers after the first one arrives
+BATCH_MAX_ENTRIES = 256  # Flush early once this many entries are queued
+BATCH_MAX_BYTES = 1024 * 1024  # Flush early once this many command bytes are queued
+
+# Peer RPC connection pool settings
+RPC_POOL_SIZE = 4  # Persistent keep-alive connections per peer
+RPC_TIMEOUT = 2.0  # Seconds before a peer RPC (or waiting for a pooled connection) times out
+RPC_BACKOFF = 0.05  # Initial delay before reconnecting to a peer after a connection failure
+RPC_MAX_BACKOFF = 1.0  # Upper bound for the exponential reconnect backoff
+# Peer-to-peer transport. "binary" sends length-prefixed frames over one persistent socket per
+# peer, listening on port + BINARY_PORT_OFFSET; XML-RPC stays served for clients and old peers.
+TRANSPORTS = ("xmlrpc", "binary")
+TRANSPORT = "xmlrpc"
+
+# Pipelined replication: AppendEntries batches a leader keeps in flight to each follower
+APPEND_MAX_ENTRIES = MAX_APPEND_ENTRIES  # Entries per AppendEntries batch
+PIPELINE_MAX_INFLIGHT = PIPELINE_DEPTH  # Outstanding batches per follower (1 disables pipelining)
+PIPELINE_MAX_INFLIGHT_BYTES = PIPELINE_MAX_BYTES  # Outstanding command bytes per follower
+PIPELINE_REORDER_WAIT = 0.05  # Seconds a follower holds a batch that overtook its predecessor
+LEARNER_REPLICATION_INTERVAL = LEARNER_INTERVAL  # Seconds between the leader's batches to each learner
+
+# RPC server worker pools. Control-plane calls (heartbeats, votes, leader probes) run on
+# their own workers so they are never queued behind replication or client calls, and
+# replication has its own so client calls, which may wait up to APPLY_TIMEOUT for an
+# entry, can never hold up the AppendEntries that delivers it.
+SERVER_CONTROL_WORKERS = 2
+SERVER_REPLICATION_WORKERS = 4  # One per AppendEntries batch a leader keeps in flight
+SERVER_BULK_WORKERS = 8
+SERVER_MAX_CONNECTIONS = 64  # Open connections before the server stops accepting new ones
+CONTROL_METHODS = {
+    "receive_heartbeat",
+    "vote",
+    "pre_vote",
+    "timeout_now",
+    "is_leader",
+    "get_leader",
+    "get_metrics",
+    "get_heartbeat_interval",
+    "set_heartbeat_interval",
+    "get_log_length",
+}
+REPLICATION_METHODS = {
+    "receive_append_entries",
+    "install_snapshot",
+}
+
+
+def rpc_pool(method):
+    """Name of the server worker pool that runs `method`: control, replication, or bulk for everything else."""
+    if method in CONTROL_METHODS:
+        return "control"
+    if method in REPLICATION_METHODS:
+        return "replication"
+    return "bulk"
+
+
+def initial_config():
+    """Configuration of a cluster that has never changed its membership: the nodes in NODES vote, LEARNERS learn."""
+    return {"voters": {name: list(address) for name, address in NODES.items()},
+            "learners": {name: list(address) for name, address in LEARNERS.items()}}
+
+
+def config_with(config, name, role=None, address=None):
+    """Copy of `config` without `name`, or with it as one of `role` ("voters" or "learners") at `address`."""
+    changed = {kind: {member: list(addr) for member, addr in members.items() if member != name} for kind, members in config.items()}
+    if role is not None:
+        changed[role][name] = list(address)
+    return changed
+
+
+def encode_config(config):
+    return CONFIG_PREFIX + json.dumps(config, sort_keys=True)
+
+
+def decode_config(command):
+    return json.loads(command[len(CONFIG_PREFIX):])
+
+
+def is_internal_command(command):
+    """Whether a log entry is for Raft itself (a no-op or a configuration) rather than for the state machine."""
+    return command == NOOP_COMMAND or command.startswith(CONFIG_PREFIX)
+
 
 # server = SimpleXMLRPCServer(("0.0.0.0", NODES['node1'][1]), allow_none=True)  # Adjust for each node's port
 
-class QuietXMLRPCServer(SimpleXMLRPCServer):
-    def __init__(self, *args, **kwargs):
+class QuietXMLRPCServer(ThreadingMixIn, SimpleXMLRPCServer):
+    # Each keep-alive connection gets its own reader thread so one peer cannot hold the server,
+    # while the calls themselves run on bounded worker pools, one per priority class.
+    daemon_threads = True
+
+    def __init__(self, *args, control_workers=SERVER_CONTROL_WORKERS, replication_workers=SERVER_REPLICATION_WORKERS,
+                 bulk_workers=SERVER_BULK_WORKERS, max_connections=SERVER_MAX_CONNECTIONS, **kwargs):
         # Use the QuietXMLRPCRequestHandler to suppress logging
         kwargs['requestHandler'] = QuietXMLRPCRequestHandler
         super().__init__(*args, **kwargs)
+        self.connection_slots = threading.BoundedSemaphore(max_connections)
+        self.pools = {
+            "control": ThreadPoolExecutor(control_workers, thread_name_prefix="rpc-control"),
+            "replication": ThreadPoolExecutor(replication_workers, thread_name_prefix="rpc-replication"),
+            "bulk": ThreadPoolExecutor(bulk_workers, thread_name_prefix="rpc-bulk"),
+        }
+
+    def process_request(self, request, client_address):
+        # Stop accepting once max_connections are open; the backlog holds the rest
+        self.connection_slots.acquire()
+        try:
+            super().process_request(request, client_address)
+        except Exception:
+            self.connection_slots.release()
+            raise
 
+    def process_request_thread(self, request, client_address):
+        try:
+            super().process_request_thread(request, client_address)
+        finally:
+            self.connection_slots.release()
 
+    def _dispatch(self, method, params):
+        return self.pools[rpc_pool(method)].submit(super()._dispatch, method, params).result()
 
-class QuietXMLRPCRequestHandler(SimpleXMLRPCRequestHandler):
-    def log_message(self, format, *args):
-        # Override log_message to suppress all HTTP log messages
-        pass
+    def server_close(self):
+        super().server_close()
+        for pool in self.pools.values():
+            pool.shutdown(wait=False)
 
-class LogEntry:
-    def __init__(self, term, command):
-        self.term = term
-        self.command = command
 
-    def to_string(self):
-        """Convert log entry to a string format."""
-        return f"{self.term},{self.command}"
 
-    @staticmethod
-    def from_string(entry_str):
-        """Create a LogEntry object from a string format."""
-        term, command = entry_str.split(",")
-        return LogEntry(int(term), command)
+class QuietXMLRPCRequestHandler(SimpleXMLRPCRequestHandler):
+    # Keep connections open between requests so peers can reuse them
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
 
+    def log_message(self, format, *args):
+        # Override log_message to suppress all HTTP log messages
+        pass
 
 class Node:
-    def __init__(self, name):
+    def __init__(self, name, segment_size=WAL_SEGMENT_SIZE, fsync_policy=WAL_FSYNC_POLICY, fsync_interval=WAL_FSYNC_INTERVAL,
+                 snapshot_threshold=SNAPSHOT_THRESHOLD, state_machine=None, rpc_pool_size=RPC_POOL_SIZE,
+                 rpc_timeout=RPC_TIMEOUT, rpc_backoff=RPC_BACKOFF, rpc_max_backoff=RPC_MAX_BACKOFF,
+                 control_workers=SERVER_CONTROL_WORKERS, replication_workers=SERVER_REPLICATION_WORKERS,
+                 bulk_workers=SERVER_BULK_WORKERS, max_connections=SERVER_MAX_CONNECTIONS, batch_window=BATCH_WINDOW,
+                 batch_max_entries=BATCH_MAX_ENTRIES, batch_max_bytes=BATCH_MAX_BYTES,
+                 append_max_entries=APPEND_MAX_ENTRIES, pipeline_max_inflight=PIPELINE_MAX_INFLIGHT,
+                 pipeline_max_inflight_bytes=PIPELINE_MAX_INFLIGHT_BYTES, read_mode=READ_MODE, transport=TRANSPORT,
+                 pre_vote=PRE_VOTE, check_quorum=CHECK_QUORUM, learner_interval=LEARNER_REPLICATION_INTERVAL,
+                 log_dir="./logs", address=None):
         self.name = name
-        self.ip, self.port = NODES[name]
+        self.ip, self.port = address or {**NODES, **LEARNERS}[name]  # A node joining with add_node is in neither
         self.peers = {n: addr for n, addr in NODES.items() if n != self.name}
+        if transport == "binary":
+            self.peer_connections = BinaryPeerConnections(self.peers, timeout=rpc_timeout, backoff=rpc_backoff,
+                                                          max_backoff=rpc_max_backoff)
+        else:
+            # Every in-flight batch holds a pooled connection; keep one spare for heartbeats and votes
+            self.peer_connections = PeerConnections(self.peers, pool_size=max(rpc_pool_size, pipeline_max_inflight + 1),
+                                                    timeout=rpc_timeout, backoff=rpc_backoff, max_backoff=rpc_max_backoff)
+        self.server_options = {"control_workers": control_workers, "replication_workers": replication_workers,
+                               "bulk_workers": bulk_workers, "max_connections": max_connections}
         self.lock = threading.Lock()
         self.running = True
         self.is_leader_flag = False
         self.votes_received = 0
         self.current_term = 0
         self.last_heartbeat_time = time.time()
+        self.last_leader_contact = time.time()  # When we last accepted a heartbeat or entries from a leader, or booted
+        self.leader_id = None  # Who led leader_term, learnt from its heartbeats and entries
+        self.leader_term = -1
         self.voted_for = None 
 
         # Initialize log, next_index, and match_index for log replication
         # self.log = []  # List of log entries
-        self.next_index = {peer: 1 for peer in self.peers}  # Next log index to send to each peer
-        self.match_index = {peer: 0 for peer in self.peers}  # Highest log entry known to be replicated on each peer
-        self.commit_index = 0  # Index of the highest log entry known to be committed
-
-        # Set a unique log file for each node
-        self.LOG_FILE = f"./logs/{self.name}.log"
-        self.log = self.load_log_from_file()  # Load existing log entries from file
+        self.next_index = {peer: 0 for peer in self.peers}  # Next log index to send to each peer
+        self.match_index = {peer: -1 for peer in self.peers}  # Highest log entry known to be replicated on each peer
+        self.replicators = {}  # peer -> PeerReplicator (LearnerReplicator for learners) while this node is leader
+        self.ack_cond = threading.Condition()  # Signalled when a follower acknowledges the leader
+        self.noop_index = -1  # Index of this leader's no-op entry; reads wait until it is applied
+        self.read_mode = read_mode
+        self.lease_duration = ELECTION_TIMEOUT_MIN * (1 - LEASE_CLOCK_DRIFT)
+        self.replicator_options = {"max_batch_entries": append_max_entries, "max_inflight": pipeline_max_inflight,
+                                   "max_inflight_bytes": pipeline_max_inflight_bytes}
+        self.learner_interval = learner_interval
+        self.log_appended = threading.Condition(self.lock)  # Signalled when a follower appends entries
+        self.election_timer = threading.Condition(self.lock)  # run_election sleeps on it until its deadline
+        self.votes_arrived = threading.Condition(self.lock)  # Signalled as each (pre-)vote reply comes in
+        self.electing = False  # A (pre-)vote round is running; the lock is released while it waits
+        self.elections_started = 0
+        self.elections_won = 0
+        self.election_seconds = Histogram()  # From the timeout firing to leading, for elections we won
+        self.transfer_target = None  # Peer we are handing leadership to, while a transfer runs
+        self.no_transfer = threading.Event()  # Cleared while a transfer runs; client writes wait for it
+        self.no_transfer.set()
+        self.commit_index = -1  # Index of the highest log entry known to be committed
+        self.last_applied = -1  # Index of the highest log entry applied to the state machine
+
+        # Committed entries are applied on a dedicated applier thread
+        self.state_machine = state_machine or KVStateMachine()
+        self.apply_cond = threading.Condition()  # Signalled whenever commit_index advances
+        self.applied_cond = threading.Condition()  # Signalled whenever last_applied advances
+        self.commit_seen = deque(maxlen=FRESHNESS_HISTORY)  # (time, leader commit index) not yet applied
+        self.fresh_as_of = 0.0  # Our applied state included everything committed as of this time
+        self.apply_lock = threading.RLock()  # Held while applying or snapshotting; taken before self.lock
+        self.pending_results = {}  # log index -> ApplyFuture for entries submitted to this leader
+        self.group_committer = GroupCommitter(self.append_commands, window=batch_window,
+                                              max_entries=batch_max_entries, max_bytes=batch_max_bytes)
+        self.APPLIED_FILE = f"{log_dir}/{self.name}.applied"
+
+        # Snapshot of the applied state; self.log only holds entries after last_included_index
+        self.SNAPSHOT_FILE = f"{log_dir}/{self.name}.snapshot"
+        self.snapshots = SnapshotStore(self.SNAPSHOT_FILE)
+        self.snapshot_threshold = snapshot_threshold
+        self.snapshot_index = -1  # last_included_index of the latest snapshot
+        self.snapshot_term = 0  # last_included_term of the latest snapshot
+        self.base_config = initial_config()  # Configuration as of the snapshot
+        self.load_snapshot()
+        self.load_applied_cursor()
+
+        # Set a unique write-ahead log directory for each node
+        self.LOG_FILE = f"{log_dir}/{self.name}.log"  # Legacy text log, imported once if present
+        self.WAL_DIR = f"{log_dir}/{self.name}"
+        self.wal = SegmentedWAL(self.WAL_DIR, segment_size=segment_size, fsync_policy=fsync_policy, fsync_interval=fsync_interval)
+        self.log = self.load_log_from_file()  # Load existing log entries from the WAL
         self.simulate_replication_failure = False  # Flag for simulating replication failure
 
-        self.election_timeout = random.uniform(2.0, 5.0)
-       
+        # Membership: the newest configuration entry in the log, else the snapshot's, else NODES
+        self.voters = {}  # name -> address of every member whose votes and acknowledgements count, maybe us
+        self.learners = {}  # name -> address of members that only receive the log
+        self.config_entries = []  # (index, config) of every configuration entry in self.log
+        self.membership_lock = threading.Lock()  # Held by the one add_node/remove_node allowed at a time
+        self.load_config()
+
+        self.election_timeout = random.uniform(ELECTION_TIMEOUT_MIN, ELECTION_TIMEOUT_MAX)
+        self.pre_vote_enabled = pre_vote
+        self.check_quorum_enabled = check_quorum
+        self.leader_since = 0.0  # When we last became leader
 
         self.default_heartbeat_interval = 0.1
         self.heartbeat_interval = self.default_heartbeat_interval
@@ -94,38 +331,112 @@ class Node:
 
 
 
-    def request_vote(self):
-        """Request votes from peers to become a candidate."""
-        self.votes_received = 1
+    def start_election(self, transfer=False):
+        """Run a pre-vote round and, if a majority would vote for us, a real election. Called with self.lock held.
+
+        The lock is released while votes come in, so another caller (detect_leader_failure)
+        finds `electing` set and leaves the election to us. An election the leader asked for
+        with TimeoutNow (`transfer`) needs no pre-vote. Only voters stand for election.
+        """
+        if self.electing or not self.running or self.name not in self.voters:
+            return
+        self.electing = True
+        self.elections_started += 1
+        started = time.time()
+        term = self.current_term + 1
+        try:
+            if self.pre_vote_enabled and not transfer:
+                if not self.collect_votes("pre_vote", term):
+                    print(f"{self.name} did not win the pre-vote for term {term}; staying in term {self.current_term}.")
+                    return
+                if self.is_leader_flag or self.current_term >= term or self.last_leader_contact > started:
+                    return  # A leader or a newer term turned up while we asked
+            if self.request_vote(transfer):
+                self.elections_won += 1
+                self.election_seconds.observe(time.time() - started)
+        finally:
+            self.electing = False
+
+    def request_vote(self, transfer=False):
+        """Become a candidate in the next term and lead if a majority votes for us; returns whether we won."""
         self.current_term += 1
+        term = self.current_term
         self.role = "candidate"
-        print(f"{self.name} is requesting votes for term {self.current_term}")
-
-        # Get the term and index of this node's last log entry
-        last_log_index = len(self.log) - 1
-        last_log_term = self.log[last_log_index].term if self.log else 0
-        self.election_timeout = random.uniform(2.0, 5.0)
-        
+        self.voted_for = self.name
+        self.election_timeout = random.uniform(ELECTION_TIMEOUT_MIN, ELECTION_TIMEOUT_MAX)
+        print(f"{self.name} is requesting votes for term {term}")
+        won = self.collect_votes("vote", term, transfer)
+        if not won or self.role != "candidate" or self.current_term != term:
+            return False  # Lost, or a leader or a newer term turned up while we waited
+        self.start_leader()
+        return True
 
-        for peer, (ip, port) in self.peers.items():
+    def collect_votes(self, method, term, transfer=False):
+        """Send `method` (vote or pre_vote) for `term` to every other voter at once; True as soon as a majority of voters, counting us, grants it.
+
+        Called with self.lock held. The lock is released while we wait, so this node keeps
+        answering heartbeats and other candidates. The round ends at the first majority,
+        once every peer has answered, or after VOTE_TIMEOUT; later replies are ignored.
+        A peer that fails in any way counts as a refusal.
+        """
+        last_log_index = self.last_log_index()
+        last_log_term = self.term_at(last_log_index)
+        voters = [peer for peer in self.voters if peer != self.name]
+        majority = len(self.voters) // 2 + 1
+        ballot = {"granted": 1, "answered": 0}
+        args = (self.name, term, last_log_term, last_log_index) + ((True,) if transfer else ())
+
+        def ask(peer):
             try:
-                with xmlrpc.client.ServerProxy(f"http://{ip}:{port}/") as client:
-                    # Pass candidate's term, last log term, and last log index
-                    print(f"time out set for {self.name} to {self.election_timeout} ")
-                    response = client.vote(self.name, self.current_term, last_log_term, last_log_index)
-                    if response:
-                        self.votes_received += 1
-            except ConnectionRefusedError:
-                print(f"Connection to {peer} failed.")
-
-        # Check if received majority votes
-        if self.votes_received > len(self.peers) // 2:
-            self.start_leader()
+                granted = getattr(self.rpc(peer), method)(*args)
+            except RPC_ERRORS as e:
+                print(f"{method} request to {peer} failed: {e}")
+                granted = False
+            with self.votes_arrived:
+                ballot["answered"] += 1
+                ballot["granted"] += bool(granted)
+                self.votes_arrived.notify_all()
+
+        # A thread per request, so a peer that hangs until its RPC times out holds up nobody else's
+        for peer in voters:
+            threading.Thread(target=ask, args=(peer,), daemon=True).start()
+        deadline = time.time() + VOTE_TIMEOUT
+        while ballot["granted"] < majority and ballot["answered"] < len(voters) and self.running:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                print(f"{self.name}: {method} round for term {term} timed out with {ballot['granted']} of {majority} needed.")
+                break
+            self.votes_arrived.wait(remaining)
+        return ballot["granted"] >= majority
+
+    def log_up_to_date(self, last_log_term, last_log_index):
+        """Whether a log ending at (last_log_term, last_log_index) is at least as up-to-date as ours."""
+        my_last_log_index = self.last_log_index()
+        my_last_log_term = self.term_at(my_last_log_index)
+        return last_log_term > my_last_log_term or (last_log_term == my_last_log_term and last_log_index >= my_last_log_index)
+
+    def grants_pre_vote(self, term, last_log_term, last_log_index):
+        """Whether we would vote in `term` for a candidate with this log, without voting or changing term."""
+        if term <= self.current_term:
+            return False
+        if self.is_leader_flag or (self.role == "follower" and time.time() - self.last_leader_contact < ELECTION_TIMEOUT_MIN):
+            return False  # We still have a leader; the candidate is the one cut off
+        return self.log_up_to_date(last_log_term, last_log_index)
 
-    
-    def vote(self, candidate, term, last_log_term, last_log_index):
+    def pre_vote(self, candidate, term, last_log_term, last_log_index):
+        """Answer a PreVote: would we vote for `candidate` in `term`? Changes nothing here."""
+        with self.lock:
+            self.refresh_log_from_file()
+            granted = self.grants_pre_vote(term, last_log_term, last_log_index)
+            print(f"Pre-vote {'granted' if granted else 'denied'} to {candidate} for term {term}")
+            return granted
+
+    def vote(self, candidate, term, last_log_term, last_log_index, transfer=False):
         """Vote for a candidate if the candidate's term is greater than the current term
-        and the candidate's log is at least as up-to-date as this node's log."""
+        and the candidate's log is at least as up-to-date as this node's log.
+
+        `transfer` marks an election the leader started with TimeoutNow; recent contact with
+        that leader is then no reason to refuse."""
         with self.lock:
             self.refresh_log_from_file()
             print(f"Received vote request from {candidate} for term {term} with last_log_term {last_log_term}, last_log_index {last_log_index}")
@@ -134,17 +445,22 @@ class Node:
                 print(f"Vote denied for {candidate}: candidate's term {term} is less than current term {self.current_term}")
                 return False
 
-            my_last_log_index = len(self.log) - 1
-            my_last_log_term = self.log[my_last_log_index].term if self.log else 0
+            if not transfer and self.role == "follower" and time.time() - self.last_leader_contact < ELECTION_TIMEOUT_MIN:
+                # Our leader is alive and may be serving lease reads; don't help depose it
+                print(f"Vote denied for {candidate}: heard from the leader {time.time() - self.last_leader_contact:.2f}s ago")
+                return False
+
+            if term > self.current_term:
+                self.step_down(term)  # A newer term also ends our own leadership, if any
+
+            my_last_log_index = self.last_log_index()
+            my_last_log_term = self.term_at(my_last_log_index)
 
             if (last_log_term < my_last_log_term) or (last_log_term == my_last_log_term and last_log_index < my_last_log_index):
                 print(f"Vote denied for {candidate}: candidate's log is not up-to-date")
                 return False
 
-            if (term > self.current_term) or \
-            (term == self.current_term and not self.voted_for) or \
-            (self.voted_for == candidate):
-                self.current_term = term
+            if not self.voted_for or self.voted_for == candidate:
                 self.voted_for = candidate
                 self.last_heartbeat_time = time.time()  # Reset the election timeout
                 print(f"Vote granted to {candidate} for term {term}")
@@ -155,41 +471,257 @@ class Node:
 
 
 
-    def start_leader(self):
-        """Become the leader and start sending heartbeats."""
-        self.is_leader_flag = True
-        self.votes_received = 0
-        self.role = "leader"
-        print(f"{self.name} is now the leader.")
-        threading.Thread(target=self.heartbeat).start()
-
     def set_heartbeat_interval(self, interval):
         """Set a new heartbeat interval, usually called by the client."""
         self.heartbeat_interval = interval
         # print(f"{self.name} heartbeat interval set to {self.heartbeat_interval} seconds.")
 
 
-    def heartbeat(self):
-        """Send periodic heartbeats to followers."""
-        while self.is_leader_flag:
-            # print(f"{self.name} sending heartbeat (term {self.current_term} )...")
-            for peer, (ip, port) in self.peers.items():
-                try:
-                    with xmlrpc.client.ServerProxy(f"http://{ip}:{port}/") as client:
-                        client.receive_heartbeat(self.current_term)
-                        # print(f"Heartbeat sent to {peer}")
-                except ConnectionRefusedError:
-                    print(f"Connection to {peer} failed.")
-            time.sleep(self.heartbeat_interval)  # Sleep based on the heartbeat interval
-            ##print(self.heartbeat_interval)
-
-    def receive_heartbeat(self, leader_term):
-        """Process a heartbeat received from the leader."""
+    def start_replicators(self):
+        """Start one replicator per follower; they send heartbeats and entries to their followers in parallel."""
+        for replicator in self.replicators.values():
+            replicator.stop()
+        self.replicators = {peer: self.make_replicator(peer) for peer in self.peers}
+        for replicator in self.replicators.values():
+            replicator.start()
+
+    def make_replicator(self, peer):
+        """A replicator for `peer`; learners get one that runs at a lower priority than the voters'."""
+        if peer in self.learners:
+            return LearnerReplicator(self, peer, self.current_term, interval=self.learner_interval, **self.replicator_options)
+        return PeerReplicator(self, peer, self.current_term, **self.replicator_options)
+
+    def lose_leadership(self):
+        """Stop leading but stay in our term, keeping our vote in it. Called with self.lock held."""
+        self.role = "follower"
+        self.is_leader_flag = False
+        for replicator in self.replicators.values():
+            replicator.stop()
+        with self.ack_cond:
+            self.ack_cond.notify_all()  # Reads waiting for a majority can give up now
+
+    def transfer_leadership(self, target):
+        """Hand leadership to `target`: bring its log fully up to date, then send it TimeoutNow.
+
+        Client writes that arrive meanwhile wait, then go to whichever node leads by then. We
+        stop leading just before sending TimeoutNow, so two leaders never serve at once. If
+        the target cannot be told, we lead again in the same term. Returns {ok, error, leader}.
+        """
+        if target not in self.voters:
+            return self.transfer_reply(f"{target} is a learner; only voters can lead." if target in self.learners
+                                       else f"Unknown node {target!r}.")
+        with self.lock:
+            if not self.is_leader_flag:
+                return self.transfer_reply("NotLeader")
+            if target == self.name:
+                return self.transfer_reply()
+            if self.transfer_target is not None:
+                return self.transfer_reply(f"Already transferring leadership to {self.transfer_target}.")
+            self.transfer_target = target
+            self.no_transfer.clear()
+            term = self.current_term
+            replicator = self.replicators[target]
+        print(f"{self.name} is transferring leadership of term {term} to {target}.")
+        try:
+            replicator.request_heartbeat()  # A lagging target gets its missing entries on the reply
+            with self.ack_cond:
+                self.ack_cond.wait_for(lambda: not self.is_leader_flag or self.match_index[target] >= self.last_log_index(),
+                                       timeout=TRANSFER_TIMEOUT)
+            with self.lock:
+                if not self.is_leader_flag or self.current_term != term:
+                    return self.transfer_reply("NotLeader")
+                if self.match_index[target] < self.last_log_index():
+                    return self.transfer_reply(f"Timeout: {target} did not catch up within {TRANSFER_TIMEOUT} seconds.")
+                self.lose_leadership()
+                self.last_heartbeat_time = time.time()  # Give the target a full timeout to win
+            try:
+                self.rpc(target).timeout_now(term, self.name)
+            except RPC_ERRORS as e:
+                with self.lock:
+                    if self.current_term == term and self.role == "follower":
+                        self.start_leader()  # Nobody else can lead our term, so carry on
+                return self.transfer_reply(f"Could not send TimeoutNow to {target}: {e}")
+            deadline = time.time() + TRANSFER_TIMEOUT
+            while self.known_leader() is None and time.time() < deadline:
+                time.sleep(0.01)  # Wait for the new leader's first heartbeat, so held writes know where to go
+            leader = self.known_leader()
+            return self.transfer_reply(None if leader == target else f"{target} did not win the election; leader is {leader}.")
+        finally:
+            with self.lock:
+                self.transfer_target = None
+            self.no_transfer.set()
+
+    def transfer_reply(self, error=None):
+        """Result of transfer_leadership(): whether it worked, why not, and who leads now."""
+        return {"ok": error is None, "error": error, "leader": self.known_leader()}
+
+    def timeout_now(self, term, leader_id):
+        """TimeoutNow from the leader of `term`, handing leadership to us: start an election straight away.
+
+        Returns whether we did; the election runs after we reply.
+        """
+        with self.lock:
+            if term != self.current_term or self.is_leader_flag or self.name not in self.voters:
+                return False
+            print(f"{self.name} got TimeoutNow from {leader_id}; starting an election for term {term + 1}.")
+            self.last_heartbeat_time = time.time()
+        threading.Thread(target=self.run_transfer_election, daemon=True).start()
+        return True
+
+    def run_transfer_election(self):
+        with self.lock:
+            self.start_election(transfer=True)
+
+    def add_node(self, name, ip, port):
+        """Add `name`, listening at ip:port, to the cluster as a voter without pausing writes.
+
+        The node joins as a learner first: it receives the log, but until it has caught up its
+        acknowledgements count toward nothing, so an empty newcomer cannot hold up commits or
+        elections. It is promoted to voter by a second configuration once a replication round
+        to it takes less than an election timeout. Start the node with its address before
+        calling this. Returns membership_reply().
+        """
+        if not self.is_leader_flag:
+            return self.membership_reply("NotLeader")
+        if not self.membership_lock.acquire(blocking=False):
+            return self.membership_reply("Another membership change is in progress.")
+        try:
+            address = [ip, port]
+            config = self.current_config()
+            if name in config["voters"]:
+                return self.membership_reply(None if config["voters"][name] == address else
+                                             f"{name} is already a voter at {config['voters'][name]}; remove it first.")
+            error = None
+            if config["learners"].get(name) != address:
+                print(f"{self.name} is adding {name} at {ip}:{port} as a learner.")
+                error = self.append_config(config_with(config, name, "learners", address))
+            error = error or self.catch_up(name)
+            if error is None:
+                print(f"{self.name} is promoting {name} to voter.")
+                error = self.append_config(config_with(self.current_config(), name, "voters", address))
+            return self.membership_reply(error)
+        finally:
+            self.membership_lock.release()
+
+    def add_learner(self, name, ip, port):
+        """Attach `name`, listening at ip:port, as a learner: a replica that serves follower reads but never votes.
+
+        Commits never wait for a learner, and the leader replicates to it at a lower priority
+        than to the voters. Detach it with remove_node. Returns membership_reply().
+        """
+        if not self.is_leader_flag:
+            return self.membership_reply("NotLeader")
+        if not self.membership_lock.acquire(blocking=False):
+            return self.membership_reply("Another membership change is in progress.")
+        try:
+            address = [ip, port]
+            config = self.current_config()
+            if name in config["voters"]:
+                return self.membership_reply(f"{name} is a voter; remove it before adding it as a learner.")
+            if config["learners"].get(name) == address:
+                return self.membership_reply()
+            print(f"{self.name} is adding {name} at {ip}:{port} as a learner.")
+            return self.membership_reply(self.append_config(config_with(config, name, "learners", address)))
+        finally:
+            self.membership_lock.release()
+
+    def remove_node(self, name):
+        """Remove `name`, voter or learner, from the cluster with one configuration change.
+
+        Asked to remove itself, the leader first hands leadership to the most up-to-date voter,
+        which then makes the change, so writes never wait for an election. Returns membership_reply().
+        """
+        if not self.is_leader_flag:
+            return self.membership_reply("NotLeader")
+        if name == self.name:
+            with self.lock:
+                others = [voter for voter in self.voters if voter != self.name]
+                target = max(others, key=lambda voter: self.match_index.get(voter, -1)) if others else None
+            if target is None:
+                return self.membership_reply("Cannot remove the last voter.")
+            reply = self.transfer_leadership(target)
+            if not reply["ok"]:
+                return self.membership_reply(f"Could not hand leadership to {target} first: {reply['error']}")
+            return self.forward("remove_node", name) or self.membership_reply("No leader available to handle the request.")
+        if not self.membership_lock.acquire(blocking=False):
+            return self.membership_reply("Another membership change is in progress.")
+        try:
+            config = self.current_config()
+            if name not in config["voters"] and name not in config["learners"]:
+                return self.membership_reply()
+            print(f"{self.name} is removing {name} from the cluster.")
+            return self.membership_reply(self.append_config(config_with(config, name)))
+        finally:
+            self.membership_lock.release()
+
+    def append_config(self, config):
+        """Append `config` as the cluster's next configuration and wait until it is committed; returns an error or None.
+
+        A configuration is only appended once the previous one has committed, and once this
+        leader has committed an entry of its own term, which commits any configuration an
+        earlier leader left pending. Called with membership_lock held.
+        """
+        deadline = time.time() + APPLY_TIMEOUT
+        if not self.wait_applied(max(self.noop_index, self.config_index()), deadline):
+            return f"Timeout: the previous configuration was not committed within {APPLY_TIMEOUT} seconds."
+        [future] = self.replicate_entries([LogEntry(self.current_term, encode_config(config))])
+        if not future.wait(max(0.0, deadline - time.time())):
+            return f"Timeout: the configuration at index {future.index} was not committed within {APPLY_TIMEOUT} seconds."
+        return future.error
+
+    def catch_up(self, learner):
+        """Wait until `learner` is close enough to our log to vote; returns an error or None.
+
+        Each round waits for the learner to hold everything we held when the round began. A
+        round shorter than an election timeout means it keeps up with us, so promoting it
+        will not stall commits while it fetches the rest.
+        """
+        for round_number in range(1, CATCHUP_ROUNDS + 1):
+            started = time.time()
+            target = self.last_log_index()
+            with self.ack_cond:
+                caught_up = self.ack_cond.wait_for(
+                    lambda: not self.is_leader_flag or self.match_index.get(learner, -1) >= target, timeout=CATCHUP_TIMEOUT)
+            if not self.is_leader_flag:
+                return "NotLeader"
+            if not caught_up:
+                return f"Timeout: {learner} did not catch up within {CATCHUP_TIMEOUT} seconds; it stays a learner."
+            elapsed = time.time() - started
+            print(f"{learner} caught up to index {target} in round {round_number} ({elapsed:.2f}s).")
+            if elapsed < ELECTION_TIMEOUT_MIN:
+                return None
+        return f"{learner} was still catching up after {CATCHUP_ROUNDS} rounds; it stays a learner."
+
+    def membership_reply(self, error=None):
+        """Result of add_node()/remove_node(): whether it worked, why not, who leads, and the configuration in use."""
+        return {"ok": error is None, "error": error, "leader": self.known_leader(),
+                "voters": sorted(self.voters), "learners": sorted(self.learners)}
+
+    def step_down(self, term):
+        """Adopt a higher term seen in a peer's reply and fall back to follower. Called with self.lock held."""
+        self.current_term = term
+        self.voted_for = None
+        self.role = "follower"
+        self.is_leader_flag = False
+
+    def notify_replicators(self):
+        """Tell every replicator that the leader's log has grown."""
+        for replicator in self.replicators.values():
+            replicator.notify()
+
+    def receive_heartbeat(self, leader_term, leader_commit=-1, match_index=-1, leader_id=None):
+        """Process a heartbeat received from the leader; returns True if we accept it as our leader.
+
+        The leader also sends its commit index and how much of our log it knows matches its
+        own, which keeps our commit index (and follower reads) current between writes.
+        """
         with self.lock:
             if leader_term >= self.current_term:
                 self.current_term = leader_term
+                self.follow_leader(leader_id)
                 ##print(f"heart beat recieve at {self.last_heartbeat_time} from leader"  )
-                self.last_heartbeat_time = time.time()  # Reset the election timeout
+                self.last_heartbeat_time = self.last_leader_contact = time.time()  # Reset the election timeout
+                self.follow_commit_index(leader_commit, match_index)
                 ##print(f"heart reset at {self.last_heartbeat_time} for follower"  )
 
                 
@@ -199,9 +731,55 @@ class Node:
                     self.is_leader_flag = False
                     self.in_cooldown = True  # Enter cooldown after receiving a heartbeat
                     # threading.Timer(self.cooldown_period, self.end_cooldown).start()
+                return True
          
             else:
                 print(f"{self.name} ignored heartbeat with lower term {leader_term}.")
+                return False
+
+    def follow_leader(self, leader_id):
+        """Remember `leader_id` as the leader of the current term. Called with self.lock held."""
+        if leader_id is not None:
+            self.leader_id, self.leader_term = leader_id, self.current_term
+
+    def known_leader(self):
+        """Name of the current term's leader if we know it, else None."""
+        if self.is_leader_flag:
+            return self.name
+        return self.leader_id if self.leader_term == self.current_term else None
+
+    def follow_commit_index(self, leader_commit, matched_index):
+        """Advance our commit index from the leader's, up to the last entry known to match its log.
+
+        Also records how fresh our state is for bounded-staleness reads. Called with self.lock held.
+        """
+        if leader_commit > self.commit_index:
+            prev_commit_index = self.commit_index
+            self.commit_index = max(self.commit_index, min(leader_commit, matched_index, self.last_log_index()))
+            if self.commit_index > prev_commit_index:
+                print(f"{self.name}: Updated commit index from {prev_commit_index} to {self.commit_index}")
+                self.notify_applier()
+
+        # Our state is as fresh as this moment once everything the leader has committed is applied
+        self.update_freshness(leader_commit)
+
+    def update_freshness(self, leader_commit=None):
+        """Move fresh_as_of up to the latest leader commit index we have applied, first noting `leader_commit` as seen now."""
+        with self.applied_cond:
+            if leader_commit is not None:
+                if self.commit_seen and self.commit_seen[-1][1] >= leader_commit:
+                    self.commit_seen[-1] = (time.time(), self.commit_seen[-1][1])
+                else:
+                    self.commit_seen.append((time.time(), leader_commit))
+            while self.commit_seen and self.commit_seen[0][1] <= self.last_applied:
+                self.fresh_as_of = max(self.fresh_as_of, self.commit_seen.popleft()[0])
+            self.applied_cond.notify_all()
+
+    def freshness(self):
+        """Time as of which our applied state is known to include every committed entry."""
+        if self.is_leader_flag and self.last_applied >= self.commit_index:
+            return self.leadership_confirmed_at()  # Nobody else could commit while we were leader
+        return self.fresh_as_of
 
     def periodic_receive_status_print(self):
         """Prints follower's status at the set interval."""
@@ -221,82 +799,371 @@ class Node:
         """Check if the node is the leader."""
         return self.is_leader_flag
 
+    def get_leader(self):
+        """Name of the leader as far as this node knows, or None while there is none."""
+        return self.known_leader()
+
+    def get_metrics(self):
+        """Counters and histograms describing this node, for monitoring."""
+        return {"elections_started": self.elections_started, "elections_won": self.elections_won,
+                "election_seconds": self.election_seconds.to_dict()}
+
 
     def get_heartbeat_interval(self):
         """Get the current heartbeat interval."""
         return self.heartbeat_interval
 
     def run_election(self):
-        """Monitor election timeouts and initiate elections when necessary."""
-        while self.running:
-            with self.lock:
-                
-                # if not self.in_cooldown and (time.time() - self.last_heartbeat_time > self.election_timeout):
-                if (time.time() - self.last_heartbeat_time > self.election_timeout):
+        """Monitor election timeouts and initiate elections when necessary.
 
-                    if self.role == "follower":
-                        print(f"{self.name} timeout, starting election.")
-                        self.last_heartbeat_time = time.time()
-                        self.request_vote()
-                        self.election_timeout = random.uniform(2.0, 5.0)  # Adjust this range as needed
-                        print(f"election timeout {self.election_timeout}")
+        The thread sleeps on election_timer until the current deadline. Heartbeats and appends
+        only move last_heartbeat_time forward, so a healthy follower wakes about once per
+        timeout, finds the deadline has moved and goes back to sleep.
+        """
+        with self.lock:
+            while self.running:
+                remaining = self.last_heartbeat_time + self.election_timeout - time.time()
+                if remaining > 0:
+                    self.election_timer.wait(remaining)
+                    continue
+                if self.role == "leader":
+                    # Check quorum: look again one timeout after a majority last acknowledged us
+                    confirmed_at = max(self.leader_since, self.leadership_confirmed_at())
+                    if not self.check_quorum_enabled or time.time() - confirmed_at < self.election_timeout:
+                        self.last_heartbeat_time = confirmed_at if self.check_quorum_enabled else time.time()
+                        continue
+                    print(f"{self.name} has not heard from a majority for {time.time() - confirmed_at:.2f}s; stepping down.")
+                    self.lose_leadership()
+                    self.last_heartbeat_time = time.time()
+                    continue
+
+                if self.name not in self.voters:
+                    self.last_heartbeat_time = time.time()  # Learners and removed nodes never campaign
+                    continue
+
+                # Followers start an election; candidates that did not win retry in a new term
+                print(f"{self.name} timeout, starting election.")
+                self.last_heartbeat_time = time.time()
+                self.start_election()
+                self.election_timeout = random.uniform(ELECTION_TIMEOUT_MIN, ELECTION_TIMEOUT_MAX)  # Adjust this range as needed
+                print(f"election timeout {self.election_timeout}")
+
+    def stop(self):
+        """Stop every thread of this node: server, election timer, applier, replicators and group commit."""
+        self.running = False
+        with self.lock:
+            self.is_leader_flag = False
+            for replicator in self.replicators.values():
+                replicator.stop()
+            self.election_timer.notify_all()
+            self.votes_arrived.notify_all()
+        self.group_committer.stop()
+        self.notify_applier()
 
     def detect_leader_failure(self):
-        """Actively check for leader failure across the cluster."""
+        """Actively check for leader failure across the cluster.
+
+        An election starts only once we have not heard from a leader for an election timeout
+        and no peer says it leads; every follower answers is_leader() with False, so that
+        alone says nothing. The election goes through the same pre-vote as the timer's.
+        """
         while self.running:
-            for peer, (ip, port) in self.peers.items():
-                try:
-                    with xmlrpc.client.ServerProxy(f"http://{ip}:{port}/") as client:
-                        # Check if any node believes the leader is down
-                        if not client.is_leader():
-                            # Trigger election if leader is confirmed down
-                            self.request_vote()
-                            break
-                except ConnectionRefusedError:
-                    print(f"Connection to {peer} failed.")
             time.sleep(1)  # Check periodically
-        
+            if (self.is_leader_flag or self.name not in self.voters
+                    or time.time() - self.last_leader_contact < self.election_timeout):
+                continue
+            leader_found = False
+            for peer in self.peers:
+                try:
+                    if self.rpc(peer).is_leader():
+                        leader_found = True
+                        break
+                except RPC_ERRORS as e:
+                    print(f"Connection to {peer} failed: {e}")
+            if not leader_found:
+                with self.lock:
+                    if not self.is_leader_flag and time.time() - self.last_leader_contact >= self.election_timeout:
+                        self.last_heartbeat_time = time.time()
+                        self.start_election()
+
     def load_log_from_file(self):
-        """Load the log from a file at startup or initialize to an empty log if the file is missing."""
-        log = []
-        try:
+        """Load the entries after the snapshot from the write-ahead log, importing a legacy text log if present."""
+        log = LogStore(LogEntry(term, command) for term, command in self.wal.load())
+        if not log and self.snapshot_index < 0 and self.wal.first_index() == 0 and os.path.exists(self.LOG_FILE):
             with open(self.LOG_FILE, "r") as f:
-                for line in f:
-                    term, command = line.strip().split(',')
-                    log.append(LogEntry(int(term), command))
-            print(f"{self.name} loaded log from file with {len(log)} entries.")
-        except FileNotFoundError:
-            # Reinitialize log as empty if file is missing
-            log = []
-            print(f"{self.name} log file not found. Starting with an empty log.")
-
+                log = LogStore(LogEntry.from_string(line.strip()) for line in f if line.strip())
+            self.wal.append([(entry.term, entry.command) for entry in log])
+            os.rename(self.LOG_FILE, self.LOG_FILE + ".imported")
+            print(f"{self.name} imported {len(log)} entries from legacy log {self.LOG_FILE}.")
+
+        if self.wal.first_index() > self.log_start() or self.wal.next_index() < self.log_start():
+            # The WAL does not line up with the snapshot; only the snapshot can be trusted.
+            print(f"{self.name}: WAL [{self.wal.first_index()}, {self.wal.next_index()}) does not follow snapshot index {self.snapshot_index}, discarding it.")
+            self.wal.reset(self.log_start())
+            log = LogStore()
+        else:
+            del log[:self.log_start() - self.wal.first_index()]  # Entries already covered by the snapshot
+        print(f"{self.name} loaded log from WAL with {len(log)} entries after snapshot index {self.snapshot_index}.")
         return log
 
     def refresh_log_from_file(self):
-        """Refresh self.log by reloading from the file if it has been updated."""
+        """Pick up entries written to the WAL by someone else, reading only the appended tail.
+
+        The in-memory log is the source of truth; this costs one stat per call unless the
+        WAL actually grew, and only falls back to a full reload if it was truncated or removed.
+        """
+        tail = self.wal.poll_tail()
+        if tail is None:
+            self.log = self.load_log_from_file()
+            self.load_config()
+            print(f"{self.name}: WAL changed underneath us, reloaded {len(self.log)} entries.")
+        elif tail:
+            first_index = self.last_log_index() + 1
+            self.log.extend(LogEntry(term, command) for term, command in tail)
+            self.track_config(first_index)
+            print(f"{self.name}: Picked up {len(tail)} new entries from the WAL tail.")
+
+    def persist_entries(self, entries):
+        """Append a batch of LogEntry objects to the WAL with a single write."""
+        self.wal.append([(entry.term, entry.command) for entry in entries])
+
+    def truncate_log(self, index):
+        """Drop every log entry at or after `index`, in memory and in the WAL."""
+        del self.log[index - self.log_start():]
+        self.wal.truncate(index)
+        if self.config_entries and self.config_entries[-1][0] >= index:
+            self.config_entries = [(i, config) for i, config in self.config_entries if i < index]
+            self.use_config(self.current_config())
+        for lost_index in [i for i in self.pending_results if i >= index]:
+            self.pending_results.pop(lost_index).set_error(f"Entry at index {lost_index} was overwritten by another leader.")
+
+    def log_start(self):
+        """Index of the first entry held in self.log; everything before it lives in the snapshot."""
+        return self.snapshot_index + 1
+
+    def last_log_index(self):
+        """Index of the last entry in the log, or the snapshot's last_included_index if the log is empty."""
+        return self.snapshot_index + len(self.log)
+
+    def term_at(self, index):
+        """Term of the entry at `index`, answering from the snapshot marker at the compaction boundary."""
+        if index == self.snapshot_index:
+            return self.snapshot_term
+        if index < self.log_start():
+            raise IndexError(f"Log index {index} has been compacted into the snapshot at {self.snapshot_index}.")
+        return self.log.term(index - self.log_start())
+
+    def first_index_of_term(self, index):
+        """First index of the run of entries sharing the term of the entry at `index`, stopping at the snapshot."""
+        term = self.term_at(index)
+        while index > self.log_start() and self.term_at(index - 1) == term:
+            index -= 1
+        return index
+
+    def last_index_of_term(self, term, before):
+        """Last index below `before` holding an entry from `term`, or None if our log has none."""
+        index = min(before, self.last_log_index() + 1) - 1
+        while index >= self.log_start():
+            entry_term = self.term_at(index)
+            if entry_term == term:
+                return index
+            if entry_term < term:
+                return None  # Terms only grow along the log
+            index -= 1
+        return None
+
+    def entry_at(self, index):
+        """Log entry at absolute `index`, which must not be compacted."""
+        if index < self.log_start():
+            raise IndexError(f"Log index {index} has been compacted into the snapshot at {self.snapshot_index}.")
+        return self.log[index - self.log_start()]
+
+    def config_at(self, index):
+        """Configuration in effect at log `index`: the newest configuration entry up to it, else the snapshot's."""
+        for entry_index, config in reversed(self.config_entries):
+            if entry_index <= index:
+                return config
+        return self.base_config
+
+    def current_config(self):
+        return self.config_at(self.last_log_index())
+
+    def config_index(self):
+        """Index of the entry holding our current configuration, or -1 if it came from the snapshot or NODES."""
+        return self.config_entries[-1][0] if self.config_entries else -1
+
+    def load_config(self):
+        """Rebuild the configuration from the snapshot's and the configuration entries in the log. Called with self.lock held."""
+        self.config_entries = []
+        self.track_config(self.log_start())
+        self.use_config(self.current_config())
+
+    def track_config(self, first_index):
+        """Switch to the newest configuration among the entries just appended from `first_index` on.
+
+        Called with self.lock held. The new entries' bytes are searched for CONFIG_PREFIX in
+        place, so a batch without a configuration costs no decoding.
+        """
+        start = first_index - self.log_start()
+        if not self.log.contains(CONFIG_PREFIX.encode(), start):
+            return
+        for offset, (_, payload) in enumerate(self.log[start:].records()):
+            command = str(payload, "utf-8")
+            if command.startswith(CONFIG_PREFIX):
+                self.config_entries.append((first_index + offset, decode_config(command)))
+        self.use_config(self.current_config())
+
+    def use_config(self, config):
+        """Make `config` our membership: who votes, who only learns, and which peers we replicate to. Called with self.lock held."""
+        was_learner = self.learners
+        self.voters = {name: tuple(address) for name, address in config["voters"].items()}
+        self.learners = {name: tuple(address) for name, address in config["learners"].items()}
+        peers = {name: address for name, address in {**self.voters, **self.learners}.items() if name != self.name}
+        replicators = dict(self.replicators)  # Replaced, not changed, as others iterate it without the lock
+        for peer, address in self.peers.items():
+            if peers.get(peer) != address:
+                self.peer_connections.remove_peer(peer)
+                if peer in replicators:
+                    replicators.pop(peer).stop()
+        for peer, address in peers.items():
+            joined = self.peers.get(peer) != address
+            if joined:
+                print(f"{self.name}: {peer} at {address[0]}:{address[1]} joined as a {'voter' if peer in self.voters else 'learner'}.")
+                self.peer_connections.add_peer(peer, address)
+                self.next_index[peer] = self.last_log_index()  # Our last entry goes out at once; a mismatch backtracks from it
+                self.match_index[peer] = -1
+            if self.is_leader_flag and (joined or (peer in was_learner) != (peer in self.learners)):
+                if peer in replicators:
+                    replicators[peer].stop()  # Promoted: replicate to it as a voter from now on
+                replicators[peer] = self.make_replicator(peer)
+                replicators[peer].start()
+        self.replicators = replicators
+        self.peers = peers
+
+    def load_snapshot(self):
+        """Restore the applied state from the latest snapshot, if there is one."""
+        snapshot = self.snapshots.load()
+        if snapshot is None:
+            return
+        self.snapshot_index = snapshot["last_included_index"]
+        self.snapshot_term = snapshot["last_included_term"]
+        if snapshot.get("config"):
+            self.base_config = snapshot["config"]
+        self.state_machine.restore(snapshot["state"])
+        self.last_applied = self.commit_index = self.snapshot_index
+        print(f"{self.name} restored snapshot at index {self.snapshot_index} (term {self.snapshot_term}).")
+
+    def load_applied_cursor(self):
+        """Resume a durable state machine from the persisted last_applied cursor."""
+        if not self.state_machine.durable:
+            return  # Rebuilt from the snapshot and the log instead
         try:
-            # Get the current modification time of the log file
-            current_mtime = os.path.getmtime(self.LOG_FILE)
-
-            # Check if the log file has been modified since the last load
-            if getattr(self, 'last_log_mtime', None) != current_mtime:
-                # Load the log entries from the file
-                log = []
-                with open(self.LOG_FILE, "r") as f:
-                    for line in f:
-                        term, command = line.strip().split(',')
-                        log.append(LogEntry(int(term), command))
-
-                # Update the in-memory log and modification time
-                self.log = log
-                self.last_log_mtime = current_mtime  # Update last modification time
-                print(f"{self.name}: Log refreshed from file with {len(self.log)} entries.")
-
-        except FileNotFoundError:
-            # If the file is missing, reset self.log to an empty list
-            self.log = []
-            self.last_log_mtime = None
-            print(f"{self.name}: Log file not found. Resetting to empty log.")
+            with open(self.APPLIED_FILE, "r") as f:
+                cursor = int(f.read().strip())
+        except (FileNotFoundError, ValueError):
+            return
+        if cursor > self.last_applied:
+            # Everything up to the cursor was committed before we went down
+            self.last_applied = self.commit_index = cursor
+            print(f"{self.name} resuming from persisted last_applied {cursor}.")
+
+    def save_applied_cursor(self):
+        """Persist last_applied so a durable state machine does not re-apply entries after a restart."""
+        tmp_path = self.APPLIED_FILE + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(str(self.last_applied))
+        os.replace(tmp_path, self.APPLIED_FILE)
+
+    def maybe_take_snapshot(self):
+        """Take a snapshot once `snapshot_threshold` entries have been applied since the last one."""
+        if self.snapshot_threshold and self.last_applied - self.snapshot_index >= self.snapshot_threshold:
+            self.take_snapshot()
+
+    def take_snapshot(self):
+        """Snapshot the applied state and drop the log (and whole WAL segments) behind it."""
+        with self.apply_lock, self.lock:
+            index = self.last_applied
+            if index <= self.snapshot_index:
+                return False
+            term = self.term_at(index)
+            config = self.config_at(index)
+            self.snapshots.save(index, term, self.state_machine.snapshot(), config)
+            del self.log[:index - self.log_start() + 1]
+            self.snapshot_index = index
+            self.snapshot_term = term
+            self.base_config = config
+            self.config_entries = [(i, config) for i, config in self.config_entries if i > index]
+            removed = self.wal.compact(self.log_start())
+        print(f"{self.name} took snapshot at index {index} (term {term}), removed {removed} WAL segments.")
+        return True
+
+    def install_snapshot(self, term, leader_id, last_included_index, last_included_term, state, config=None):
+        """Follower installs a snapshot from a leader that has already compacted the entries it needs.
+
+        `config` is the configuration as of the snapshot; leaders that predate membership changes send none.
+        """
+        with self.apply_lock, self.lock:
+            if term < self.current_term:
+                return False  # Reject snapshots from an outdated leader
+
+            if term > self.current_term:
+                self.current_term = term
+                self.role = "follower"
+                self.is_leader_flag = False
+            self.follow_leader(leader_id)
+            self.last_heartbeat_time = self.last_leader_contact = time.time()
+
+            if last_included_index <= self.snapshot_index:
+                return True  # We already have everything this snapshot covers
+
+            config = config or self.config_at(last_included_index)
+            self.snapshots.save(last_included_index, last_included_term, state, config)
+            if last_included_index <= self.last_log_index() and self.term_at(last_included_index) == last_included_term:
+                # Our log extends the snapshot consistently: keep the suffix after it
+                del self.log[:last_included_index - self.log_start() + 1]
+                self.snapshot_index = last_included_index
+                self.snapshot_term = last_included_term
+                self.wal.compact(self.log_start())
+                self.config_entries = [(i, entry) for i, entry in self.config_entries if i > last_included_index]
+            else:
+                self.log = LogStore()
+                self.snapshot_index = last_included_index
+                self.snapshot_term = last_included_term
+                self.wal.reset(self.log_start())
+                self.config_entries = []
+            self.base_config = config
+            self.use_config(self.current_config())
+
+            if last_included_index > self.last_applied:
+                self.state_machine.restore(state)
+                self.last_applied = last_included_index
+                self.save_applied_cursor()
+            self.commit_index = max(self.commit_index, last_included_index)
+            print(f"{self.name}: Installed snapshot from {leader_id} at index {last_included_index} (term {last_included_term}).")
+            return True
+
+    def send_snapshot(self, peer, client):
+        """Ship the latest snapshot to a follower whose next_index falls behind the compacted prefix."""
+        snapshot = self.snapshots.load()
+        if snapshot is None:
+            return False
+        success = client.install_snapshot(
+            self.current_term,
+            self.name,
+            snapshot["last_included_index"],
+            snapshot["last_included_term"],
+            snapshot["state"],
+            snapshot.get("config")
+        )
+        if success:
+            self.match_index[peer] = snapshot["last_included_index"]
+            self.next_index[peer] = snapshot["last_included_index"] + 1
+            print(f"Sent snapshot at index {snapshot['last_included_index']} to {peer}.")
+        return success
+
+    def rpc(self, peer):
+        """Return the shared keep-alive XML-RPC proxy for `peer`."""
+        return self.peer_connections.proxy(peer)
 
     def set_replication_simulation(self, simulate_failure):
         """Toggle replication simulation mode based on client request."""
@@ -304,187 +1171,377 @@ class Node:
         status = "enabled" if simulate_failure else "disabled"
         print(f"Replication failure simulation {status} on {self.name}.")
 
-    def append_entries(self, term, entries):
-        """Leader appends entries and attempts replication to followers."""
-        if not self.is_leader_flag:
-            return False
+    def append_entries_reply(self, success, conflict_index=None, conflict_term=None):
+        """Reply to AppendEntries; on a rejection the conflict hints let the leader skip a whole term at once."""
+        return {"success": success, "term": self.current_term, "conflict_index": conflict_index, "conflict_term": conflict_term}
 
-        # Convert each entry to a LogEntry if they are not already objects
-        entries = [LogEntry(term, command) if not isinstance(command, LogEntry) else command for command in entries]
-
-        # Append new entries to leader's log and save to file
-        for entry in entries:
-            self.log.append(entry)
-            with open(self.LOG_FILE, "a") as f:
-                f.write(entry.to_string() + "\n")
-            print(f"{self.name} appended log entry: {entry.to_string()}")
-
-        # Attempt replication to all followers with simulation check
-        for peer, (ip, port) in self.peers.items():
-            if self.simulate_replication_failure and peer != "leader":
-                print(f"Replication to {peer} skipped due to simulation.")
-                continue  # Skip replication to simulate failure
+    def receive_append_entries(self, term, prev_log_index, prev_log_term, entries, leader_commit, leader_id=None):
+        """Follower receives and appends multiple log entries from the leader, ensuring consistency.
 
-            while True:
-                try:
-                    # Simulate regular replication attempts
-                    prev_log_index = self.next_index[peer] - 1
-                    prev_log_term = self.log[prev_log_index].term if prev_log_index >= 0 else 0
-                    entries_to_send = self.log[self.next_index[peer]:]
-
-                    if not entries_to_send:
-                        break  # No new entries to send
-
-                    with xmlrpc.client.ServerProxy(f"http://{ip}:{port}/") as client:
-                        success = client.receive_append_entries(
-                            self.current_term,
-                            prev_log_index,
-                            prev_log_term,
-                            [entry.to_string() for entry in entries_to_send],
-                            self.commit_index
-                        )
-
-                        if success:
-                            self.match_index[peer] = len(self.log) - 1
-                            self.next_index[peer] = len(self.log)
-                            print(f"Successfully updated {peer} with {len(entries_to_send)} entries.")
-                            break
-                        else:
-                            self.next_index[peer] = max(0, self.next_index[peer] - 1)
-                            print(f"Backtracking nextIndex for {peer} to {self.next_index[peer]} due to mismatch.")
-                            time.sleep(0.1)
-                except ConnectionRefusedError:
-                    print(f"Connection to {peer} failed.")
-                    break
-        self.check_commit_index()
-        return True
-     
- 
-
-    def receive_append_entries(self, term, prev_log_index, prev_log_term, entries, leader_commit):
-        """Follower receives and appends multiple log entries from the leader, ensuring consistency."""
-        
-        # Refresh in-memory log from file before processing entries
-        self.refresh_log_from_file()
+        Returns an append_entries_reply() dict. When the log does not match at prev_log_index
+        it carries conflict_term (the term of our entry there, or None if we have no entry
+        there) and conflict_index (the first index of that term, or our log length).
+        `entries` is a LogSlice from the binary transport or "term,command" strings from XML-RPC.
+        """
+        if not isinstance(entries, LogSlice):
+            entries = LogStore(LogEntry.from_string(entry_str) for entry_str in entries)[:]
 
         with self.lock:
+            # Pick up any entries appended to the WAL tail behind our back
+            self.refresh_log_from_file()
+
             if term < self.current_term:
-                return False  # Reject entries from an outdated leader
+                return self.append_entries_reply(False)  # Reject entries from an outdated leader
 
             # Update term and reset role if in a new term
             if term > self.current_term:
                 self.current_term = term
                 self.role = "follower"
                 self.is_leader_flag = False
+            self.follow_leader(leader_id)
 
             # Reset election timer on heartbeat
-            self.last_heartbeat_time = time.time()
+            self.last_heartbeat_time = self.last_leader_contact = time.time()
+
+            # With pipelining a batch can overtake its predecessor on another connection;
+            # give the predecessor a moment to land before making the leader back off
+            if prev_log_index > self.last_log_index():
+                self.log_appended.wait_for(lambda: prev_log_index <= self.last_log_index() or term != self.current_term,
+                                           timeout=PIPELINE_REORDER_WAIT)
+                if term != self.current_term:
+                    return self.append_entries_reply(False)
 
             # Log consistency check at `prev_log_index`
-            if prev_log_index >= len(self.log):
+            if prev_log_index > self.last_log_index():
                 print(f"{self.name}: Missing entry at prev_log_index {prev_log_index}. Leader will backtrack.")
-                return False  # Leader will retry with a lower `nextIndex`
+                return self.append_entries_reply(False, conflict_index=self.last_log_index() + 1)  # Resume after our last entry
 
-            # Ensure log matches at `prev_log_index`
-            if prev_log_index >= 0 and (len(self.log) <= prev_log_index or self.log[prev_log_index].term != prev_log_term):
-                print(f"{self.name}: Log mismatch at index {prev_log_index}. Truncating to resolve conflict.")
-                self.log = self.log[:prev_log_index]  # Truncate to remove conflicting entries
-                with open(self.LOG_FILE, "w") as f:  # Rewrite log file
-                    for entry in self.log:
-                        f.write(entry.to_string() + "\n")
-                return False  # Leader should retry
-
-            # Process and append entries from the leader
-            new_index = prev_log_index + 1
-            for entry_str in entries:
-                entry = LogEntry.from_string(entry_str)
-
-                # Truncate if there's a conflicting entry
-                if new_index < len(self.log) and self.log[new_index].term != entry.term:
-                    self.log = self.log[:new_index]
-                    print(f"{self.name}: Truncated conflicting entries from index {new_index}.")
-                    with open(self.LOG_FILE, "w") as f:  # Rewrite log file
-                        for log_entry in self.log:
-                            f.write(log_entry.to_string() + "\n")
-
-                # Append new entries if beyond current log length
-                if new_index >= len(self.log):
-                    self.log.append(entry)
-                    with open(self.LOG_FILE, "a") as f:
-                        f.write(entry.to_string() + "\n")
-                    print(f"{self.name}: Appended entry at index {new_index}: {entry.to_string()}")
-
-                new_index += 1
-
-            # Update commit index and apply new entries if needed
-            if leader_commit > self.commit_index:
-                prev_commit_index = self.commit_index
-                self.commit_index = min(leader_commit, len(self.log) - 1)
-                if self.commit_index > prev_commit_index:
-                    print(f"{self.name}: Updated commit index from {prev_commit_index} to {self.commit_index}")
-                    self.apply_entries_to_state_machine()
+            # Entries covered by our snapshot are committed and match by definition; skip them
+            if prev_log_index < self.snapshot_index:
+                entries = entries[self.snapshot_index - prev_log_index:]
+                prev_log_index = self.snapshot_index
+                prev_log_term = self.snapshot_term
 
-            return True
+            # Ensure log matches at `prev_log_index`
+            if prev_log_index >= 0 and self.term_at(prev_log_index) != prev_log_term:
+                conflict_term = self.term_at(prev_log_index)
+                conflict_index = self.first_index_of_term(prev_log_index)
+                print(f"{self.name}: Log mismatch at index {prev_log_index} (term {conflict_term} from index {conflict_index}). "
+                      f"Truncating to resolve conflict.")
+                self.truncate_log(prev_log_index)  # Truncate to remove conflicting entries
+                return self.append_entries_reply(False, conflict_index, conflict_term)  # Leader should retry
+
+            # Skip the entries we already hold, truncating at the first one that conflicts
+            first_index = prev_log_index + 1
+            held = 0
+            while held < len(entries) and first_index + held <= self.last_log_index():
+                if self.term_at(first_index + held) != entries.terms[held]:
+                    self.truncate_log(first_index + held)
+                    print(f"{self.name}: Truncated conflicting entries from index {first_index + held}.")
+                    break
+                held += 1
+
+            # Append the rest with a single WAL write, straight from the received bytes
+            new_entries = entries[held:]
+            if new_entries:
+                self.log.extend(new_entries)
+                self.wal.append(list(new_entries.records()))
+                self.track_config(first_index + held)
+                self.log_appended.notify_all()
+                print(f"{self.name}: Appended {len(new_entries)} entries at indexes {first_index + held}-{self.last_log_index()}.")
+
+            # Update commit index and apply new entries if needed. Only the entries this call
+            # checked against the leader's log are known to match, so don't commit past them.
+            self.follow_commit_index(leader_commit, prev_log_index + len(entries))
+            return self.append_entries_reply(True)
 
         
     def get_log_length(self):
-        """Return the length of this node's log."""
+        """Return the length of this node's log, including entries compacted into the snapshot."""
         with self.lock:
-            return len(self.log)
+            return self.last_log_index() + 1
 
    
     def check_commit_index(self):
-        """Check if a new entry can be committed based on follower match indexes."""
-        majority_index = len(self.peers) // 2 + 1
-        for i in range(self.commit_index + 1, len(self.log) + 1):
-            if sum(1 for match in self.match_index.values() if match >= i) >= majority_index:
-                self.commit_index = i
-                print(f"Leader {self.name} committed entry at index {self.commit_index}")
-                self.apply_entries_to_state_machine()
-            else:
-                break
+        """Commit the highest entry from the current term that is stored on a majority of voters, counting the leader if it votes.
 
-    def apply_entries_to_state_machine(self):
-        """Apply committed entries to the state machine up to the commit index."""
-        for i in range(self.commit_index):
-            entry = self.log[i]
-            print(f"{self.name} applying entry {i} (term {entry.term}): {entry.command}")
+        Learners' acknowledgements never count. A leader whose own removal has just committed steps down.
+        """
+        with self.lock:
+            voters = self.voters
+            for i in range(self.last_log_index(), self.commit_index, -1):
+                if self.term_at(i) != self.current_term:
+                    break  # Older entries are only committed indirectly, through one from this term
+                replicas = sum(1 for voter in voters if voter == self.name or self.match_index.get(voter, -1) >= i)
+                if replicas > len(voters) // 2:
+                    self.commit_index = i
+                    print(f"Leader {self.name} committed entry at index {self.commit_index}")
+                    self.notify_applier()
+                    break
+            if self.is_leader_flag and self.name not in voters and self.commit_index >= self.config_index():
+                print(f"{self.name} has been removed from the cluster; stepping down.")
+                self.lose_leadership()
 
+    def notify_applier(self):
+        """Wake the applier thread after commit_index has advanced."""
+        with self.apply_cond:
+            self.apply_cond.notify()
 
+    def has_unapplied_entries(self):
+        return self.last_applied < min(self.commit_index, self.last_log_index())
 
+    def run_applier(self):
+        """Apply committed entries on a dedicated thread whenever commit_index moves past last_applied."""
+        while self.running:
+            with self.apply_cond:
+                self.apply_cond.wait_for(lambda: not self.running or self.has_unapplied_entries(), timeout=1.0)
+            self.apply_entries_to_state_machine()
 
+    def apply_entries_to_state_machine(self):
+        """Apply the range (last_applied, commit_index] to the state machine and resolve waiting clients."""
+        with self.apply_lock:
+            with self.lock:
+                end = min(self.commit_index, self.last_log_index(), self.last_applied + APPLY_BATCH_ENTRIES)
+                batch = [(i, self.entry_at(i)) for i in range(self.last_applied + 1, end + 1)]
+            if not batch:
+                return
+
+            # A leader's no-op only exists to be committed, and configurations took effect when they
+            # were appended; neither carries anything for the state machine
+            results = iter(self.state_machine.apply_batch([entry for _, entry in batch if not is_internal_command(entry.command)]))
+            for index, entry in batch:
+                print(f"{self.name} applying entry {index} (term {entry.term}): {entry.command}")
+                result = next(results) if not is_internal_command(entry.command) else None
+                self.last_applied = index
+                future = self.pending_results.pop(index, None)
+                if future is None:
+                    continue
+                if future.term == entry.term:
+                    future.set_result(result)
+                else:
+                    future.set_error(f"Entry at index {index} was overwritten by another leader.")
+            self.save_applied_cursor()
+            self.update_freshness()
+            self.maybe_take_snapshot()
+
+    def wait_for_result(self, future, timeout=APPLY_TIMEOUT):
+        """Block until the entry behind `future` is applied and describe the outcome for the client."""
+        if not future.wait(timeout):
+            return f"Error: Entry at index {future.index} was not applied within {timeout} seconds."
+        if future.error:
+            return f"Error: {future.error}"
+        return f"Success: Value committed at index {future.index}, result: {future.result}"
+
+    def append_commands(self, commands):
+        """Append one group-committed batch of client commands and return an ApplyFuture per command."""
+        if not self.is_leader_flag:
+            futures = [ApplyFuture(None, None) for _ in commands]
+            for future in futures:
+                future.set_error(f"{self.name} is no longer the leader.")
+            return futures
+        term = self.current_term
+        return self.replicate_entries([LogEntry(term, command) for command in commands])
+
+    def forward(self, method, *args):
+        """Run a client call on the leader and return its reply; None if no leader could be reached.
+
+        The leader we learnt from heartbeats gets the call straight away. Only if we know of
+        none, or it cannot be reached, do we ask the other peers whether they lead. Failing
+        that, we keep trying for VOTE_TIMEOUT: long enough for an election under way, such
+        as one after a leadership transfer, to produce a leader that answers.
+        """
+        deadline = time.time() + VOTE_TIMEOUT
+        while True:
+            if self.is_leader_flag:
+                return getattr(self, method)(*args)  # We won while waiting
+            leader = self.known_leader()
+            if leader in self.peers:
+                try:
+                    return getattr(self.rpc(leader), method)(*args)
+                except RPC_ERRORS as e:
+                    print(f"Connection to {leader} failed: {e}")
+            for peer in self.peers:
+                if peer == leader:
+                    continue
+                try:
+                    client = self.rpc(peer)
+                    if client.is_leader():
+                        return getattr(client, method)(*args)
+                except RPC_ERRORS as e:
+                    print(f"Connection to {peer} failed: {e}")
+            if time.time() >= deadline or not self.running:
+                return None
+            time.sleep(self.heartbeat_interval)
+
+    def submit_values(self, values):
+        """Submit a batch of values through group commit; returns one {index, committed, result, error, leader} per value.
+
+        Forwarded to the leader if this node is not the leader. `leader` names the node that
+        handled the batch, so clients can send the next one there directly.
+        """
+        if any(value.startswith(CONFIG_PREFIX) for value in values):
+            return [{"index": None, "committed": False, "result": None, "leader": self.known_leader(),
+                     "error": f"Values may not start with {CONFIG_PREFIX!r}; use add_node/remove_node."} for _ in values]
+        self.no_transfer.wait(APPLY_TIMEOUT)  # Held while leadership moves, then sent to the new leader
+        if not self.is_leader_flag:
+            results = self.forward("submit_values", values)
+            return results or [{"index": None, "committed": False, "result": None, "error": "No leader available to handle the request.",
+                                "leader": None} for _ in values]
+
+        futures = self.group_committer.submit(values)
+        if values and futures[0].index is None and not self.no_transfer.is_set():
+            # Caught by a leadership transfer before reaching the log, so sending it again is safe
+            return self.submit_values(values)
+        deadline = time.time() + APPLY_TIMEOUT
+        results = []
+        for future in futures:
+            applied = future.wait(max(0.0, deadline - time.time()))
+            if not applied:
+                error = f"Entry at index {future.index} was not applied within {APPLY_TIMEOUT} seconds."
+            else:
+                error = future.error
+            results.append({"index": future.index, "committed": applied and not error, "result": future.result, "error": error,
+                            "leader": self.name})
+        return results
 
     def submit_value(self, value):
         """Submit a value to the leader; if this node is not the leader, it forwards the request."""
+        if value.startswith(CONFIG_PREFIX):
+            return f"Error: Values may not start with {CONFIG_PREFIX!r}; use add_node/remove_node."
+        self.no_transfer.wait(APPLY_TIMEOUT)
         if self.is_leader_flag:
-            # Convert the submitted string value to a LogEntry object for storage
-            entry = LogEntry(self.current_term, value)
-            self.append_entries(self.current_term, [entry])
-            return "Success: Value logged and distributed."
+            # Concurrent submissions share one append, fsync and replication round
+            [future] = self.group_committer.submit([value])
+            if future.index is None and not self.no_transfer.is_set():
+                return self.submit_value(value)  # Caught by a leadership transfer before reaching the log
+            return self.wait_for_result(future)
         else:
-            for peer, (ip, port) in self.peers.items():
-                try:
-                    with xmlrpc.client.ServerProxy(f"http://{ip}:{port}/") as client:
-                        if client.is_leader():
-                            return client.submit_value(value)
-                except ConnectionRefusedError:
-                    print(f"Connection to {peer} failed.")
-            return "Error: No leader available to handle the request."
+            return self.forward("submit_value", value) or "Error: No leader available to handle the request."
         
 
 
+    def read_reply(self, value=None, index=None, error=None):
+        """Result of read(): the value, the commit index it reflects, an error such as "NotLeader", and who leads."""
+        return {"ok": error is None, "value": value, "index": index, "error": error, "leader": self.known_leader()}
+
+    def query_reply(self, key, index):
+        """read_reply() for `key` as of `index`; a state machine that does not serve the key raises LookupError."""
+        try:
+            return self.read_reply(self.state_machine.query(key), index)
+        except LookupError as e:
+            return self.read_reply(error=str(e))
+
+    def read(self, key, mode=None):
+        """Linearizable read of `key` from the leader's state machine, without appending to the log.
+
+        "read_index" confirms leadership with one heartbeat round before answering;
+        "lease" answers straight away while a majority acknowledged us within the lease.
+        Either way the read waits until everything committed before it has been applied.
+        """
+        mode = mode or self.read_mode
+        if mode not in READ_MODES:
+            return self.read_reply(error=f"Unknown read mode {mode!r}; expected one of {', '.join(READ_MODES)}.")
+        deadline = time.time() + APPLY_TIMEOUT
+        since = time.time()
+        if not self.is_leader_flag:
+            return self.read_reply(error="NotLeader")
+
+        # Our commit_index is only complete once an entry from our own term has committed
+        term = self.current_term
+        if self.last_applied < self.noop_index:
+            self.check_commit_index()
+            if not self.wait_applied(self.noop_index, deadline):
+                return self.read_reply(error=f"Timeout: {self.name} has not committed an entry in term {term} yet.")
+        with self.lock:
+            if not self.is_leader_flag or self.current_term != term:
+                return self.read_reply(error="NotLeader")
+            read_index = self.commit_index
+
+        if not (mode == "lease" and self.lease_valid()) and not self.confirm_leadership(since, deadline):
+            if not self.is_leader_flag:
+                return self.read_reply(error="NotLeader")
+            return self.read_reply(error=f"Timeout: a majority did not confirm {self.name} as leader within {APPLY_TIMEOUT} seconds.")
+
+        if not self.wait_applied(read_index, deadline):
+            return self.read_reply(error=f"Timeout: entry {read_index} was not applied within {APPLY_TIMEOUT} seconds.")
+        with self.apply_lock:
+            return self.query_reply(key, read_index)
+
+    def read_local(self, key, min_index=-1, max_staleness_ms=None):
+        """Read `key` from this node's own state machine, which may lag the leader's.
+
+        Any node serves these. The read waits until entry `min_index` has been applied (pass the
+        index a write returned to read your own writes) and, if `max_staleness_ms` is given,
+        until our state is known to include everything committed that long ago. The wait holds
+        a bulk server worker; the entries it waits for arrive on the replication pool.
+        """
+        deadline = time.time() + APPLY_TIMEOUT
+        if not self.wait_applied(min_index, deadline):
+            return self.read_reply(error=f"Timeout: {self.name} had not applied entry {min_index} within {APPLY_TIMEOUT} seconds.")
+        if max_staleness_ms is not None and not self.wait_fresh(time.time() - max_staleness_ms / 1000, deadline):
+            return self.read_reply(error=f"Stale: {self.name} could not get within {max_staleness_ms}ms of the leader.")
+        with self.apply_lock:
+            return self.query_reply(key, self.last_applied)
+
+    def wait_fresh(self, since, deadline):
+        """Block until freshness() reaches `since`; returns False if `deadline` passes first."""
+        with self.applied_cond:
+            while self.freshness() < since:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                # A leader gets fresher through acknowledgements, which do not signal applied_cond
+                self.applied_cond.wait(min(remaining, self.heartbeat_interval))
+        return True
+
+    def wait_applied(self, index, deadline):
+        """Block until last_applied reaches `index`; returns False if `deadline` passes first."""
+        with self.applied_cond:
+            return self.applied_cond.wait_for(lambda: self.last_applied >= index, timeout=max(0.0, deadline - time.time()))
+
+    def leadership_confirmed_at(self):
+        """Send time of the latest request a majority of voters (counting ourselves) acknowledged as coming from their leader."""
+        voters = self.voters
+        needed = len(voters) // 2 + 1 - (self.name in voters)  # Followers we need on top of ourselves
+        if needed <= 0:
+            return time.time()
+        acks = sorted((replicator.acked_at for peer, replicator in self.replicators.items() if peer in voters), reverse=True)
+        return acks[needed - 1] if len(acks) >= needed else 0.0
+
+    def lease_valid(self):
+        """True while no other node can have been elected since our last majority acknowledgement."""
+        return self.is_leader_flag and time.time() < self.leadership_confirmed_at() + self.lease_duration
+
+    def confirm_leadership(self, since, deadline):
+        """Wait until a majority acknowledges a heartbeat sent at or after `since`; False if we time out or lose leadership."""
+        if self.leadership_confirmed_at() >= since:
+            return True
+        # Concurrent reads share the heartbeat each voter's replicator sends next
+        for peer, replicator in list(self.replicators.items()):
+            if peer in self.voters:
+                replicator.request_heartbeat()
+        with self.ack_cond:
+            self.ack_cond.wait_for(lambda: not self.is_leader_flag or self.leadership_confirmed_at() >= since,
+                                   timeout=max(0.0, deadline - time.time()))
+        return self.is_leader_flag and self.leadership_confirmed_at() >= since
+
     def run_server(self):
         """Run the XML-RPC server to handle incoming requests.""" 
 
        
         # with QuietXMLRPCServer((self.ip, self.port), allow_none=True) as server:
-        with QuietXMLRPCServer(("0.0.0.0", self.port), allow_none=True) as server:
+        with QuietXMLRPCServer(("0.0.0.0", self.port), allow_none=True, **self.server_options) as server:
+            server.timeout = 0.5  # Wake up regularly to notice shutdown
 
 
             server.register_instance(self)
             # server.register_function(self.delete_log_file)
             # print(f"{self.name} is listening on {self.ip}:{self.port}")
             logging.info(f"{self.name} is listening on {self.ip}:{self.port}")
+
+            # Peers using the binary transport connect here; calls share the XML-RPC worker pools
+            binary_server = BinaryRPCServer(("0.0.0.0", self.port + BINARY_PORT_OFFSET), self, server.pools, rpc_pool)
+            binary_server.start()
             try:
                 while self.running:
                     server.handle_request()
@@ -492,6 +1549,7 @@ class Node:
                 print(f"{self.name} server is shutting down.")    
                 self.running = False
             finally:
+                binary_server.close()
                 print(f"{self.name} has shut down cleanly.")  
 
 
@@ -500,99 +1558,125 @@ class Node:
         self.is_leader_flag = True
         self.votes_received = 0
         self.role = "leader"
+        self.leader_since = time.time()
         print(f"{self.name} is now the leader.")
         
         # Initialize `next_index` for each follower to the current log length
         # This ensures the leader will start replicating from the latest entry
-        self.next_index = {peer: len(self.log) for peer in self.peers}
-        self.match_index = {peer: 0 for peer in self.peers}  # Reset matchIndex
+        self.next_index = {peer: self.last_log_index() + 1 for peer in self.peers}
+        self.match_index = {peer: -1 for peer in self.peers}  # Reset matchIndex
+
+        # Commit an entry from our own term straight away: it settles anything earlier leaders
+        # left uncommitted, and reads use it to know when our commit_index can be trusted
+        noop = LogEntry(self.current_term, NOOP_COMMAND)
+        self.log.append(noop)
+        self.persist_entries([noop])
+        self.noop_index = self.last_log_index()
         
-        # Start the heartbeat mechanism
-        threading.Thread(target=self.heartbeat).start()
+        # Start the per-follower replicators, which also send the heartbeats
+        self.start_replicators()
 
     def append_entries(self, term, entries):
         """Leader appends entries and attempts replication to followers."""
         if not self.is_leader_flag:
             return False
+        if any(not isinstance(command, LogEntry) and command.startswith(CONFIG_PREFIX) for command in entries):
+            return False  # Configurations only come from add_node/remove_node
 
         # Convert each entry to a LogEntry if they are not already objects
         entries = [LogEntry(term, command) if not isinstance(command, LogEntry) else command for command in entries]
+        self.replicate_entries(entries)
+        return True
 
-        # Append new entries to leader's log and save to file
+    def replicate_entries(self, entries):
+        """Append LogEntry objects to the leader's log, replicate them, and return an ApplyFuture per entry."""
+        # Append new entries to leader's log and save them to the WAL in one write
+        with self.lock:
+            if not self.is_leader_flag:
+                # Lost leadership (or handed it over) since append_commands looked
+                futures = [ApplyFuture(None, None) for _ in entries]
+                for future in futures:
+                    future.set_error(f"{self.name} is no longer the leader.")
+                return futures
+            first_index = self.last_log_index() + 1
+            self.log.extend(entries)
+            self.persist_entries(entries)
+            self.track_config(first_index)
+            futures = []
+            for offset, entry in enumerate(entries):
+                future = ApplyFuture(first_index + offset, entry.term)
+                self.pending_results[future.index] = future
+                futures.append(future)
         for entry in entries:
-            self.log.append(entry)
-            with open(self.LOG_FILE, "a") as f:
-                f.write(entry.to_string() + "\n")
             print(f"{self.name} appended log entry: {entry.to_string()}")
 
-        # Attempt replication to all followers with simulation check
-        for peer, (ip, port) in self.peers.items():
-            if self.simulate_replication_failure and peer != "leader":
-                print(f"Replication to {peer} skipped due to simulation.")
-                continue  # Skip replication to simulate failure
-
-            success = False
-            while not success:
-                try:
-                    # Use `next_index` for determining where to start replication
-                    prev_log_index = self.next_index[peer] - 1
-                    prev_log_term = self.log[prev_log_index].term if prev_log_index >= 0 else 0
-                    entries_to_send = self.log[self.next_index[peer]:]
-
-                    if not entries_to_send:
-                        # No new entries to replicate
-                        break
-
-                    with xmlrpc.client.ServerProxy(f"http://{ip}:{port}/") as client:
-                        success = client.receive_append_entries(
-                            self.current_term,
-                            prev_log_index,
-                            prev_log_term,
-                            [entry.to_string() for entry in entries_to_send],
-                            self.commit_index
-                        )
-
-                        if success:
-                            # Update matchIndex and nextIndex on success
-                            self.match_index[peer] = len(self.log) - 1
-                            self.next_index[peer] = len(self.log)
-                            print(f"Successfully updated {peer} with {len(entries_to_send)} entries.")
-                        else:
-                            # Backtrack nextIndex on failure and retry
-                            self.next_index[peer] = max(0, self.next_index[peer] - 1)
-                            print(f"Backtracking nextIndex for {peer} to {self.next_index[peer]} due to mismatch.")
-                            time.sleep(0.1)  # Short delay to prevent tight looping
-
-                except ConnectionRefusedError:
-                    print(f"Connection to {peer} failed.")
-                    break  # Stop retrying on connection failure
-
-        # Check if entries can be committed after successful replication
-        self.check_commit_index()
-        return True
+        # Hand the entries to the per-follower replicators. Commit advances as soon as a majority
+        # has acknowledged them; a slow follower only delays its own replicator.
+        self.notify_replicators()
+        self.check_commit_index()  # A single-node cluster commits immediately
+        return futures
     
 
     def delete_log_file(self):
-        """Deletes the log file for this node."""
+        """Deletes the write-ahead log for this node."""
         try:
-            os.remove(self.LOG_FILE)
-            logging.info(f"Log file {self.LOG_FILE} deleted successfully.")
+            with self.lock:
+                self.wal.reset(self.log_start())
+                self.log = LogStore()
+                self.load_config()
+            logging.info(f"Write-ahead log {self.WAL_DIR} deleted successfully.")
             return True
-        except FileNotFoundError:
-            logging.error("Log file not found.")
-            return False
         except Exception as e:
             logging.error(f"Error while deleting log file: {e}")
             return False
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Run a Raft Node.")
-    parser.add_argument("node_name", choices=NODES.keys(), help="The name of the node to run (e.g., node1, node2, node3).")
-    
+    parser.add_argument("node_name", help="The name of the node to run (e.g., node1, node2, node3).")
+    parser.add_argument("--address", help="HOST:PORT to listen on, for a new node outside NODES and LEARNERS that joins with add_node or add_learner.")
+    parser.add_argument("--segment-size", type=int, default=WAL_SEGMENT_SIZE, help="WAL segment size in bytes.")
+    parser.add_argument("--fsync", choices=FSYNC_POLICIES, default=WAL_FSYNC_POLICY, help="When to fsync the WAL.")
+    parser.add_argument("--fsync-interval", type=float, default=WAL_FSYNC_INTERVAL, help="Seconds between fsyncs for --fsync interval.")
+    parser.add_argument("--snapshot-threshold", type=int, default=SNAPSHOT_THRESHOLD, help="Applied entries between snapshots (0 disables them).")
+    parser.add_argument("--rpc-pool-size", type=int, default=RPC_POOL_SIZE, help="Keep-alive connections per peer.")
+    parser.add_argument("--rpc-timeout", type=float, default=RPC_TIMEOUT, help="Peer RPC timeout in seconds.")
+    parser.add_argument("--rpc-backoff", type=float, default=RPC_BACKOFF, help="Initial reconnect backoff in seconds.")
+    parser.add_argument("--rpc-max-backoff", type=float, default=RPC_MAX_BACKOFF, help="Maximum reconnect backoff in seconds.")
+    parser.add_argument("--control-workers", type=int, default=SERVER_CONTROL_WORKERS, help="Server workers for heartbeats, votes and probes.")
+    parser.add_argument("--replication-workers", type=int, default=SERVER_REPLICATION_WORKERS, help="Server workers for AppendEntries and snapshots.")
+    parser.add_argument("--bulk-workers", type=int, default=SERVER_BULK_WORKERS, help="Server workers for client calls.")
+    parser.add_argument("--max-connections", type=int, default=SERVER_MAX_CONNECTIONS, help="Concurrent connections the server accepts.")
+    parser.add_argument("--batch-window", type=float, default=BATCH_WINDOW, help="Seconds to coalesce concurrent writes for group commit.")
+    parser.add_argument("--batch-max-entries", type=int, default=BATCH_MAX_ENTRIES, help="Maximum entries per group commit.")
+    parser.add_argument("--batch-max-bytes", type=int, default=BATCH_MAX_BYTES, help="Maximum command bytes per group commit.")
+    parser.add_argument("--append-max-entries", type=int, default=APPEND_MAX_ENTRIES, help="Entries per AppendEntries batch.")
+    parser.add_argument("--pipeline-max-inflight", type=int, default=PIPELINE_MAX_INFLIGHT, help="AppendEntries batches in flight per follower.")
+    parser.add_argument("--pipeline-max-inflight-bytes", type=int, default=PIPELINE_MAX_INFLIGHT_BYTES, help="Command bytes in flight per follower.")
+    parser.add_argument("--learner-interval", type=float, default=LEARNER_REPLICATION_INTERVAL, help="Seconds between batches to each learner.")
+    parser.add_argument("--state-machine", choices=STATE_MACHINES, default="kv", help="State machine committed entries are applied to.")
+    parser.add_argument("--read-mode", choices=READ_MODES, default=READ_MODE, help="Default mode for linearizable reads.")
+    parser.add_argument("--transport", choices=TRANSPORTS, default=TRANSPORT, help="Protocol used to talk to the other nodes.")
+    parser.add_argument("--no-pre-vote", dest="pre_vote", action="store_false", help="Start elections without a pre-vote round.")
+    parser.add_argument("--no-check-quorum", dest="check_quorum", action="store_false", help="Keep leading without hearing from a majority.")
+
     args = parser.parse_args()
     node_name = args.node_name
-
-    node = Node(node_name)
+    address = None
+    if args.address:
+        host, port = args.address.rsplit(":", 1)
+        address = (host, int(port))
+    elif node_name not in NODES and node_name not in LEARNERS:
+        parser.error(f"{node_name} is not in NODES or LEARNERS ({', '.join({**NODES, **LEARNERS})}); give its --address to run it as a new node.")
+
+    node = Node(node_name, segment_size=args.segment_size, fsync_policy=args.fsync, fsync_interval=args.fsync_interval,
+                snapshot_threshold=args.snapshot_threshold, rpc_pool_size=args.rpc_pool_size, rpc_timeout=args.rpc_timeout,
+                rpc_backoff=args.rpc_backoff, rpc_max_backoff=args.rpc_max_backoff, control_workers=args.control_workers,
+                replication_workers=args.replication_workers, bulk_workers=args.bulk_workers, max_connections=args.max_connections, batch_window=args.batch_window,
+                batch_max_entries=args.batch_max_entries, batch_max_bytes=args.batch_max_bytes,
+                append_max_entries=args.append_max_entries, pipeline_max_inflight=args.pipeline_max_inflight,
+                pipeline_max_inflight_bytes=args.pipeline_max_inflight_bytes, learner_interval=args.learner_interval, read_mode=args.read_mode,
+                transport=args.transport, pre_vote=args.pre_vote, check_quorum=args.check_quorum,
+                state_machine=STATE_MACHINES[args.state_machine](), address=address)
     
     # Start the server and election threads
     server_thread = threading.Thread(target=node.run_server)
@@ -601,12 +1685,16 @@ if __name__ == "__main__":
     election_thread = threading.Thread(target=node.run_election)
     election_thread.start()
 
+    applier_thread = threading.Thread(target=node.run_applier)
+    applier_thread.start()
+
     try:
         while True:
             time.sleep(1)
     except KeyboardInterrupt:
         print(f"{node_name} shutting down.")
-        node.running = False
+        node.stop()
         server_thread.join()
         election_thread.join()
+        applier_thread.join()
         print(f"{node_name} has shut down clean")
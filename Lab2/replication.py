@@ -0,0 +1,258 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from transport import RPC_ERRORS
+
+
+MAX_APPEND_ENTRIES = 512  # Entries sent to a follower in one AppendEntries call
+PIPELINE_DEPTH = 4  # AppendEntries calls allowed in flight to one follower
+PIPELINE_MAX_BYTES = 4 * 1024 * 1024  # Command bytes allowed in flight to one follower
+LEARNER_INTERVAL = 0.05  # Seconds a learner's replicator lets entries gather before sending them
+
+
+class PeerReplicator:
+    """Replicates the leader's log to a single follower on its own thread.
+
+    One replicator runs per follower for the duration of a leadership term, so a slow or
+    partitioned follower only delays itself. Replication is pipelined: up to
+    `max_inflight` AppendEntries batches (and `max_inflight_bytes` of commands) may be
+    outstanding at once. next_index advances optimistically when a batch is sent and
+    match_index when it is acknowledged. A rejection rolls next_index back and starts a
+    new epoch, so replies to batches sent before the rollback no longer move it.
+    When there is nothing to send the replicator falls back to heartbeats.
+    """
+
+    def __init__(self, node, peer, term, max_inflight=PIPELINE_DEPTH, max_inflight_bytes=PIPELINE_MAX_BYTES,
+                 max_batch_entries=MAX_APPEND_ENTRIES):
+        self.node = node
+        self.peer = peer
+        self.term = term
+        self.max_inflight = max_inflight
+        self.max_inflight_bytes = max_inflight_bytes
+        self.max_batch_entries = max_batch_entries
+        self.wakeup = threading.Event()
+        self.stopped = False
+        self.last_sent = 0.0
+        self.acked_at = 0.0  # Send time of the latest request the follower accepted us as leader for
+        self.heartbeat_requested = False
+        self.retry_at = 0.0  # Don't send entries before this time after a connection failure
+        self.skipped_index = -1  # Last index we reported as skipped by the replication simulation
+
+        # Pipeline state, guarded by node.lock
+        self.epoch = 0
+        self.inflight = {}  # batch id -> command bytes
+        self.inflight_bytes = 0
+        self.next_batch_id = 0
+
+        self.senders = ThreadPoolExecutor(max_inflight, thread_name_prefix=f"append-{peer}")
+        self.thread = threading.Thread(target=self.run, name=f"replicator-{peer}", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped = True
+        self.wakeup.set()
+        self.senders.shutdown(wait=False)
+
+    def notify(self):
+        """Wake the replicator because the leader has appended new entries."""
+        self.wakeup.set()
+
+    def request_heartbeat(self):
+        """Send a heartbeat now, even with batches in flight, so a read can confirm our leadership."""
+        self.heartbeat_requested = True
+        self.wakeup.set()
+
+    def acknowledged(self, sent_at):
+        """Record that the follower still followed us when it answered a request sent at `sent_at`."""
+        node = self.node
+        with node.ack_cond:
+            self.acked_at = max(self.acked_at, sent_at)
+            node.ack_cond.notify_all()
+
+    def active(self):
+        node = self.node
+        return not self.stopped and node.running and node.is_leader_flag and node.current_term == self.term
+
+    def tick(self):
+        """Longest the replicator sleeps between rounds when nothing wakes it."""
+        return self.node.heartbeat_interval
+
+    def run(self):
+        while self.active():
+            timeout = self.tick() - (time.time() - self.last_sent)
+            if timeout > 0:
+                self.wakeup.wait(timeout)
+            self.wakeup.clear()
+            if not self.active():
+                break
+
+            try:
+                if self.heartbeat_requested:
+                    self.send_heartbeat()
+                if self.replication_paused() or not self.fill_pipeline():
+                    if not self.inflight and time.time() - self.last_sent >= self.node.heartbeat_interval:
+                        self.send_heartbeat()
+            except RPC_ERRORS as e:
+                print(f"Connection to {self.peer} failed: {e}")
+                self.last_sent = self.retry_at = time.time()  # Retry on the next heartbeat tick
+            except RuntimeError:
+                break  # Stopped while submitting to the sender pool
+
+    def replication_paused(self):
+        """Honour the client's replication failure simulation, reporting each skipped batch once."""
+        node = self.node
+        if not node.simulate_replication_failure:
+            return False
+        if node.last_log_index() > self.skipped_index:
+            self.skipped_index = node.last_log_index()
+            print(f"Replication to {self.peer} skipped due to simulation.")
+        return True
+
+    def send_heartbeat(self):
+        self.heartbeat_requested = False
+        node = self.node
+        sent_at = self.last_sent = time.time()
+        if node.rpc(self.peer).receive_heartbeat(self.term, node.commit_index, node.match_index[self.peer], node.name):
+            self.acknowledged(sent_at)
+
+    def fill_pipeline(self):
+        """Send batches from next_index until the pipeline is full; returns True if anything was sent."""
+        node = self.node
+        sent = False
+        while self.active() and time.time() >= self.retry_at:
+            with node.lock:
+                if len(self.inflight) >= self.max_inflight or self.inflight_bytes >= self.max_inflight_bytes:
+                    break
+                next_index = node.next_index[self.peer]
+                if next_index > node.last_log_index():
+                    break
+                if next_index < node.log_start():
+                    if self.inflight:
+                        break  # Let outstanding batches drain before shipping the snapshot
+                    needs_snapshot = True
+                else:
+                    needs_snapshot = False
+                    prev_log_index = next_index - 1
+                    prev_log_term = node.term_at(prev_log_index)
+                    start = next_index - node.log_start()
+                    batch = node.log[start:start + self.max_batch_entries]  # A view, payloads are not copied
+                    entries_to_send = node.peer_connections.encode_entries(batch)
+                    size = batch.nbytes
+                    # Optimistically assume the batch lands; a rejection rolls this back
+                    node.next_index[self.peer] = next_index + len(batch)
+                    batch_id = self.next_batch_id
+                    self.next_batch_id += 1
+                    self.inflight[batch_id] = size
+                    self.inflight_bytes += size
+                    epoch = self.epoch
+                    leader_commit = node.commit_index
+
+            self.last_sent = time.time()
+            if needs_snapshot:
+                # The follower needs entries we compacted away: bring it up to the snapshot first
+                node.send_snapshot(self.peer, node.rpc(self.peer))
+                continue
+            self.senders.submit(self.send_batch, batch_id, epoch, prev_log_index, prev_log_term,
+                                entries_to_send, leader_commit)
+            sent = True
+        return sent
+
+    def send_batch(self, batch_id, epoch, prev_log_index, prev_log_term, entries_to_send, leader_commit):
+        """Send one AppendEntries batch on a sender thread and fold the reply into next/match_index."""
+        node = self.node
+        sent_at = time.time()
+        reply, success, failed = None, False, True
+        try:
+            reply = node.rpc(self.peer).receive_append_entries(
+                self.term, prev_log_index, prev_log_term, entries_to_send, leader_commit, node.name)
+            success, failed = reply["success"], False
+        except RPC_ERRORS:
+            pass  # Rolled back below, like a lost connection
+        finally:
+            with node.lock:
+                # Free the pipeline slot whatever the call raised, or the pipeline stays full for good
+                self.inflight_bytes -= self.inflight.pop(batch_id)
+
+        with node.lock:
+            if not self.active():
+                return
+            if reply and reply["term"] > node.current_term:
+                node.step_down(reply["term"])
+                print(f"{self.peer} is at term {reply['term']}; {node.name} stepped down.")
+                return
+            if reply:
+                self.acknowledged(sent_at)  # Even a log mismatch means the follower accepts our term
+            if success:
+                # Update matchIndex and nextIndex on success
+                last_index = prev_log_index + len(entries_to_send)
+                node.match_index[self.peer] = max(node.match_index[self.peer], last_index)
+                node.next_index[self.peer] = max(node.next_index[self.peer], node.match_index[self.peer] + 1)
+                with node.ack_cond:
+                    node.ack_cond.notify_all()  # A leadership transfer may be waiting for this follower to catch up
+                print(f"Successfully updated {self.peer} with {len(entries_to_send)} entries.")
+            elif epoch == self.epoch:
+                # Roll back everything sent after this batch and start a new epoch
+                self.epoch += 1
+                if failed:
+                    node.next_index[self.peer] = node.match_index[self.peer] + 1
+                    self.retry_at = time.time() + node.heartbeat_interval
+                    print(f"Connection to {self.peer} failed.")
+                else:
+                    # Backtrack nextIndex past the whole conflicting term and retry
+                    node.next_index[self.peer] = self.backtrack_index(reply, prev_log_index)
+                    print(f"Backtracking nextIndex for {self.peer} to {node.next_index[self.peer]} due to mismatch.")
+            else:
+                return  # A reply from before the last rollback; it no longer says anything useful
+
+        if success and self.peer in node.voters:
+            node.check_commit_index()
+        self.wakeup.set()  # Room in the pipeline, or more entries may be waiting
+
+    def backtrack_index(self, reply, prev_log_index):
+        """next_index to retry from after the follower rejected a batch at prev_log_index.
+
+        If the follower has no entry at prev_log_index we resume right after its last one.
+        Otherwise we resume after our own last entry from the follower's conflicting term,
+        or, if we have none, at the first index the follower holds for that term.
+        Called with node.lock held.
+        """
+        conflict_index = reply["conflict_index"]
+        if conflict_index is None:
+            return max(0, prev_log_index)  # No hint: step back one entry
+        if reply["conflict_term"] is not None:
+            last_index = self.node.last_index_of_term(reply["conflict_term"], prev_log_index)
+            if last_index is not None:
+                conflict_index = last_index + 1
+        return max(0, min(conflict_index, prev_log_index))
+
+
+class LearnerReplicator(PeerReplicator):
+    """Replicates to a learner at a lower priority than the voters' replicators.
+
+    Commits never wait for a learner, so it does not chase each append: notify() is
+    ignored and whatever has gathered goes out every `interval` seconds, one batch in
+    flight. A learner that is a full batch or more behind is sent batches back to back
+    until it catches up. Fewer, larger batches keep learners from competing with the
+    voters for the leader's lock and network.
+    """
+
+    def __init__(self, node, peer, term, interval=LEARNER_INTERVAL, **options):
+        options["max_inflight"] = 1
+        super().__init__(node, peer, term, **options)
+        self.interval = interval
+
+    def notify(self):
+        pass  # The next round picks the new entries up
+
+    def tick(self):
+        return min(self.node.heartbeat_interval, self.interval)
+
+    def fill_pipeline(self):
+        node = self.node
+        backlog = node.last_log_index() - node.next_index.get(self.peer, 0) + 1
+        if backlog < self.max_batch_entries and time.time() - self.last_sent < self.interval:
+            return False
+        return super().fill_pipeline()
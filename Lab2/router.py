@@ -0,0 +1,239 @@
+import argparse
+import logging
+import time
+import xmlrpc.client
+
+from kv import KV_OPS, WRONG_SHARD, encode_command, encode_range_command
+from multi_raft import CONFIG_FILE, load_groups
+from shard_map import SHARD_MAP_GROUP, SHARD_MAP_KEY, ShardMap, encode_shard_map_command
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+ROUTE_RETRIES = 50  # Attempts at a request before giving up on its group or shard
+ROUTE_RETRY_DELAY = 0.1  # Seconds to wait before retrying when nothing has changed yet
+
+
+def not_leader(reply):
+    """Whether a group refused a request because the member asked is not its leader."""
+    if isinstance(reply, dict):
+        return reply.get("error") == "NotLeader"
+    if isinstance(reply, list):
+        return any((result["error"] or "").startswith("No leader") for result in reply)
+    return False
+
+
+def leader_hint(reply):
+    """The leader a reply names, if any: read replies and submit_values results both carry one."""
+    if isinstance(reply, dict):
+        return reply.get("leader")
+    if isinstance(reply, list) and reply and isinstance(reply[0], dict):
+        return reply[0].get("leader")
+    return None
+
+
+def wrong_shard(result):
+    return isinstance(result, str) and result.startswith(WRONG_SHARD)
+
+
+class ShardRouter:
+    """Client-side router that sends each key's requests to the leader of the group serving it.
+
+    The router keeps a copy of the shard map (held by the SHARD_MAP_GROUP group) and each
+    group's last known leader, so a request normally costs one RPC. Replies name the
+    leader, which keeps that cache current; a NotLeader reply without a leader, or a failed
+    connection, drops the cached leader. A WrongShard reply, meaning the key's shard has
+    moved or is moving, reloads the shard map. Either way the request is retried.
+    """
+
+    def __init__(self, groups, nodes):
+        self.groups = groups  # group -> member names, SHARD_MAP_GROUP included
+        self.urls = {name: f"http://{ip}:{port}/" for name, (ip, port) in nodes.items()}
+        self.leaders = {}  # group -> member we last found leading it
+        self.map = None
+
+    def data_groups(self):
+        return [group for group in self.groups if group != SHARD_MAP_GROUP]
+
+    def find_leader(self, group):
+        for member in self.groups[group]:
+            try:
+                with xmlrpc.client.ServerProxy(self.urls[member], allow_none=True) as proxy:
+                    if getattr(proxy, f"{group}.is_leader")():
+                        logging.info(f"Leader of {group} found at {member}.")
+                        self.leaders[group] = member
+                        return member
+            except (OSError, xmlrpc.client.Fault) as e:
+                logging.warning(f"Failed to ask {member} about {group}: {e}")
+        return None
+
+    def group_call(self, group, method, *args):
+        """Call `method` on the leader of `group` and return its reply, finding the leader again when it moves."""
+        for _ in range(ROUTE_RETRIES):
+            leader = self.leaders.get(group) or self.find_leader(group)
+            if leader is None:
+                time.sleep(ROUTE_RETRY_DELAY)  # Probably mid-election
+                continue
+            try:
+                with xmlrpc.client.ServerProxy(self.urls[leader], allow_none=True) as proxy:
+                    reply = getattr(proxy, f"{group}.{method}")(*args)
+            except (OSError, xmlrpc.client.Fault) as e:
+                logging.warning(f"{method} on {group} at {leader} failed: {e}")
+                self.leaders.pop(group, None)
+                continue
+            hint = leader_hint(reply)
+            if hint in self.groups[group]:
+                self.leaders[group] = hint
+            if not_leader(reply):
+                if hint is None:
+                    self.leaders.pop(group, None)
+                continue
+            return reply
+        raise OSError(f"No leader of {group} answered {method} after {ROUTE_RETRIES} attempts.")
+
+    def commit(self, group, command):
+        """Commit one command in `group` and return its result."""
+        [result] = self.group_call(group, "submit_values", [command])
+        if not result["committed"]:
+            raise OSError(f"{group} did not commit {command!r}: {result['error']}")
+        return result["result"]
+
+    def shard_map(self, refresh=False):
+        if self.map is None or refresh:
+            reply = self.group_call(SHARD_MAP_GROUP, "read", SHARD_MAP_KEY)
+            if not reply["ok"]:
+                raise OSError(f"Could not read the shard map: {reply['error']}")
+            self.map = ShardMap.from_dict(reply["value"])
+        return self.map
+
+    def shard_moved(self):
+        """Reload the shard map after a WrongShard reply, pausing if the move has not reached the map yet."""
+        version = self.map.version
+        if self.shard_map(refresh=True).version == version:
+            time.sleep(ROUTE_RETRY_DELAY)
+
+    def submit(self, key, command):
+        """Commit `command` in the group serving `key`; returns its {index, committed, result, error}."""
+        for _ in range(ROUTE_RETRIES):
+            group = self.shard_map().locate(key)["group"]
+            [result] = self.group_call(group, "submit_values", [command])
+            if not wrong_shard(result["result"]):
+                return result
+            self.shard_moved()
+        raise OSError(f"Could not find the group serving {key!r} after {ROUTE_RETRIES} attempts.")
+
+    def put(self, key, value):
+        return self.submit(key, encode_command("put", key, value))
+
+    def delete(self, key):
+        return self.submit(key, encode_command("delete", key))
+
+    def cas(self, key, expected, value):
+        return self.submit(key, encode_command("cas", key, value, expected))
+
+    def get(self, key):
+        """Linearizable read of `key` from the leader of its group; returns a read reply like Node.read."""
+        for _ in range(ROUTE_RETRIES):
+            reply = self.group_call(self.shard_map().locate(key)["group"], "read", key)
+            if not wrong_shard(reply["error"]):
+                return reply
+            self.shard_moved()
+        raise OSError(f"Could not find the group serving {key!r} after {ROUTE_RETRIES} attempts.")
+
+    def init(self, shards):
+        """Create the shard map: `shards` equal ranges of the hash space dealt out to the data groups."""
+        result = self.commit(SHARD_MAP_GROUP, encode_shard_map_command("init", groups=self.data_groups(), shards=shards))
+        self.shard_map(refresh=True)
+        return result
+
+    def split(self, shard_id, at=None):
+        """Split a shard in two at hash position `at` (by default its middle); returns the new shard's id.
+
+        Both halves stay on the same group, so no keys move.
+        """
+        shard = self.shard_map(refresh=True).shard(shard_id)
+        at = (shard["lo"] + shard["hi"]) // 2 if at is None else at
+        result = self.commit(SHARD_MAP_GROUP, encode_shard_map_command("split", shard=shard_id, at=at))
+        self.shard_map(refresh=True)
+        return result
+
+    def move(self, shard_id, target):
+        """Move a shard's keys to the group `target` while every other shard keeps serving.
+
+        The source fences the shard's range, which refuses its keys from then on and hands
+        back their values in the same log entry. The target ingests them, and only then
+        does the shard map point at the target. Requests for the shard get WrongShard
+        while it moves, and routers retry them until the new map is committed. Last, the
+        source deletes its copy. Returns the number of keys moved.
+        Only one move should run at a time.
+        """
+        shard = self.shard_map(refresh=True).shard(shard_id)
+        source, lo, hi = shard["group"], shard["lo"], shard["hi"]
+        if target not in self.data_groups():
+            raise ValueError(f"Unknown group {target!r}; expected one of {', '.join(self.data_groups())}.")
+        if source == target:
+            return 0
+        values = self.commit(source, encode_range_command("fence", lo, hi))
+        try:
+            self.commit(target, encode_range_command("ingest", lo, hi, values))
+            moved = self.commit(SHARD_MAP_GROUP, encode_shard_map_command("move", shard=shard_id, source=source, target=target))
+        except OSError:
+            if self.shard_map(refresh=True).shard(shard_id)["group"] != target:
+                self.abort_move(source, target, lo, hi)
+                raise
+            moved = True  # The map moved the shard; we only missed the reply
+        if moved is not True:
+            self.abort_move(source, target, lo, hi)
+            raise OSError(f"Shard {shard_id} is no longer on {source}; the shard map changed during the move.")
+        self.commit(source, encode_range_command("drop", lo, hi))
+        self.shard_map(refresh=True)
+        logging.info(f"Moved shard {shard_id} [{lo}, {hi}) with {len(values)} keys from {source} to {target}.")
+        return len(values)
+
+    def abort_move(self, source, target, lo, hi):
+        """Undo a move the shard map never recorded: the target drops whatever it ingested and the source serves the range again."""
+        self.commit(target, encode_range_command("drop", lo, hi))
+        self.commit(source, encode_range_command("ingest", lo, hi))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Route key-value operations to the Raft group serving each key.")
+    parser.add_argument("--config", default=CONFIG_FILE, help="Config file mapping each group (cluster) to its members (default: Lab3's).")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("map", help="Show the shard map.")
+    init = commands.add_parser("init", help="Create the shard map, spreading its shards over the groups.")
+    init.add_argument("shards", type=int, help="Number of shards.")
+    split = commands.add_parser("split", help="Split a shard in two; both halves stay on its group.")
+    split.add_argument("shard", type=int, help="Id of the shard to split.")
+    split.add_argument("--at", type=int, help="Hash position the new shard starts at (default: the middle).")
+    move = commands.add_parser("move", help="Move a shard's keys to another group.")
+    move.add_argument("shard", type=int, help="Id of the shard to move.")
+    move.add_argument("group", help="Group to move it to.")
+    for op in KV_OPS:
+        command = commands.add_parser(op, help=f"Run a {op} on the group serving the key.")
+        command.add_argument("key")
+        if op == "cas":
+            command.add_argument("expected", help="Value the key must have; use '' for an absent key.")
+        if op in ("put", "cas"):
+            command.add_argument("value")
+    args = parser.parse_args()
+
+    router = ShardRouter(*load_groups(args.config))
+    if args.command == "map":
+        shard_map = router.shard_map()
+        logging.info(f"Shard map version {shard_map.version}:")
+        for shard in shard_map.shards:
+            logging.info(f"  shard {shard['id']}: [{shard['lo']}, {shard['hi']}) on {shard['group']}")
+    elif args.command == "init":
+        logging.info(f"init: {router.init(args.shards)}")
+    elif args.command == "split":
+        logging.info(f"Split off shard {router.split(args.shard, args.at)}.")
+    elif args.command == "move":
+        logging.info(f"Moved {router.move(args.shard, args.group)} keys.")
+    elif args.command == "get":
+        logging.info(f"get {args.key!r}: {router.get(args.key)}")
+    elif args.command == "put":
+        logging.info(f"put {args.key!r}: {router.put(args.key, args.value)}")
+    elif args.command == "delete":
+        logging.info(f"delete {args.key!r}: {router.delete(args.key)}")
+    else:
+        logging.info(f"cas {args.key!r}: {router.cas(args.key, args.expected or None, args.value)}")
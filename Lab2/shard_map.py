@@ -0,0 +1,118 @@
+import bisect
+import json
+
+from kv import HASH_SPACE, key_hash
+from state_machine import StateMachine
+
+
+SHARD_MAP_GROUP = "shards"  # The Raft group that holds the shard map
+SHARD_MAP_KEY = "map"  # Reading this key from the shard map group returns the whole map
+SHARD_MAP_OPS = ("init", "split", "move")
+
+
+def encode_shard_map_command(op, **fields):
+    """Build the log command for one shard map change (see ShardMapStateMachine)."""
+    if op not in SHARD_MAP_OPS:
+        raise ValueError(f"Unknown shard map operation {op!r}; expected one of {', '.join(SHARD_MAP_OPS)}.")
+    return json.dumps(dict(op=op, **fields), separators=(",", ":"))
+
+
+class ShardMap:
+    """Which Raft group serves each key: the hash space cut into ranges, one group per range.
+
+    `shards` is sorted by `lo` and covers [0, HASH_SPACE) without gaps. `version` goes up
+    with every change, so a router can tell whether its copy is out of date.
+    """
+
+    def __init__(self, shards=(), version=0):
+        self.shards = sorted((dict(shard) for shard in shards), key=lambda shard: shard["lo"])
+        self.version = version
+        self.starts = [shard["lo"] for shard in self.shards]
+
+    def locate(self, key):
+        """The shard {id, lo, hi, group} that `key` hashes into."""
+        if not self.shards:
+            raise LookupError("The shard map is empty; run the router's init command first.")
+        return self.shards[bisect.bisect_right(self.starts, key_hash(key)) - 1]
+
+    def shard(self, shard_id):
+        for shard in self.shards:
+            if shard["id"] == shard_id:
+                return shard
+        raise LookupError(f"No shard {shard_id} in shard map version {self.version}.")
+
+    def to_dict(self):
+        return {"version": self.version, "shards": [dict(shard) for shard in self.shards]}
+
+    @staticmethod
+    def from_dict(state):
+        return ShardMap(state["shards"], state["version"])
+
+
+class ShardMapStateMachine(StateMachine):
+    """Replicated shard map for the metadata group; committed changes are applied in log order.
+
+    Commands are JSON objects made by encode_shard_map_command():
+      {"op": "init", "groups": [g, ...], "shards": n}
+                                 -> True; n ranges of equal size, dealt out to the groups in turn
+      {"op": "split", "shard": id, "at": h}
+                                 -> the new shard's id; it takes [h, hi) and stays on the same group
+      {"op": "move", "shard": id, "source": g1, "target": g2}
+                                 -> whether the shard was on g1 and is now on g2
+    Failed changes return an "Error: ..." string and leave the map as it was.
+    """
+
+    def __init__(self):
+        self.map = ShardMap()
+
+    def apply(self, entry):
+        request = json.loads(entry.command)
+        op = request["op"]
+        try:
+            if op == "init":
+                return self.init(request["groups"], request["shards"])
+            if op == "split":
+                return self.split(request["shard"], request["at"])
+            if op == "move":
+                return self.move(request["shard"], request["source"], request["target"])
+        except KeyError:
+            raise  # A missing field is a malformed command, not an unknown shard
+        except LookupError as e:
+            return f"Error: {e}"
+        return f"Error: unknown shard map operation {op!r}."
+
+    def init(self, groups, count):
+        if self.map.shards:
+            return f"Error: the shard map is already initialised (version {self.map.version})."
+        if not groups or count < 1:
+            return "Error: init needs at least one group and one shard."
+        bounds = [HASH_SPACE * i // count for i in range(count + 1)]
+        shards = [{"id": i, "lo": bounds[i], "hi": bounds[i + 1], "group": groups[i % len(groups)]} for i in range(count)]
+        self.map = ShardMap(shards, self.map.version + 1)
+        return True
+
+    def split(self, shard_id, at):
+        shard = self.map.shard(shard_id)
+        if not shard["lo"] < at < shard["hi"]:
+            return f"Error: {at} is not inside shard {shard_id} [{shard['lo']}, {shard['hi']})."
+        new_id = max(other["id"] for other in self.map.shards) + 1
+        shards = [dict(other, hi=at) if other["id"] == shard_id else other for other in self.map.shards]
+        shards.append({"id": new_id, "lo": at, "hi": shard["hi"], "group": shard["group"]})
+        self.map = ShardMap(shards, self.map.version + 1)
+        return new_id
+
+    def move(self, shard_id, source, target):
+        if self.map.shard(shard_id)["group"] != source:
+            return False
+        shards = [dict(other, group=target) if other["id"] == shard_id else other for other in self.map.shards]
+        self.map = ShardMap(shards, self.map.version + 1)
+        return True
+
+    def snapshot(self):
+        return self.map.to_dict()
+
+    def restore(self, state):
+        self.map = ShardMap.from_dict(state) if state else ShardMap()
+
+    def query(self, key):
+        return self.map.to_dict() if key == SHARD_MAP_KEY else None
@@ -0,0 +1,44 @@
+import json
+import os
+
+
+class SnapshotStore:
+    """Persist the latest state machine snapshot for a node in a single JSON file.
+
+    A snapshot records the applied state together with the index and term of the last
+    log entry it covers (`last_included_index` / `last_included_term`). Writes go to a
+    temporary file that is fsynced and renamed over the old snapshot, so a crash never
+    leaves a half-written snapshot behind.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+
+    def save(self, last_included_index, last_included_term, state, config=None):
+        """Atomically replace the stored snapshot; `config` is the cluster configuration as of its last entry."""
+        snapshot = {
+            "last_included_index": last_included_index,
+            "last_included_term": last_included_term,
+            "state": state,
+        }
+        if config is not None:
+            snapshot["config"] = config
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(snapshot, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        return snapshot
+
+    def load(self):
+        """Return the stored snapshot as a dict, or None if there is none."""
+        try:
+            with open(self.path, "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except json.JSONDecodeError:
+            print(f"Snapshot {self.path} is unreadable, ignoring it.")
+            return None
@@ -0,0 +1,96 @@
+import threading
+
+
+class StateMachine:
+    """Interface for the state machine that committed Raft log entries are applied to.
+
+    `apply` is called exactly once per committed entry, in log order, from the node's
+    applier thread. Its return value is handed back to the client that submitted the entry.
+    """
+
+    # Whether applied effects survive a restart on their own. A durable state machine
+    # resumes from the persisted last_applied cursor; any other one is rebuilt from the
+    # latest snapshot plus the log after it.
+    durable = False
+
+    def apply(self, entry):
+        """Apply a committed LogEntry and return its result.
+
+        Raise ValueError, KeyError or TypeError for a command that cannot be parsed.
+        """
+        raise NotImplementedError
+
+    def apply_batch(self, entries):
+        """Apply consecutive committed entries and return their results, in order."""
+        results = []
+        for entry in entries:
+            try:
+                results.append(self.apply(entry))
+            except (ValueError, KeyError, TypeError) as e:
+                # A bad command must not stop the applier; it just fails for its submitter
+                results.append(f"Error: malformed command {entry.command!r}: {e}")
+        return results
+
+    def snapshot(self):
+        """Return the applied state as a JSON-serialisable object."""
+        return {}
+
+    def restore(self, state):
+        """Replace the applied state with one previously returned by snapshot()."""
+        pass
+
+    def query(self, key):
+        """Return the applied value of `key` for Node.read(), or None if it has none.
+
+        Raise LookupError if `key` is not served by this state machine at all.
+        """
+        return None
+
+
+class LoggingStateMachine(StateMachine):
+    """Default state machine: committed commands are logged and echoed back as the result.
+
+    Commands of the form "key=value" also record the latest value of each key, so
+    they can be read back with Node.read().
+    """
+
+    def __init__(self):
+        self.values = {}
+
+    def apply(self, entry):
+        key, sep, value = entry.command.partition("=")
+        if sep:
+            self.values[key] = value
+        return entry.command
+
+    def snapshot(self):
+        return dict(self.values)
+
+    def restore(self, state):
+        self.values = dict(state)
+
+    def query(self, key):
+        return self.values.get(key)
+
+
+class ApplyFuture:
+    """Completed by the applier once the entry at `index` has been applied (or lost)."""
+
+    def __init__(self, index, term):
+        self.index = index
+        self.term = term
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+    def set_result(self, result):
+        self.result = result
+        self.done.set()
+
+    def set_error(self, error):
+        self.error = error
+        self.done.set()
+
+    def wait(self, timeout=None):
+        """Block until the entry is applied; returns False if `timeout` expires first."""
+        return self.done.wait(timeout)
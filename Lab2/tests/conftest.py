@@ -0,0 +1,29 @@
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import node as raft
+
+
+@pytest.fixture
+def cluster(tmp_path, monkeypatch):
+    """Start real Nodes on localhost: cluster(base_port, count=3, **node_options) returns {name: Node}."""
+    started = []
+
+    def start(base_port, count=3, **node_options):
+        monkeypatch.setattr(raft, "NODES", {f"node{i + 1}": ("127.0.0.1", base_port + i) for i in range(count)})
+        nodes = {}
+        for name in raft.NODES:
+            member = nodes[name] = raft.Node(name, log_dir=str(tmp_path), **node_options)
+            started.append(member)
+            for target in (member.run_server, member.run_election, member.run_applier):
+                threading.Thread(target=target, daemon=True).start()
+        return nodes
+
+    yield start
+    for member in started:
+        member.stop()
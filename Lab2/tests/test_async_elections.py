@@ -0,0 +1,37 @@
+import asyncio
+import time
+
+from async_node import AsyncRaftHost
+
+
+def test_timeout_now_replaces_a_running_election(tmp_path):
+    nodes = {f"node{i + 1}": ("127.0.0.1", 23200 + i) for i in range(3)}
+
+    async def scenario():
+        hosts = [AsyncRaftHost(name, nodes) for name in nodes]
+        try:
+            for host in hosts:
+                host.add_group("default", log_dir=str(tmp_path), pre_vote=True)
+                await host.start(clients=False)
+            members = [host.groups["default"] for host in hosts]
+            deadline = time.time() + 20
+            while not any(member.is_leader_flag for member in members):
+                assert time.time() < deadline
+                await asyncio.sleep(0.05)
+            leader = next(member for member in members if member.is_leader_flag)
+            follower = next(member for member in members if member is not leader)
+            term = follower.current_term
+
+            timed_out = follower.begin_election()  # As if the timer fired; its pre-vote is bound to fail
+            assert follower.begin_election() is timed_out
+            assert follower.timeout_now(term, leader.name)
+            assert follower.election is not timed_out
+            await asyncio.wait([timed_out])
+            assert timed_out.cancelled()
+            await follower.election
+            assert follower.is_leader_flag and follower.current_term == term + 1
+        finally:
+            for host in hosts:
+                await host.close()
+
+    asyncio.run(scenario())
@@ -0,0 +1,14 @@
+import time
+
+import node as raft
+from benchmark import LocalCluster
+
+
+def test_restarted_node_grants_no_votes_within_the_old_leaders_lease():
+    with LocalCluster() as cluster:
+        booted = cluster.nodes["node2"]
+        assert not booted.pre_vote("node3", 1, 0, -1)
+        assert not booted.vote("node3", 1, 0, -1)
+        booted.last_leader_contact = time.time() - raft.ELECTION_TIMEOUT_MIN  # As if it booted that long ago
+        assert booted.pre_vote("node3", 1, 0, -1)
+        assert booted.vote("node3", 1, 0, -1)
@@ -0,0 +1,31 @@
+import time
+import xmlrpc.client
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmark import wait_for
+
+
+def test_read_your_writes_on_a_follower_do_not_stall_replication(cluster):
+    # More waiting reads than bulk workers: the write they wait for must still reach the follower
+    nodes = cluster(23100, bulk_workers=2)
+    wait_for(lambda: any(member.is_leader_flag for member in nodes.values()), timeout=20)
+    leader = next(member for member in nodes.values() if member.is_leader_flag)
+    follower = next(member for member in nodes.values() if member is not leader)
+    wait_for(lambda: follower.last_applied >= leader.noop_index)
+    index = leader.last_log_index() + 1
+
+    def read(_):
+        start = time.time()
+        with xmlrpc.client.ServerProxy(f"http://127.0.0.1:{follower.port}/", allow_none=True) as proxy:
+            reply = proxy.read_local("key", index)
+        return reply, time.time() - start
+
+    with ThreadPoolExecutor(4) as readers:
+        reads = [readers.submit(read, slot) for slot in range(4)]
+        time.sleep(0.2)
+        [written] = leader.submit_values(["key=value"])
+        assert written["committed"] and written["index"] == index
+        for future in reads:
+            reply, seconds = future.result()
+            assert reply["ok"] and reply["value"] == "value"
+            assert seconds < 2.0
@@ -0,0 +1,11 @@
+import node as raft
+from benchmark import run_soak
+
+
+def test_a_lagging_follower_causes_no_elections_with_pre_vote_and_check_quorum():
+    # One lag spell well past the election timeout, then time to recover from it
+    elections, leaders, failed, _ = run_soak(True, duration=14.0, lag=raft.ELECTION_TIMEOUT_MAX + 1, lag_every=14.0, lag_for=8.0,
+                                             interval=0.05, rtt=0.001)
+    assert elections == 0
+    assert len(leaders) == 1
+    assert failed == 0
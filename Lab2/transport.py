@@ -0,0 +1,154 @@
+import http.client
+import threading
+import time
+import xmlrpc.client
+
+
+# Everything a call to a peer can raise when the peer is down, slow or answers with an error.
+# Callers treat them all alike: the call failed and is retried later.
+RPC_ERRORS = (OSError, xmlrpc.client.Error, http.client.HTTPException)
+
+
+class ReconnectBackoff:
+    """Exponential backoff after connection failures to a single peer.
+
+    While a peer is backing off, requests fail immediately with ConnectionRefusedError
+    instead of paying for another connect timeout.
+    """
+
+    def __init__(self, initial=0.05, maximum=1.0):
+        self.initial = initial
+        self.maximum = maximum
+        self.delay = 0.0
+        self.retry_at = 0.0
+        self.lock = threading.Lock()
+
+    def check(self, peer):
+        if time.time() < self.retry_at:
+            raise ConnectionRefusedError(f"Backing off from {peer} for another {self.retry_at - time.time():.2f}s.")
+
+    def failed(self):
+        with self.lock:
+            self.delay = min(self.maximum, self.delay * 2 if self.delay else self.initial)
+            self.retry_at = time.time() + self.delay
+
+    def succeeded(self):
+        with self.lock:
+            self.delay = 0.0
+            self.retry_at = 0.0
+
+
+class PooledTransport(xmlrpc.client.Transport):
+    """XML-RPC transport that keeps up to `pool_size` persistent HTTP/1.1 connections to one peer.
+
+    Unlike the stock Transport, which caches a single connection and is not thread safe,
+    each request checks a connection out of the pool for its duration, so one transport
+    can be shared by every thread talking to the peer.
+    """
+
+    def __init__(self, peer, pool_size=4, timeout=2.0, backoff=0.05, max_backoff=1.0):
+        super().__init__()
+        self.peer = peer
+        self.timeout = timeout
+        self.idle = []  # Idle connections, most recently used last
+        self.idle_lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(pool_size)
+        self.backoff = ReconnectBackoff(backoff, max_backoff)
+        self.local = threading.local()
+
+    def make_connection(self, host):
+        # Called from send_request(): hand out the connection checked out for this request.
+        return self.local.connection
+
+    def request(self, host, handler, request_body, verbose=False):
+        self.backoff.check(self.peer)
+        if not self.slots.acquire(timeout=self.timeout):
+            raise TimeoutError(f"No free connection to {self.peer} within {self.timeout}s.")
+        try:
+            # Retry once on a fresh connection if a pooled one had gone cold
+            for attempt in (0, 1):
+                connection, reused = self.checkout(host)
+                self.local.connection = connection
+                try:
+                    response = self.send_request(host, handler, request_body, verbose).getresponse()
+                    if response.status != 200:
+                        response.read()
+                        raise xmlrpc.client.ProtocolError(host + handler, response.status, response.reason, dict(response.getheaders()))
+                    self.verbose = verbose
+                    result = self.parse_response(response)
+                except xmlrpc.client.Fault:
+                    self.checkin(connection)
+                    raise
+                except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                    connection.close()
+                    if reused and attempt == 0:
+                        continue
+                    self.backoff.failed()
+                    raise
+                except OSError:
+                    connection.close()
+                    self.backoff.failed()
+                    raise
+                except Exception:
+                    connection.close()
+                    raise
+                self.backoff.succeeded()
+                self.checkin(connection)
+                return result
+        finally:
+            self.local.connection = None
+            self.slots.release()
+
+    def checkout(self, host):
+        """Return (connection, reused) using an idle pooled connection when there is one."""
+        with self.idle_lock:
+            if self.idle:
+                return self.idle.pop(), True
+        chost, self._extra_headers, _ = self.get_host_info(host)
+        return http.client.HTTPConnection(chost, timeout=self.timeout), False
+
+    def checkin(self, connection):
+        with self.idle_lock:
+            self.idle.append(connection)
+
+    def close(self):
+        with self.idle_lock:
+            idle, self.idle = self.idle, []
+        for connection in idle:
+            connection.close()
+
+
+class PeerConnections:
+    """Shared XML-RPC proxies for every peer of a node, one pooled keep-alive transport per peer."""
+
+    def __init__(self, peers, pool_size=4, timeout=2.0, backoff=0.05, max_backoff=1.0):
+        self.options = {"pool_size": pool_size, "timeout": timeout, "backoff": backoff, "max_backoff": max_backoff}
+        self.proxies = {}
+        for peer, address in peers.items():
+            self.add_peer(peer, address)
+
+    def add_peer(self, peer, address):
+        """Start talking to a peer that joined the cluster."""
+        ip, port = address
+        transport = PooledTransport(peer, **self.options)
+        self.proxies[peer] = xmlrpc.client.ServerProxy(f"http://{ip}:{port}/", transport=transport, allow_none=True)
+
+    def remove_peer(self, peer):
+        """Close the connections to a peer that left the cluster."""
+        proxy = self.proxies.pop(peer, None)
+        if proxy is not None:
+            proxy("close")()
+
+    def proxy(self, peer):
+        try:
+            return self.proxies[peer]
+        except KeyError:
+            raise ConnectionRefusedError(f"{peer} is not a member of the cluster.") from None
+
+    def encode_entries(self, batch):
+        """Marshal a LogSlice for AppendEntries as the "term,command" strings XML-RPC carries."""
+        return [entry.to_string() for entry in batch]
+
+    def close(self):
+        for proxy in self.proxies.values():
+            proxy("close")()
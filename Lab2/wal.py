@@ -0,0 +1,315 @@
+import os
+import struct
+import threading
+import time
+import zlib
+from array import array
+
+
+# Each record is a fixed header followed by the UTF-8 encoded command:
+#   payload length (uint32), crc32 of term + payload (uint32), term (int64)
+RECORD_HEADER = struct.Struct("<IIq")
+TERM_STRUCT = struct.Struct("<q")
+
+SEGMENT_SUFFIX = ".wal"
+INDEX_SUFFIX = ".idx"  # Sidecar file with one uint64 byte offset per record in the segment
+FSYNC_POLICIES = ("batch", "interval", "never")
+
+
+def encode_record(term, command):
+    """Encode a single (term, command) pair as a length-prefixed, checksummed record."""
+    payload = command.encode("utf-8") if isinstance(command, str) else bytes(command)
+    crc = zlib.crc32(payload, zlib.crc32(TERM_STRUCT.pack(term)))
+    return RECORD_HEADER.pack(len(payload), crc, term) + payload
+
+
+def decode_records(data, offset=0):
+    """Yield (offset, term, payload) for every intact record in `data` starting at `offset`.
+
+    Decoding stops at the first torn or corrupt record, which is what a crash in the
+    middle of a write leaves behind at the tail of the active segment.
+    """
+    end = len(data)
+    while offset + RECORD_HEADER.size <= end:
+        length, crc, term = RECORD_HEADER.unpack_from(data, offset)
+        start = offset + RECORD_HEADER.size
+        if start + length > end:
+            return
+        payload = bytes(data[start:start + length])
+        if zlib.crc32(payload, zlib.crc32(TERM_STRUCT.pack(term))) != crc:
+            return
+        yield offset, term, payload
+        offset = start + length
+
+
+class Segment:
+    """One WAL segment file holding consecutive log entries starting at `first_index`."""
+
+    def __init__(self, directory, first_index):
+        self.first_index = first_index
+        self.path = os.path.join(directory, f"{first_index:020d}{SEGMENT_SUFFIX}")
+        self.index_path = os.path.join(directory, f"{first_index:020d}{INDEX_SUFFIX}")
+        self.offsets = array("Q")  # Byte offset of every record, indexed by position in the segment
+        self.size = 0  # Size in bytes of the intact records
+
+    @property
+    def count(self):
+        return len(self.offsets)
+
+    @property
+    def next_index(self):
+        return self.first_index + self.count
+
+    def load_index(self):
+        """Read the persisted offset index, returning an empty array if it is missing."""
+        offsets = array("Q")
+        try:
+            with open(self.index_path, "rb") as f:
+                data = f.read()
+            offsets.frombytes(data[:len(data) - len(data) % offsets.itemsize])
+        except FileNotFoundError:
+            pass
+        return offsets
+
+    def write_index(self):
+        """Rewrite the offset index file from the in-memory offsets."""
+        with open(self.index_path, "wb") as f:
+            self.offsets.tofile(f)
+
+    def remove(self):
+        for path in (self.path, self.index_path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+class SegmentedWAL:
+    """Segmented, length-prefixed binary write-ahead log with a CRC per record.
+
+    Entries are addressed by their 0-based log index. A batch of entries is always
+    written with a single write() call into the active segment, and a new segment is
+    started once the active one grows past `segment_size` bytes. Truncation drops
+    whole segments and cuts at most one segment in place. After a snapshot the WAL may
+    start at a non-zero index; compaction only ever removes whole sealed segments.
+
+    With the "interval" policy, writes are synced at most `fsync_interval` seconds after
+    they are made: by the next append once the interval has passed, or by a timer if the
+    log goes idle first.
+    """
+
+    def __init__(self, directory, segment_size=4 * 1024 * 1024, fsync_policy="batch", fsync_interval=1.0):
+        if fsync_policy not in FSYNC_POLICIES:
+            raise ValueError(f"Unknown fsync policy {fsync_policy!r}, expected one of {FSYNC_POLICIES}.")
+        self.directory = directory
+        self.segment_size = segment_size
+        self.fsync_policy = fsync_policy
+        self.fsync_interval = fsync_interval
+        self.last_sync_time = time.time()
+        self.sync_timer = None  # Pending timer that syncs unsynced writes under the "interval" policy
+        self.file_lock = threading.RLock()  # The sync timer uses the active files from its own thread
+        self.segments = []
+        self.active_file = None
+        self.active_index_file = None
+        os.makedirs(self.directory, exist_ok=True)
+
+    def load(self):
+        """Open the WAL and return every intact entry as a list of (term, command) tuples.
+
+        The first returned entry has log index `first_index()`.
+        """
+        self.close()
+        entries = []
+        first_indexes = sorted(
+            int(name[:-len(SEGMENT_SUFFIX)])
+            for name in os.listdir(self.directory)
+            if name.endswith(SEGMENT_SUFFIX)
+        )
+        self.segments = []
+        for first_index in first_indexes:
+            segment = Segment(self.directory, first_index)
+            if self.segments and segment.first_index != self.segments[-1].next_index:
+                # A gap means everything from here on is unreachable; drop it.
+                print(f"WAL: discarding segment {segment.path}, expected index {self.segments[-1].next_index}.")
+                segment.remove()
+                continue
+            with open(segment.path, "rb") as f:
+                data = f.read()
+            persisted_offsets = segment.load_index()
+            entries.extend(self._read_records(segment, data, 0))
+            if segment.size < len(data):
+                # Torn write at the tail of the segment: cut it off.
+                print(f"WAL: truncating torn tail of {segment.path} at byte {segment.size}.")
+                with open(segment.path, "r+b") as f:
+                    f.truncate(segment.size)
+            if persisted_offsets != segment.offsets:
+                segment.write_index()  # Missing or stale after a crash; rebuild it from the scan
+            self.segments.append(segment)
+
+        if not self.segments:
+            self.segments.append(Segment(self.directory, 0))
+        self._open_active()
+        return entries
+
+    def first_index(self):
+        """Return the index of the oldest entry still held by the WAL."""
+        return self.segments[0].first_index
+
+    def next_index(self):
+        """Return the index the next appended entry will receive."""
+        return self.segments[-1].next_index
+
+    def append(self, entries):
+        """Append a batch of (term, command) entries with a single write to the active segment."""
+        if not entries:
+            return
+        if self.segments[-1].size >= self.segment_size:
+            self._roll()
+        segment = self.segments[-1]
+        records = [encode_record(term, command) for term, command in entries]
+        new_offsets = array("Q")
+        offset = segment.size
+        for record in records:
+            new_offsets.append(offset)
+            offset += len(record)
+        self.active_file.write(b"".join(records))
+        self.active_file.flush()
+        new_offsets.tofile(self.active_index_file)
+        self.active_index_file.flush()
+        segment.offsets.extend(new_offsets)
+        segment.size = offset
+        self._maybe_sync()
+
+    def poll_tail(self):
+        """Pick up entries appended to the WAL by another writer since we last looked.
+
+        Only the bytes past the known end of the active segment (and any segments that
+        appeared after it) are read. Returns the new (term, command) entries, or None if
+        the WAL was truncated or removed underneath us and has to be reloaded.
+        """
+        entries = []
+        while True:
+            segment = self.segments[-1]
+            try:
+                size = os.path.getsize(segment.path)
+            except FileNotFoundError:
+                return None
+            if size < segment.size:
+                return None
+            if size > segment.size:
+                with open(segment.path, "rb") as f:
+                    f.seek(segment.size)
+                    data = f.read()
+                entries.extend(self._read_records(segment, data, segment.size))
+                if self._index_size(segment) != segment.count * segment.offsets.itemsize:
+                    segment.write_index()  # The other writer did not maintain the index
+            following = Segment(self.directory, segment.next_index)
+            if segment.count == 0 or not os.path.exists(following.path):
+                return entries
+            self.close()
+            self.segments.append(following)
+            self._open_active()
+
+    def truncate(self, index):
+        """Remove every entry with a log index >= `index`."""
+        if index >= self.next_index():
+            return
+        if index <= self.first_index():
+            self.reset(index)
+            return
+        self.close()
+        # Drop whole segments that start at or after the truncation point.
+        while len(self.segments) > 1 and self.segments[-1].first_index >= index:
+            self.segments.pop().remove()
+
+        # The offset index gives the cut point inside the last remaining segment directly.
+        segment = self.segments[-1]
+        keep = max(index - segment.first_index, 0)
+        segment.size = segment.offsets[keep] if keep < segment.count else segment.size
+        del segment.offsets[keep:]
+        with open(segment.path, "ab") as f:
+            f.truncate(segment.size)
+            os.fsync(f.fileno())
+        segment.write_index()
+        self._open_active()
+
+    def compact(self, index):
+        """Remove sealed segments whose entries all lie below `index` (e.g. covered by a snapshot)."""
+        removed = 0
+        while len(self.segments) > 1 and self.segments[0].next_index <= index:
+            self.segments.pop(0).remove()
+            removed += 1
+        return removed
+
+    def reset(self, start_index=0):
+        """Delete every segment and start again with an empty log whose next index is `start_index`."""
+        self.close()
+        for segment in self.segments:
+            segment.remove()
+        self.segments = [Segment(self.directory, start_index)]
+        self._open_active()
+
+    def sync(self):
+        """Force buffered writes of the active segment to stable storage."""
+        with self.file_lock:
+            if self.sync_timer is not None:
+                self.sync_timer.cancel()
+                self.sync_timer = None
+            if self.active_file:
+                self.active_file.flush()
+                os.fsync(self.active_file.fileno())
+                self.active_index_file.flush()
+                os.fsync(self.active_index_file.fileno())
+            self.last_sync_time = time.time()
+
+    def close(self):
+        with self.file_lock:
+            if self.active_file:
+                self.sync()
+                self.active_file.close()
+                self.active_index_file.close()
+                self.active_file = None
+                self.active_index_file = None
+
+    def _maybe_sync(self):
+        if self.fsync_policy == "batch":
+            self.sync()
+        elif self.fsync_policy == "interval":
+            if time.time() - self.last_sync_time >= self.fsync_interval:
+                self.sync()
+            elif self.sync_timer is None:
+                # No later append may come to sync this one; make sure it is synced once the interval is up
+                self.sync_timer = threading.Timer(self.last_sync_time + self.fsync_interval - time.time(), self._sync_due)
+                self.sync_timer.daemon = True
+                self.sync_timer.start()
+
+    def _sync_due(self):
+        with self.file_lock:
+            if self.sync_timer is threading.current_thread():  # Not cancelled by a sync while we waited
+                self.sync()
+
+    def _roll(self):
+        """Seal the active segment and start a new one at the next index."""
+        self.close()
+        self.segments.append(Segment(self.directory, self.next_index()))
+        self._open_active()
+
+    def _open_active(self):
+        with self.file_lock:
+            self.active_file = open(self.segments[-1].path, "ab")
+            self.active_index_file = open(self.segments[-1].index_path, "ab")
+
+    def _index_size(self, segment):
+        try:
+            return os.path.getsize(segment.index_path)
+        except FileNotFoundError:
+            return 0
+
+    def _read_records(self, segment, data, base_offset):
+        """Decode records from `data` (which starts at `base_offset` in the segment file) into `segment`."""
+        entries = []
+        for offset, term, payload in decode_records(data):
+            entries.append((term, payload.decode("utf-8")))
+            segment.offsets.append(base_offset + offset)
+            segment.size = base_offset + offset + RECORD_HEADER.size + len(payload)
+        return entries